@@ -7,11 +7,40 @@ This is an initialization script for services available in this package
 """
 
 # Importing necessary modules and functions to be used by modules using this package
-from .engine import create_new_engine, get_engine, initialize_global_engine
+from .engine import create_new_engine, create_new_async_engine, get_engine, initialize_global_engine, \
+    warm_up_pool, pool_statistics, probe_database, Replica, ReplicaSet, READ_REPLICAS, initialize_read_replicas, \
+    get_read_engine, read_latest_timestamp, primary_engine
 from .read_operations import read_rows, read_rows_multiple, current_parameters_to_dictionary, \
-    total_energy_to_dictionary, date_wise_parameters_to_dictionary
+    total_energy_to_dictionary, date_wise_parameters_to_dictionary, initialize_query_concurrency, stream_rows, \
+    date_wise_batch_to_json_line, initialize_read_routing, history_engine, reading_record_type, row_to_record
+from .async_read_operations import read_rows_async, read_rows_multiple_async, stream_rows_async, \
+    run_in_transaction_async
+from .single_flight import SingleFlight, SINGLE_FLIGHT, initialize_single_flight, query_key
+from .device_registry import Device, DeviceRegistry, initialize_devices, get_device, all_devices
+from .latest_reading_cache import LatestReadingCache, LATEST_READING_CACHE, initialize_latest_reading_cache, \
+    latest_reading_cache
+from .reading_broadcaster import LIVE_TRANSPORTS, Subscription, ReadingBroadcaster, READING_BROADCASTER
+from .downsampling import DOWNSAMPLING_METHODS, downsample_rows, downsample_columns, lttb, min_max_average
+from .downsampling import columns_to_pairs, grid_averages, rows_to_arrays
+from .series_formats import SERIES_FORMATS, BINARY_SERIES_MEDIA_TYPE, date_wise_parameters_to_columns, \
+    columns_to_dictionary, encode_binary_series, rollup_columns, records_to_source_columns, source_columns_to_series
+from .rollups import RollupMaterializer, ROLLUP_MATERIALIZER, initialize_rollups, rollup_level_for_resolution, \
+    statement_for_rollup_query, statement_for_rollup_date, rollup_level_for_date
+from .table_models import ENERGY_PARAMETER_COLUMNS, ENERGY_LMEASURE_TABLE, ROLLUP_LEVELS, energy_column, \
+    energy_table, reflect_tables, ordered_parameters
+from .energy_today import DayEnergyBaseline, DAY_ENERGY_BASELINE, initialize_plant_timezone, plant_today, \
+    total_energy_today, day_energy_baseline, is_closed_day, plant_time_to_utc, initialize_closed_day_grace
 from .query_statements import LATEST_ALL_PARAMETER_QUERY, TOTAL_ENERGY_CONSUMED_TODAY_QUERY, \
-    statement_for_date_query
+    statement_for_date_query, statement_for_start_of_day_energy, statement_for_rows_after_id, \
+    statement_for_range_query, statement_for_latest_reading, statement_for_date_series, \
+    statement_for_date_series_batch
+from .sql_functions import epoch_milliseconds
+from .pagination import encode_cursor, decode_cursor, range_page_to_dictionary
+from .history_mirror import HistoryMirror, HISTORY_MIRROR, initialize_history_mirror, create_mirror_engine
+from .day_series_cache import DaySeriesCache, DAY_SERIES_CACHE, initialize_day_series_cache, read_day_series, \
+    read_day_series_batch
+from .day_statistics import STATISTICS_PERCENTILES, series_statistics, read_day_statistics
+from .plant import fan_out, plant_current_values, plant_total_energy_today, plant_parameter_series
 
 
 USER_DB = {
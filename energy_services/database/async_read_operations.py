@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Module to perform Async Read operation
+========================================
+
+Module for reading records from the database without blocking the event loop of the fastapi application
+
+This script requires the following modules be installed in the python environment
+    * logging - to perform logging operations
+    * sqlalchemy - Package used to connect to a database and do SQL operations (asyncio extension)
+
+This script contains the following function
+    * read_rows_async - awaitable equivalent of read_rows
+    * read_rows_multiple_async - awaitable equivalent of read_rows_multiple
+    * stream_rows_async - async generator equivalent of stream_rows
+    * query_semaphore - the semaphore bounding the statements run in parallel by the process
+    * run_in_transaction_async - to run a function taking a (sync) connection inside a transaction
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import time
+from typing import Union
+
+# External Imports
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# User Imports
+from ..utils import metrics
+from . import read_operations
+from .read_operations import executable, fetch_records, read_rows, read_rows_multiple, stream_rows, STREAM_BATCH_SIZE
+from .single_flight import SINGLE_FLIGHT, query_key
+
+LOGGER = logging.getLogger(__name__)
+
+# The semaphore of query_semaphore, with the event loop it is bound to and the number of statements it allows
+_QUERY_SEMAPHORE = None
+_QUERY_SEMAPHORE_LOOP = None
+_QUERY_SEMAPHORE_SIZE = None
+
+
+async def read_rows_async(engine: Union[Engine, AsyncEngine], statement: str, kind: str = "query"):
+    """
+
+    Read Rows From Database (Async)
+    ==================================
+
+    Awaitable version of read_rows. When the engine is an AsyncEngine the query is run through the async driver,
+    otherwise the blocking read_rows is run in a worker thread, so in both cases the event loop is free to serve
+    other requests while the query is running. When single flight is enabled, the callers of an identical query
+    already running wait for it and share its result (see single_flight).
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param kind: The kind of the query (such as date, range), the label its metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+
+    """
+
+    key = query_key(statement) if SINGLE_FLIGHT.enabled else None
+    return await SINGLE_FLIGHT.run(None if key is None else (engine, key), _read_rows_async, engine, statement, kind)
+
+
+async def _read_rows_async(engine: Union[Engine, AsyncEngine], statement: str, kind: str = "query"):
+    """
+    Run the query of read_rows_async (see read_rows_async)
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param kind: The kind of the query (such as date, range), the label its metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+    """
+
+    if not isinstance(engine, AsyncEngine):
+        return await asyncio.to_thread(read_rows, engine, statement, kind)
+
+    # Opening a connection to the database
+    wait_start = time.perf_counter()
+    async with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+        start_time = time.time()
+        query_result = fetch_records(await conn.execute(executable(statement)))
+        end_time = time.time()
+        metrics.observe_query(kind, end_time - start_time, len(query_result))
+        LOGGER.info("Total Time for Reading Data: {time} seconds".format(time=round((end_time - start_time), 4)))
+
+    return query_result
+
+
+def query_semaphore():
+    """
+    Function that returns the semaphore shared by all the statements run in parallel on the asyncio engines, so at
+    most MAX_CONCURRENT_QUERIES of them (see read_operations.initialize_query_concurrency) hold a connection at the
+    same time in the whole process. It is created lazily in the running event loop, and again if the loop or the
+    number of concurrent queries changes.
+
+    :return: The semaphore
+    :rtype: asyncio.Semaphore
+    """
+
+    global _QUERY_SEMAPHORE, _QUERY_SEMAPHORE_LOOP, _QUERY_SEMAPHORE_SIZE
+    loop = asyncio.get_running_loop()
+    if (_QUERY_SEMAPHORE is None or _QUERY_SEMAPHORE_LOOP is not loop
+            or _QUERY_SEMAPHORE_SIZE != read_operations.MAX_CONCURRENT_QUERIES):
+        _QUERY_SEMAPHORE = asyncio.Semaphore(read_operations.MAX_CONCURRENT_QUERIES)
+        _QUERY_SEMAPHORE_LOOP = loop
+        _QUERY_SEMAPHORE_SIZE = read_operations.MAX_CONCURRENT_QUERIES
+    return _QUERY_SEMAPHORE
+
+
+async def read_statement_async(engine: AsyncEngine, statement: str, index: int = 0, kind: str = "query"):
+    """
+
+    Read Rows For One Statement On Its Own Connection (Async)
+    ============================================================
+
+    Awaitable version of read_statement, the statement waits for the semaphore shared by the whole process (see
+    query_semaphore) before checking out its connection.
+
+    :param engine: The Sqlalchemy asyncio engine used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param index: The position of the statement in the batch (used for logging)
+    :param kind: The kind of the query, the label its metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+
+    """
+
+    async with query_semaphore():
+        wait_start = time.perf_counter()
+        async with engine.connect() as conn:
+            metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+            start_time = time.time()
+            query_result = fetch_records(await conn.execute(executable(statement)))
+            end_time = time.time()
+            metrics.observe_query(kind, end_time - start_time, len(query_result))
+            LOGGER.info("Time for Reading Statement {index}: {time} Seconds ({rows} rows)".format(
+                index=index, time=round((end_time - start_time), 4), rows=len(query_result)))
+
+    return query_result
+
+
+async def read_rows_multiple_async(engine: Union[Engine, AsyncEngine], statements: list[str], kind: str = "query"):
+    """
+
+    Read Records Multiple Times (Async)
+    ======================================
+
+    Awaitable version of read_rows_multiple, see read_rows_async for how the engine type is handled (and the
+    identical queries in flight are shared). In the parallel mode the statements run concurrently on separate pooled
+    connections and the results are returned in the same order as the statements.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param statements: An array containing the query statements that are required to be executed
+    :param kind: The kind of the queries, the label their metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+
+    """
+
+    key = None
+    if SINGLE_FLIGHT.enabled:
+        keys = tuple(query_key(statement) for statement in statements)
+        key = None if None in keys else (engine, keys)
+    return await SINGLE_FLIGHT.run(key, _read_rows_multiple_async, engine, statements, kind)
+
+
+async def _read_rows_multiple_async(engine: Union[Engine, AsyncEngine], statements: list[str], kind: str = "query"):
+    """
+    Run the queries of read_rows_multiple_async (see read_rows_multiple_async)
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param statements: An array containing the query statements that are required to be executed
+    :param kind: The kind of the queries, the label their metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+    """
+
+    if not isinstance(engine, AsyncEngine):
+        return await asyncio.to_thread(read_rows_multiple, engine, statements, kind)
+
+    if read_operations.PARALLEL_QUERIES and len(statements) > 1:
+
+        start_time = time.time()
+        # gather returns the results in the order of the given awaitables
+        query_results = await asyncio.gather(*[read_statement_async(engine, statement, index, kind)
+                                               for index, statement in enumerate(statements)])
+        end_time = time.time()
+        LOGGER.info("Total Time for Reading Data ({count} statements in parallel): {time} Seconds".format(
+            count=len(statements), time=round((end_time - start_time), 4)))
+
+        return list(query_results)
+
+    wait_start = time.perf_counter()
+    async with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+        start_time = time.time()
+        query_results = []
+        for statement in statements:
+            statement_start = time.perf_counter()
+            query_results.append(fetch_records(await conn.execute(executable(statement))))
+            metrics.observe_query(kind, time.perf_counter() - statement_start, len(query_results[-1]))
+        end_time = time.time()
+        LOGGER.info("Total Time for Reading Data: {time} Seconds".format(time=round((end_time - start_time), 4)))
+
+    return query_results
+
+
+async def stream_rows_async(engine: Union[Engine, AsyncEngine], statement: str, batch_size: int = STREAM_BATCH_SIZE,
+                            kind: str = "stream"):
+    """
+
+    Stream Rows From Database (Async)
+    ======================================
+
+    Async generator version of stream_rows. With an AsyncEngine the rows are streamed through the async driver's
+    server side cursor, otherwise every batch of the blocking stream_rows is fetched in a worker thread.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param batch_size: The number of rows in a batch
+    :param kind: The kind of the query, the label its metrics are recorded with
+
+    :return: Yields batches of rows
+    :rtype: AsyncIterator[list]
+
+    """
+
+    if not isinstance(engine, AsyncEngine):
+        batches = stream_rows(engine, statement, batch_size, kind)
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            # Closing the generator releases the connection (also when the client disconnects midway)
+            await asyncio.to_thread(batches.close)
+        return
+
+    wait_start = time.perf_counter()
+    async with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+        start_time = time.time()
+        row_count = 0
+        result = await conn.stream(executable(statement))
+        async for batch in result.partitions(batch_size):
+            row_count += len(batch)
+            yield batch
+        end_time = time.time()
+        metrics.observe_query(kind, end_time - start_time, row_count)
+        LOGGER.info("Total Time for Streaming Data: {time} Seconds ({rows} rows)".format(
+            time=round((end_time - start_time), 4), rows=row_count))
+
+
+def _run_in_transaction(engine: Engine, function, *args):
+    """
+    Function that runs the given function with a connection inside a transaction (committed when the function returns)
+
+    :param engine: The Sqlalchemy engine used to connect to the database
+    :param function: The function, called as function(connection, *args)
+    :param args: The other arguments of the function
+
+    :return: The value returned by the function
+    """
+
+    with engine.begin() as conn:
+        return function(conn, *args)
+
+
+async def run_in_transaction_async(engine: Union[Engine, AsyncEngine], function, *args):
+    """
+
+    Run A Function Inside A Transaction (Async)
+    ==============================================
+
+    Function used by the background jobs (which read and write in batches) to run blocking, connection based code
+    without blocking the event loop. With an AsyncEngine the function is run through run_sync (the connection it gets
+    is a sync facade over the async driver), otherwise the function is run in a worker thread.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param function: The function, called as function(connection, *args)
+    :param args: The other arguments of the function
+
+    :return: The value returned by the function
+    """
+
+    if not isinstance(engine, AsyncEngine):
+        return await asyncio.to_thread(_run_in_transaction, engine, function, *args)
+
+    async with engine.begin() as conn:
+        return await conn.run_sync(function, *args)
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+DAY SERIES CACHE
+======================
+
+Module that caches the series of a parameter for a date, keyed by (device id, parameter, date, resolution), so that
+comparing the same past days again does not query the database.
+
+The rows of a closed date (ended in the plant timezone more than the closed day grace period ago, see
+energy_today.is_closed_day) do not change any more, so the series of such a closed day, once read from a source
+holding all its rows (the primary or the history mirror, not a lagging read replica) and not cut short by the row
+limit, is cached without expiry, in memory (least recently used series evicted once the cache holds more than
+"max_bytes") and optionally on disk (a directory of .npz files, which survives restarts). The series of the dates
+not closed yet may still grow, it is either not cached (today_ttl 0) or cached in memory only for today_ttl seconds,
+the same as the series of a closed day that could not be cached for good.
+
+The series are cached as columns before any downsampling (see records_to_source_columns), so the requests for the
+same date with a different number of points or method share the cached series. The resolution is the rollup level
+the series was read from ("raw" for the rows of the table).
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to hold the columns and store them on disk
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date as date_type, datetime, time as time_type, timedelta
+from typing import Optional
+
+# External Imports
+import numpy as np
+
+# User Imports
+from ..utils import metrics
+from .async_read_operations import read_rows_async, read_rows_multiple_async
+from .device_registry import Device, get_device
+from .energy_today import is_closed_day
+from .engine import primary_engine
+from .downsampling import clean_series, rows_to_columns, timestamp_column
+from . import read_operations
+from .query_statements import DATE_SERIES_LIMIT, statement_for_date_series, statement_for_date_series_batch
+from .read_operations import history_engine
+from .rollups import rollup_level_for_date, statement_for_rollup_query
+from .series_formats import records_to_source_columns
+from .table_models import energy_column, ordered_parameters
+
+LOGGER = logging.getLogger(__name__)
+
+RAW_RESOLUTION = "raw"
+
+
+class DaySeriesCache:
+    """
+    CACHE FOR THE SERIES OF A DATE
+    ==================================
+
+    This class holds the series (columns) of (device id, parameter, date, resolution) keys in memory, bounded by
+    bytes, with an optional on disk tier for the closed days.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, today_ttl: float = 0, directory: Optional[str] = None,
+                 disk_max_bytes: Optional[int] = None):
+        """
+        :param max_bytes: The maximum number of bytes of the series held in memory
+        :param today_ttl: The time (in seconds) for which the series of today is served from memory, 0 to not cache it
+        :param directory: The directory of the on disk tier, None to keep the series in memory only
+        :param disk_max_bytes: The maximum number of bytes of the series on disk, None for no limit
+        """
+
+        self.enabled = False
+        self.max_bytes = max_bytes
+        self.today_ttl = today_ttl
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._disk_files: Optional[OrderedDict] = None
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+
+    def _memory_get(self, key: tuple):
+        """
+        Get the series of a key from memory (marking it as the most recently used)
+
+        :param key: The (device id, parameter, date, resolution) key
+
+        :return: The columns, None if not cached (or expired)
+        :rtype: Optional[dict[str, np.ndarray]]
+        """
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        columns, size, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            self.size -= size
+            return None
+
+        self._entries.move_to_end(key)
+        return columns
+
+    def _memory_put(self, key: tuple, columns: dict, expires_at: Optional[float]):
+        """
+        Put the series of a key in memory, evicting the least recently used series to stay within max_bytes
+
+        :param key: The (device id, parameter, date, resolution) key
+        :param columns: The columns
+        :param expires_at: The (monotonic) time at which the series expires, None for no expiry
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        size = sum(column.nbytes for column in columns.values())
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+
+        # The cached columns are shared by the requests, so they should not be modified in place
+        for column in columns.values():
+            column.setflags(write=False)
+
+        self._entries[key] = (columns, size, expires_at)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def _disk_path(self, key: tuple):
+        """
+        The path of the file of a key in the on disk tier
+
+        :param key: The (device id, parameter, date, resolution) key
+
+        :return: The path
+        :rtype: str
+        """
+
+        return os.path.join(self.directory, "{0}_{1}_{2}_{3}.npz".format(*key))
+
+    def _load_disk_files(self):
+        """
+        Load the files of the on disk tier (least recently written first), once, to keep it within disk_max_bytes
+
+        :return: The dictionary of file path to its size
+        :rtype: OrderedDict
+        """
+
+        if self._disk_files is None:
+            os.makedirs(self.directory, exist_ok=True)
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith(".npz")]
+            self._disk_files = OrderedDict((path, os.path.getsize(path)) for path in
+                                           sorted(paths, key=os.path.getmtime))
+            self._disk_size = sum(self._disk_files.values())
+        return self._disk_files
+
+    def _disk_get(self, key: tuple):
+        """
+        Read the series of a key from the on disk tier (blocking, run in a worker thread)
+
+        :param key: The (device id, parameter, date, resolution) key
+
+        :return: The columns, None if not on disk
+        :rtype: Optional[dict[str, np.ndarray]]
+        """
+
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as stored:
+                columns = {name: stored[name] for name in stored.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            LOGGER.error("Could not read the cached series {path}: {error}".format(path=path, error=error))
+            return None
+
+        with self._disk_lock:
+            files = self._load_disk_files()
+            if path in files:
+                files.move_to_end(path)
+        return columns
+
+    def _disk_put(self, key: tuple, columns: dict):
+        """
+        Write the series of a key to the on disk tier (blocking, run in a worker thread), removing the least recently
+        used files to stay within disk_max_bytes
+
+        :param key: The (device id, parameter, date, resolution) key
+        :param columns: The columns
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        path = self._disk_path(key)
+        with self._disk_lock:
+            files = self._load_disk_files()
+            try:
+                # Writing to a temporary file first, so that a reader never sees a partly written file
+                temporary_path = path + ".{pid}.tmp".format(pid=os.getpid())
+                with open(temporary_path, "wb") as file_object:
+                    np.savez(file_object, **columns)
+                os.replace(temporary_path, path)
+            except OSError as error:
+                LOGGER.error("Could not write the cached series {path}: {error}".format(path=path, error=error))
+                return
+
+            self._disk_size += os.path.getsize(path) - files.pop(path, 0)
+            files[path] = os.path.getsize(path)
+            while self.disk_max_bytes is not None and self._disk_size > self.disk_max_bytes and len(files) > 1:
+                evicted_path, evicted_size = files.popitem(last=False)
+                self._disk_size -= evicted_size
+                try:
+                    os.remove(evicted_path)
+                except OSError:
+                    pass
+
+    async def get(self, key: tuple, closed: bool):
+        """
+        Get the series of a key, from memory or (for a closed day) from disk
+
+        :param key: The (device id, parameter, date, resolution) key
+        :param closed: Whether the date is closed (its rows do not change any more, see is_closed_day)
+
+        :return: The columns, None if not cached
+        :rtype: Optional[dict[str, np.ndarray]]
+        """
+
+        if not self.enabled:
+            return None
+
+        columns = self._memory_get(key)
+        metrics.observe_cache("day_series", columns is not None)
+        if columns is not None or not closed or self.directory is None:
+            return columns
+
+        columns = await asyncio.to_thread(self._disk_get, key)
+        metrics.observe_cache("day_series_disk", columns is not None)
+        if columns is not None:
+            self._memory_put(key, columns, None)
+        return columns
+
+    async def put(self, key: tuple, columns: dict, closed: bool):
+        """
+        Cache the series of a key, a closed day without expiry (and on disk), the others for today_ttl seconds
+
+        :param key: The (device id, parameter, date, resolution) key
+        :param columns: The columns
+        :param closed: Whether the date is closed (its rows do not change any more, see is_closed_day)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if not self.enabled:
+            return
+
+        if not closed:
+            if self.today_ttl > 0:
+                self._memory_put(key, columns, time.monotonic() + self.today_ttl)
+            return
+
+        self._memory_put(key, columns, None)
+        if self.directory is not None:
+            await asyncio.to_thread(self._disk_put, key, columns)
+
+    def clear(self):
+        """
+        Remove all the series held in memory (the on disk tier is kept)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        self._entries.clear()
+        self.size = 0
+
+
+DAY_SERIES_CACHE = DaySeriesCache()
+
+
+def initialize_day_series_cache(enabled: bool, max_bytes: int = 256 * 1024 * 1024, today_ttl: float = 0,
+                                directory: Optional[str] = None, disk_max_bytes: Optional[int] = None):
+    """
+    Function used to initialize the global day series cache ( from the main script)
+
+    :param enabled: Whether the series are cached
+    :param max_bytes: The maximum number of bytes of the series held in memory
+    :param today_ttl: The time (in seconds) for which the series of today is served from memory, 0 to not cache it
+    :param directory: The directory of the on disk tier, None to keep the series in memory only
+    :param disk_max_bytes: The maximum number of bytes of the series on disk, None for no limit
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if max_bytes < 0 or today_ttl < 0:
+        raise ValueError("The day series cache max_bytes and today_ttl should not be negative")
+
+    DAY_SERIES_CACHE.enabled = enabled
+    DAY_SERIES_CACHE.max_bytes = max_bytes
+    DAY_SERIES_CACHE.today_ttl = today_ttl
+    DAY_SERIES_CACHE.directory = directory
+    DAY_SERIES_CACHE.disk_max_bytes = disk_max_bytes
+    DAY_SERIES_CACHE.clear()
+    LOGGER.info("Day series cache {state} ({size} bytes in memory, on disk at {directory})".format(
+        state="enabled" if enabled else "disabled", size=max_bytes, directory=directory))
+
+
+def covers_closed_day(source_engine, engine):
+    """
+    Function that checks whether the engine the raw rows of a closed day were read from holds all of them, the
+    primary or the history mirror (history_engine picks it only for the dates it holds), not a read replica that can
+    lag behind
+
+    :param source_engine: The engine the rows were read from
+    :param engine: The engine of the request (the primary or a read replica)
+
+    :return: True if the series can be cached for good
+    :rtype: bool
+    """
+
+    mirror = read_operations.HISTORY_MIRROR
+    return source_engine is primary_engine(engine) or (mirror is not None and source_engine is mirror.engine)
+
+
+async def read_day_series(engine, parameter: str, dates: list[str], points: Optional[int] = None,
+                          device: Optional[Device] = None):
+    """
+
+    READ THE SERIES OF DATES
+    ============================
+
+    Function that returns the series (columns before any downsampling) of a parameter for every given date, from the
+    day series cache when cached, the dates not cached are queried together (see read_rows_multiple_async), from the
+    coarsest rollup that gives the requested number of points when the rollups cover the date, and the raw rows from
+    the history mirror when it holds the whole date (see history_engine), the raw rows of the closed days from the
+    primary rather than a read replica.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param parameter: The parameter that needs to be read such as energy, power
+    :param dates: The dates (YYYY-MM-DD) for which the parameter is required
+    :param points: The number of points the series will be downsampled to, None for the raw series
+    :param device: The device, the default device when not given
+
+    :return: The dictionary of date to its columns and the set of dates whose columns are rollup columns
+    :rtype: tuple[dict[str, dict[str, np.ndarray]], set]
+
+    """
+
+    # Checking the parameter and the dates before they are used in the keys (and file names) of the cache
+    device = device or get_device()
+    energy_column(parameter)
+    days = {date: date_type.fromisoformat(date).isoformat() for date in dates}
+
+    closed = {date: is_closed_day(days[date]) for date in dates}
+    source, rollup_dates, missing = {}, set(), {}
+    for date in dates:
+        if date in source or date in missing:
+            continue
+
+        level = rollup_level_for_date(parameter, date, points, device) if points is not None else None
+        if level is not None:
+            rollup_dates.add(date)
+
+        key = (device.device_id, parameter, days[date], level or RAW_RESOLUTION)
+        columns = await DAY_SERIES_CACHE.get(key, closed[date])
+        if columns is None:
+            missing[date] = (key, level)
+        else:
+            source[date] = columns
+
+    # Grouping the dates not cached by the engine they are read from, the raw rows of the closed days (cached for
+    # good) from the primary or the history mirror, the other raw rows from the given engine (a read replica when
+    # available) or the history mirror, the rollups always from the primary (where they are materialized, a lagging
+    # replica could return incomplete rows or buckets, which would then be cached)
+    batches = {}
+    for date, (key, level) in missing.items():
+        if level is None:
+            end_of_day = datetime.combine(date_type.fromisoformat(days[date]) + timedelta(days=1), time_type.min)
+            date_engine = primary_engine(engine) if closed[date] else engine
+            batch = batches.setdefault(history_engine(date_engine, end_of_day, device), [])
+            batch.append((date, key, level, statement_for_date_series(parameter, date, device=device)))
+        else:
+            batch = batches.setdefault(primary_engine(engine), [])
+            batch.append((date, key, level, statement_for_rollup_query(parameter, date, date, level)))
+
+    batch_records = await asyncio.gather(*[
+        read_rows_multiple_async(batch_engine, [statement for *_, statement in batch], "date")
+        for batch_engine, batch in batches.items()])
+
+    for (batch_engine, batch), records in zip(batches.items(), batch_records):
+        for (date, key, level, _), result in zip(batch, records):
+            source[date] = records_to_source_columns(result, level is not None)
+            # The raw rows of a closed day are cached for good only when they are complete
+            complete = level is not None or (covers_closed_day(batch_engine, engine)
+                                             and len(result) < DATE_SERIES_LIMIT)
+            await DAY_SERIES_CACHE.put(key, source[date], closed[date] and complete)
+
+    return {date: source[date] for date in dates}, rollup_dates
+
+
+async def read_day_series_batch(engine, parameters: list[str], dates: list[str], device: Optional[Device] = None):
+    """
+
+    READ THE SERIES OF SEVERAL PARAMETERS AND DATES
+    ===================================================
+
+    Function that returns the raw series of every given parameter for every given date, from the day series cache
+    when cached. The series not cached are read in a single scan of the table (for all their dates and parameters)
+    for each engine they are read from (the history mirror for the dates it holds, see history_engine, and the
+    primary rather than a read replica for the closed days), the rows are split into the dates by their date column
+    (as selected, the same rows as read_day_series), with the same row limit for every date.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param parameters: The parameters that need to be read such as energy, power
+    :param dates: The dates (YYYY-MM-DD) for which the parameters are required
+    :param device: The device, the default device when not given
+
+    :return: The dictionary of date to the dictionary of parameter to its columns
+    :rtype: dict[str, dict[str, dict[str, np.ndarray]]]
+
+    """
+
+    # Checking the parameters and the dates before they are used in the keys (and file names) of the cache, the
+    # parameters in the order of the columns of the table (the order the statement of the scan returns them in)
+    device = device or get_device()
+    parameters = ordered_parameters(parameters)
+    days = {date: date_type.fromisoformat(date).isoformat() for date in dates}
+
+    closed = {date: is_closed_day(days[date]) for date in days}
+    source, missing = {date: {} for date in days}, {}
+    for date in source:
+        for parameter in parameters:
+            key = (device.device_id, parameter, days[date], RAW_RESOLUTION)
+            columns = await DAY_SERIES_CACHE.get(key, closed[date])
+            if columns is None:
+                missing.setdefault(date, []).append(parameter)
+            else:
+                source[date][parameter] = columns
+
+    # Grouping the dates not cached by the engine they are read from, the closed days (cached for good) from the
+    # primary or the history mirror, not from a read replica that can lag behind
+    batches = {}
+    for date in missing:
+        end_of_day = datetime.combine(date_type.fromisoformat(days[date]) + timedelta(days=1), time_type.min)
+        date_engine = primary_engine(engine) if closed[date] else engine
+        batches.setdefault(history_engine(date_engine, end_of_day, device), []).append(date)
+
+    batch_parameters = [[parameter for parameter in parameters if any(parameter in missing[date] for date in batch)]
+                        for batch in batches.values()]
+    batch_records = await asyncio.gather(*[
+        read_rows_async(batch_engine, statement_for_date_series_batch(columns, batch, device=device), "date_batch")
+        for (batch_engine, batch), columns in zip(batches.items(), batch_parameters)])
+
+    for (batch_engine, batch), columns, records in zip(batches.items(), batch_parameters, batch_records):
+        # A scan that reached its limit may have left out the rows of any of its dates
+        complete = covers_closed_day(batch_engine, engine) and len(records) < DATE_SERIES_LIMIT * len(batch)
+        timestamps, dates_of_rows, *values = rows_to_columns(records, len(columns) + 2)
+        timestamps, dates_of_rows = timestamp_column(timestamps), timestamp_column(dates_of_rows)
+        values = dict(zip(columns, (np.asarray(column, dtype=np.float64) for column in values)))
+
+        for date in batch:
+            # Split by the date column the rows were selected by, at most DATE_SERIES_LIMIT rows for a date (as the
+            # statement of a single date)
+            date_of_rows = np.datetime64(days[date], "D").astype("datetime64[ms]").astype(np.int64)
+            rows_of_date = np.flatnonzero(dates_of_rows == date_of_rows)[:DATE_SERIES_LIMIT]
+            date_complete = complete and rows_of_date.size < DATE_SERIES_LIMIT
+            for parameter in missing[date]:
+                date_timestamps, date_values = clean_series(timestamps[rows_of_date], values[parameter][rows_of_date])
+                source[date][parameter] = {"timestamps": date_timestamps, "values": date_values}
+                key = (device.device_id, parameter, days[date], RAW_RESOLUTION)
+                await DAY_SERIES_CACHE.put(key, source[date][parameter], closed[date] and date_complete)
+
+    return source
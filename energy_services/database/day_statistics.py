@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+DAY STATISTICS
+======================
+
+Module that computes the statistics of a parameter for a date (count, minimum, maximum, mean, standard deviation,
+percentiles and the time spent above a threshold), so the clients do not have to download the whole series of the
+day to compute them.
+
+The statistics are computed in one vectorized pass over the series of the date, which is read through the day series
+cache (see read_day_series), so the statistics of a closed day do not query the database once its series is cached.
+The raw series is used rather than the rollups, as the percentiles can not be computed from the rollup buckets.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to compute the statistics
+"""
+
+# Standard Imports
+import asyncio
+import logging
+from typing import Optional
+
+# External Imports
+import numpy as np
+
+# User Imports
+from .day_series_cache import read_day_series
+from .device_registry import Device
+from .table_models import energy_column
+
+LOGGER = logging.getLogger(__name__)
+
+# The percentiles computed for every series
+STATISTICS_PERCENTILES = (50, 95, 99)
+
+# A reading is taken to hold until the next one, but not for longer than this (in milliseconds), so the time the
+# meter was not sending readings is not counted as time above the threshold
+MAX_READING_INTERVAL = 5 * 60 * 1000
+
+
+def series_statistics(timestamps: np.ndarray, values: np.ndarray, threshold: Optional[float] = None):
+    """
+
+    STATISTICS OF A SERIES
+    ==========================
+
+    Function that computes the statistics of a series (ordered by timestamp, without missing values, see
+    rows_to_arrays).
+
+    :param timestamps: The timestamps (epoch milliseconds)
+    :param values: The values
+    :param threshold: When given, the time (in seconds) the value was above the threshold is also computed
+
+    :return: The count, min, max, mean, std (population), p50, p95, p99 and (when threshold is given)
+    seconds_above_threshold, the statistics are None when the series is empty
+    :rtype: dict
+
+    """
+
+    statistics = {"count": int(values.size)}
+    names = ["min", "max", "mean", "std"] + ["p{percentile}".format(percentile=percentile)
+                                             for percentile in STATISTICS_PERCENTILES]
+    if values.size == 0:
+        statistics.update({name: None for name in names})
+    else:
+        results = [values.min(), values.max(), values.mean(), values.std()] + \
+                  list(np.percentile(values, STATISTICS_PERCENTILES))
+        statistics.update({name: float(result) for name, result in zip(names, results)})
+
+    if threshold is not None:
+        intervals = np.minimum(np.diff(timestamps), MAX_READING_INTERVAL)
+        statistics["seconds_above_threshold"] = float(intervals[values[:-1] > threshold].sum()) / 1000
+
+    return statistics
+
+
+async def read_day_statistics(engine, parameters: list[str], dates: list[str], threshold: Optional[float] = None,
+                              device: Optional[Device] = None):
+    """
+
+    READ THE STATISTICS OF DATES
+    ================================
+
+    Function that returns the statistics (see series_statistics) of every given parameter for every given date, the
+    series of the parameters are read concurrently.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param parameters: The parameters such as power, avg_voltage
+    :param dates: The dates (YYYY-MM-DD)
+    :param threshold: When given, the time (in seconds) every parameter was above the threshold is also computed
+    :param device: The device, the default device when not given
+
+    :return: The dictionary of parameter to the dictionary of date to its statistics
+    :rtype: dict[str, dict[str, dict]]
+
+    """
+
+    for parameter in parameters:
+        energy_column(parameter)
+
+    parameters = list(dict.fromkeys(parameters))
+    results = await asyncio.gather(*[read_day_series(engine, parameter, dates, None, device)
+                                     for parameter in parameters])
+
+    return {parameter: {date: series_statistics(columns["timestamps"], columns["values"], threshold)
+                        for date, columns in source.items()}
+            for parameter, (source, _) in zip(parameters, results)}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+DEVICE REGISTRY
+======================
+
+Module that keeps the energy meters (devices) served by this service, and where the readings of each of them are
+stored, either a table of its own (with the layout of the energy meter table) or the rows of a shared table having
+its id in a device column.
+
+The default device is the energy meter of the energy meter table (u759114105_energy_meter.energy_lmeasure), the one
+served by the routes that do not name a device, and the one the rollups and the history mirror are kept for.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * sqlalchemy - Package used to build the device filters of the statements
+"""
+
+# Standard Imports
+import logging
+import re
+from typing import Optional
+
+# External Imports
+from sqlalchemy import Table
+
+# User Imports
+from .table_models import ENERGY_LMEASURE_TABLE, ENERGY_SCHEMA, energy_column, energy_table
+
+LOGGER = logging.getLogger(__name__)
+
+# The device ids are used in the urls and in the file names of the day series cache
+DEVICE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Device:
+    """
+    ENERGY METER (DEVICE)
+    =========================
+
+    This class holds the id of a device and the table (and device column filter) its readings are stored in.
+    """
+
+    def __init__(self, device_id: str, table: Table = ENERGY_LMEASURE_TABLE, device_column: Optional[str] = None,
+                 device_value: Optional[str] = None, is_default: bool = False):
+        """
+        :param device_id: The id of the device
+        :param table: The table the readings of the device are stored in
+        :param device_column: The column holding the id of the device, when the table is shared by several devices
+        :param device_value: The value of the device column for this device (the device id when not given)
+        :param is_default: Whether this is the default device (the one of the energy meter table)
+        """
+
+        if not DEVICE_ID_PATTERN.match(device_id):
+            raise ValueError("Invalid device id {device_id}, should match {pattern}".format(
+                device_id=device_id, pattern=DEVICE_ID_PATTERN.pattern))
+
+        self.device_id = device_id
+        self.table = table
+        self.device_column = device_column
+        self.device_value = device_value if device_value is not None else device_id
+        self.is_default = is_default
+
+    def column(self, parameter: str):
+        """
+        Function that returns the column of a parameter in the table of the device (see energy_column)
+
+        :param parameter: The parameter such as energy, power
+
+        :return: The column of the parameter
+        :rtype: Column
+        """
+
+        return energy_column(parameter, self.table)
+
+    def filter(self, statement):
+        """
+        Function that restricts a statement on the table of the device to the rows of the device
+
+        :param statement: The select statement
+
+        :return: The statement with the device filter, the same statement when the table is not shared
+        :rtype: Select
+        """
+
+        if self.device_column is None:
+            return statement
+        return statement.where(self.table.c[self.device_column] == self.device_value)
+
+    def to_dictionary(self):
+        """
+        Function that returns the device as the dictionary sent to the clients
+
+        :return: The id, table and device filter of the device
+        :rtype: dict
+        """
+
+        return {"device_id": self.device_id, "table": self.table.fullname, "device_column": self.device_column,
+                "device_value": self.device_value if self.device_column is not None else None,
+                "is_default": self.is_default}
+
+    def __repr__(self):
+        return "Device({device_id})".format(device_id=self.device_id)
+
+
+class DeviceRegistry:
+    """
+    DEVICE REGISTRY
+    ==================
+
+    This class holds the devices by their id, the default device is always registered.
+    """
+
+    def __init__(self, default_device_id: str = "main"):
+        """
+        :param default_device_id: The id of the default device
+        """
+
+        self.default = Device(default_device_id, is_default=True)
+        self.devices = {self.default.device_id: self.default}
+
+    def register(self, device: Device):
+        """
+        Function that adds a device to the registry
+
+        :param device: The device
+
+        :return: The same device
+        :rtype: Device
+        """
+
+        if device.device_id in self.devices:
+            raise ValueError("Device {device_id} is already registered".format(device_id=device.device_id))
+        self.devices[device.device_id] = device
+        return device
+
+    def get(self, device_id: Optional[str] = None):
+        """
+        Function that returns a device by its id
+
+        :param device_id: The id of the device, None for the default device
+
+        :return: The device
+        :rtype: Device
+        """
+
+        if device_id is None:
+            return self.default
+        try:
+            return self.devices[device_id]
+        except KeyError:
+            raise KeyError("Unknown device {device_id}".format(device_id=device_id)) from None
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
+
+
+DEVICE_REGISTRY = DeviceRegistry()
+
+
+def initialize_devices(default_device_id: str = "main", devices: Optional[dict] = None):
+    """
+    Function used to initialize the global device registry ( from the main script)
+
+    :param default_device_id: The id of the default device (the energy meter table)
+    :param devices: The other devices, device id to its table ("table", "schema", the energy meter schema when not
+    given, and for a shared table "device_column" and "device_value", the device id when not given)
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    global DEVICE_REGISTRY
+    registry = DeviceRegistry(default_device_id)
+    for device_id, options in (devices or {}).items():
+        table = energy_table(options["table"], options.get("schema", ENERGY_SCHEMA), options.get("device_column"))
+        registry.register(Device(device_id, table, options.get("device_column"), options.get("device_value")))
+
+    DEVICE_REGISTRY = registry
+    LOGGER.info("Registered {count} devices ({devices})".format(count=len(registry),
+                                                                devices=", ".join(registry.devices)))
+
+
+def get_device(device_id: Optional[str] = None):
+    """
+    Function that returns a device of the global device registry by its id
+
+    :param device_id: The id of the device, None for the default device
+
+    :return: The device
+    :rtype: Device
+    """
+
+    return DEVICE_REGISTRY.get(device_id)
+
+
+def all_devices():
+    """
+    Function that returns all the devices of the global device registry
+
+    :return: The devices, the default device first
+    :rtype: list[Device]
+    """
+
+    return list(DEVICE_REGISTRY)
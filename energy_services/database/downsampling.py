@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+DOWNSAMPLING
+======================
+
+Module that reduces a date wise parameter series (timestamp, value rows) to a given number of points, so that a
+chart a few hundred pixels wide is not sent (and does not have to draw) every raw reading.
+
+Two methods are available
+    * lttb - Largest Triangle Three Buckets, keeps the visual shape of the series using the original points
+    * minmax - equal time buckets, each reduced to its minimum, maximum and average value
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to do the reduction vectorized instead of point by point
+"""
+
+# Standard Imports
+import logging
+from datetime import datetime
+
+# External Imports
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+
+
+def rows_to_columns(rows, count: int):
+    """
+    Function that returns the first "count" columns of the records resulted from a query, the records of the numeric
+    statements are already a float64 array (see read_operations.fetch_records) whose columns are copied out as
+    contiguous arrays, other rows are transposed (with zip, so a tuple per column)
+
+    :param rows: The records resulted from the query, a two dimensional array or the rows
+    :param count: The number of columns
+
+    :return: The columns, as arrays or tuples of the values
+    :rtype: list[Union[np.ndarray, tuple]]
+    """
+
+    if isinstance(rows, np.ndarray):
+        return [np.ascontiguousarray(column) for column in rows.T[:count]]
+    if not rows:
+        return [()] * count
+    return list(zip(*rows))[:count]
+
+
+def timestamp_column(values):
+    """
+    Function that converts the timestamps of a query to epoch milliseconds, the timestamps can be the epoch
+    milliseconds already (see sql_functions.epoch_milliseconds) or datetime objects
+
+    :param values: The timestamps
+
+    :return: The epoch milliseconds (of the naive timestamps)
+    :rtype: np.ndarray
+    """
+
+    if isinstance(values, np.ndarray):
+        return values.astype(np.int64)
+    if values and isinstance(values[0], datetime):
+        return np.array(values, dtype="datetime64[ms]").astype(np.int64)
+    return np.array(values, dtype=np.int64)
+
+
+def rows_to_arrays(rows: list):
+    """
+    Function that converts (timestamp, value) rows to numpy arrays, ordered by timestamp and without missing values
+
+    :param rows: The (timestamp, value) records resulted from the query (see rows_to_columns), the timestamps as
+    epoch milliseconds or datetime objects
+
+    :return: The timestamps (epoch milliseconds of the naive timestamps) and the values
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+
+    timestamps, values = rows_to_columns(rows, 2)
+    return clean_series(timestamp_column(timestamps), np.asarray(values, dtype=np.float64))
+
+
+def clean_series(timestamps: np.ndarray, values: np.ndarray):
+    """
+    Function that orders a series by timestamp and removes its missing values
+
+    :param timestamps: The timestamps (epoch milliseconds)
+    :param values: The values
+
+    :return: The timestamps and the values
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+
+    keep = ~np.isnan(values)
+    timestamps, values = timestamps[keep], values[keep]
+
+    if timestamps.size > 1 and np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+
+    return timestamps, values
+
+
+def timestamps_to_strings(timestamps: np.ndarray):
+    """
+    Function that converts epoch millisecond timestamps back to the iso format strings sent for raw series
+
+    :param timestamps: The epoch millisecond timestamps
+
+    :return: The timestamps as iso format strings
+    :rtype: np.ndarray
+    """
+
+    return np.datetime_as_string(timestamps.astype("datetime64[ms]"), unit="s")
+
+
+def lttb(timestamps: np.ndarray, values: np.ndarray, points: int):
+    """
+
+    LARGEST TRIANGLE THREE BUCKETS
+    ==================================
+
+    Function that selects "points" of the original points, keeping the first and last point and from every bucket in
+    between the point forming the largest triangle with the point selected in the previous bucket and the average of
+    the next bucket.
+
+    :param timestamps: The timestamps of the series (ordered)
+    :param values: The values of the series
+    :param points: The number of points required (at least 3)
+
+    :return: The selected timestamps and values
+    :rtype: tuple[np.ndarray, np.ndarray]
+
+    """
+
+    size = timestamps.size
+    if points >= size or points < 3:
+        return timestamps, values
+
+    x = timestamps.astype(np.float64)
+    y = values
+
+    # Bucket boundaries for the points in between the first and the last point
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        # The average point of the next bucket (the last point for the last bucket)
+        if bucket + 2 < edges.size:
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            average_x, average_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            average_x, average_y = x[-1], y[-1]
+
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return timestamps[selected], values[selected]
+
+
+def min_max_average(timestamps: np.ndarray, values: np.ndarray, points: int):
+    """
+
+    MIN MAX AVERAGE BUCKETS
+    ==========================
+
+    Function that splits the time span of the series into "points" equal buckets and reduces every (non empty) bucket
+    to its minimum, maximum and average value.
+
+    :param timestamps: The timestamps of the series (ordered)
+    :param values: The values of the series
+    :param points: The number of buckets
+
+    :return: The bucket start timestamps and the minimum, maximum and average values of the buckets
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+    """
+
+    if timestamps.size == 0:
+        return timestamps, values, values, values
+
+    first, last = timestamps[0], timestamps[-1]
+    width = max((last - first + 1) / points, 1)
+
+    buckets = ((timestamps - first) // width).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0])
+    counts = np.diff(np.r_[starts, timestamps.size])
+
+    minimum = np.minimum.reduceat(values, starts)
+    maximum = np.maximum.reduceat(values, starts)
+    average = np.add.reduceat(values, starts) / counts
+    bucket_timestamps = (first + buckets[starts] * width).astype(np.int64)
+
+    return bucket_timestamps, minimum, maximum, average
+
+
+def grid_averages(timestamps: np.ndarray, values: np.ndarray, start: int, width: float, points: int):
+    """
+    Function that averages a series over a fixed grid of "points" buckets of "width" milliseconds from "start", so
+    that the series of different devices (read at different timestamps) can be combined bucket by bucket
+
+    :param timestamps: The timestamps of the series (epoch milliseconds)
+    :param values: The values of the series
+    :param start: The start of the first bucket (epoch milliseconds)
+    :param width: The width of a bucket (milliseconds)
+    :param points: The number of buckets
+
+    :return: The average of every bucket (nan for the buckets without values)
+    :rtype: np.ndarray
+    """
+
+    buckets = ((timestamps - start) // width).astype(np.int64)
+    inside = (buckets >= 0) & (buckets < points)
+    totals = np.bincount(buckets[inside], weights=values[inside], minlength=points)
+    counts = np.bincount(buckets[inside], minlength=points)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / counts
+
+
+def downsample_columns(timestamps: np.ndarray, values: np.ndarray, points: int, method: str = "lttb"):
+    """
+
+    DOWNSAMPLE A SERIES TO COLUMNS
+    =================================
+
+    Function that downsamples a series and returns the result as named columns.
+
+    :param timestamps: The timestamps of the series (ordered)
+    :param values: The values of the series
+    :param points: The number of points (buckets) required
+    :param method: The downsampling method, "lttb" or "minmax"
+
+    :return: "timestamps" and "values" columns for "lttb", "timestamps", "min", "max" and "average" for "minmax"
+    :rtype: dict[str, np.ndarray]
+
+    """
+
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError("Invalid downsampling method {method}, should be one of {methods}".format(
+            method=method, methods=DOWNSAMPLING_METHODS))
+
+    if method == "lttb":
+        timestamps, values = lttb(timestamps, values, points)
+        return {"timestamps": timestamps, "values": values}
+
+    timestamps, minimum, maximum, average = min_max_average(timestamps, values, points)
+    return {"timestamps": timestamps, "min": minimum, "max": maximum, "average": average}
+
+
+def rollup_rows_to_columns(rows: list):
+    """
+    Function that converts rollup rows (bucket_start, minimum, maximum, total, count, first_value, last_value) to
+    numpy columns
+
+    :param rows: The rollup rows resulted from the query, ordered by bucket_start
+
+    :return: The columns "timestamps", "min", "max", "total", "count", "first" and "last"
+    :rtype: dict[str, np.ndarray]
+    """
+
+    timestamps, *values = rows_to_columns(rows, 7)
+    columns = {"timestamps": timestamp_column(timestamps)}
+    for name, column in zip(("min", "max", "total", "count", "first", "last"), values):
+        columns[name] = np.asarray(column, dtype=np.float64)
+
+    return columns
+
+
+def merge_rollup_buckets(columns: dict, points: int):
+    """
+
+    MERGE ROLLUP BUCKETS
+    ========================
+
+    Function that merges (finer) rollup buckets into "points" equal time buckets, the same way min_max_average
+    reduces raw values.
+
+    :param columns: The rollup columns (see rollup_rows_to_columns)
+    :param points: The number of buckets
+
+    :return: The bucket start timestamps and the minimum, maximum and average values of the buckets
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+    """
+
+    timestamps = columns["timestamps"]
+    if timestamps.size == 0:
+        return timestamps, columns["min"], columns["max"], columns["min"]
+
+    first, last = timestamps[0], timestamps[-1]
+    width = max((last - first + 1) / points, 1)
+
+    buckets = ((timestamps - first) // width).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0])
+
+    minimum = np.fmin.reduceat(columns["min"], starts)
+    maximum = np.fmax.reduceat(columns["max"], starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.add.reduceat(columns["total"], starts) / np.add.reduceat(columns["count"], starts)
+    bucket_timestamps = (first + buckets[starts] * width).astype(np.int64)
+
+    return bucket_timestamps, minimum, maximum, average
+
+
+def downsample_rollup_columns(columns: dict, points: int, method: str = "lttb"):
+    """
+    Function that downsamples a series read from a rollup table, "lttb" runs on the bucket averages and "minmax"
+    merges the buckets
+
+    :param columns: The rollup columns (see rollup_rows_to_columns)
+    :param points: The number of points (buckets) required
+    :param method: The downsampling method, "lttb" or "minmax"
+
+    :return: The same columns as downsample_columns
+    :rtype: dict[str, np.ndarray]
+    """
+
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError("Invalid downsampling method {method}, should be one of {methods}".format(
+            method=method, methods=DOWNSAMPLING_METHODS))
+
+    if method == "lttb":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = columns["total"] / columns["count"]
+        keep = ~np.isnan(average)
+        timestamps, values = lttb(columns["timestamps"][keep], average[keep], points)
+        return {"timestamps": timestamps, "values": values}
+
+    timestamps, minimum, maximum, average = merge_rollup_buckets(columns, points)
+    return {"timestamps": timestamps, "min": minimum, "max": maximum, "average": average}
+
+
+def columns_to_pairs(columns: dict):
+    """
+    Function that converts downsampled columns to lists of [timestamp, value, ...] (the timestamps as iso format
+    strings), the format sent for the "pairs" response format
+
+    :param columns: The columns ("timestamps" followed by the value columns)
+
+    :return: [timestamp, value] pairs for "lttb", [timestamp, min, max, average] lists for "minmax"
+    :rtype: list
+    """
+
+    columns = dict(columns)
+    timestamps = timestamps_to_strings(columns.pop("timestamps")).tolist()
+    return [list(point) for point in zip(timestamps, *[column.tolist() for column in columns.values()])]
+
+
+def downsample_rows(rows: list, points: int, method: str = "lttb"):
+    """
+
+    DOWNSAMPLE A DATE WISE SERIES
+    =================================
+
+    Function that downsamples the (timestamp, value) rows of one date.
+
+    :param rows: The (timestamp, value) rows resulted from the query
+    :param points: The number of points (buckets) required
+    :param method: The downsampling method, "lttb" or "minmax"
+
+    :return: [timestamp, value] pairs for "lttb", [timestamp, min, max, average] lists for "minmax"
+    :rtype: list
+
+    """
+
+    return columns_to_pairs(downsample_columns(*rows_to_arrays(rows), points, method))
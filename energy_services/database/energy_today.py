@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+ENERGY CONSUMED TODAY
+======================
+
+Module that computes the energy consumed today as (latest energy - energy at the start of the day).
+
+The start of the day energy (baseline) is looked up once per day and cached, the latest energy comes from the
+latest reading cache, so "/energy_meter/energy_core/total_energy_today" does not query the table on every request.
+The day rolls over at midnight in the plant timezone (not at the database server's curdate()).
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * pytz - to get the current date in the plant timezone
+"""
+
+# Standard Imports
+import asyncio
+import logging
+from datetime import date as date_type, datetime, timedelta
+from typing import Optional
+
+# External Imports
+import pytz
+
+# User Imports
+from ..utils import metrics
+from .async_read_operations import read_rows_async
+from .device_registry import Device
+from .latest_reading_cache import latest_reading_cache
+from .query_statements import statement_for_start_of_day_energy
+
+LOGGER = logging.getLogger(__name__)
+
+# The timezone of the plant, the one used by the device simulator
+PLANT_TIMEZONE = pytz.timezone("Asia/Kolkata")
+
+# The time (in seconds) after the end of a date (midnight in the plant timezone) from which the date is closed, so the
+# rows arriving late (batched by the devices or the ingestion) are in before its series is cached for good
+CLOSED_DAY_GRACE_SECONDS = 3600
+
+
+def initialize_plant_timezone(timezone: str):
+    """
+    Function used to initialize the global plant timezone variable ( from the main script)
+
+    :param timezone: The name of the timezone (such as Asia/Kolkata)
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    global PLANT_TIMEZONE
+    PLANT_TIMEZONE = pytz.timezone(timezone)
+
+
+def initialize_closed_day_grace(grace_seconds: float):
+    """
+    Function used to initialize the global closed day grace period ( from the main script)
+
+    :param grace_seconds: The time (in seconds) after the end of a date from which the date is closed
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if grace_seconds < 0:
+        raise ValueError("The closed day grace period should not be negative")
+
+    global CLOSED_DAY_GRACE_SECONDS
+    CLOSED_DAY_GRACE_SECONDS = grace_seconds
+
+
+def plant_today():
+    """
+    Function that returns today's date in the plant timezone
+
+    :return: Today's date in the format stored in the date column (YYYY-MM-DD)
+    :rtype: str
+    """
+
+    return datetime.now(PLANT_TIMEZONE).date().isoformat()
+
+
+def is_closed_day(date: str):
+    """
+    Function that checks whether a date is closed (its rows do not change any more), that is it ended (in the plant
+    timezone) more than CLOSED_DAY_GRACE_SECONDS ago
+
+    :param date: The date (YYYY-MM-DD)
+
+    :return: True if the date is closed
+    :rtype: bool
+    """
+
+    closed_until = (datetime.now(PLANT_TIMEZONE) - timedelta(seconds=CLOSED_DAY_GRACE_SECONDS)).date()
+    return date_type.fromisoformat(date) < closed_until
+
+
+def plant_time_to_utc(moment: datetime):
+    """
+    Function that converts a naive timestamp of the energy meter table (in the plant timezone) to utc
+
+    :param moment: The naive timestamp
+
+    :return: The aware utc timestamp
+    :rtype: datetime
+    """
+
+    return PLANT_TIMEZONE.localize(moment).astimezone(pytz.utc)
+
+
+class DayEnergyBaseline:
+    """
+    START OF THE DAY ENERGY BASELINE
+    ====================================
+
+    This class holds the energy of the first reading of the current (plant) day, looking it up again only when the
+    day changes.
+    """
+
+    def __init__(self, device: Optional[Device] = None):
+        """
+        :param device: The device whose baseline is cached, the default device when not given
+        """
+
+        self.device = device
+        self.date = None
+        self.baseline = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self):
+        """
+        The lock used to make sure only one lookup runs at a time (created lazily, so it is bound to the event loop
+        of the application)
+
+        :rtype: asyncio.Lock
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def get(self, engine, date: str):
+        """
+        Get the baseline (energy of the first reading) for the given date, looking it up if not cached
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+        :param date: The date for which the baseline is required
+
+        :return: The energy of the first reading of the date, None if there is no reading yet for the date
+        :rtype: Optional[float]
+        """
+
+        metrics.observe_cache("day_energy_baseline", self.date == date)
+        if self.date != date:
+            async with self.lock:
+                if self.date != date:
+                    statement = statement_for_start_of_day_energy(date, self.device)
+                    database_records = await read_rows_async(engine, statement, "start_of_day")
+
+                    # Until the first reading of the day arrives there is nothing to cache, so we look it up again
+                    # on the next request
+                    if not database_records:
+                        return None
+
+                    self.baseline = float(database_records[0][1])
+                    self.date = date
+                    LOGGER.info("Energy baseline for {date}: {baseline} (id {id})".format(
+                        date=date, baseline=self.baseline, id=database_records[0][0]))
+
+        return self.baseline
+
+
+DAY_ENERGY_BASELINE = DayEnergyBaseline()
+
+# The baselines of the devices other than the default one, by device id
+DEVICE_DAY_ENERGY_BASELINES = {}
+
+
+def day_energy_baseline(device: Optional[Device] = None):
+    """
+    Function that returns the start of the day energy baseline of a device (created on first use)
+
+    :param device: The device, the default device when not given
+
+    :return: The baseline of the device
+    :rtype: DayEnergyBaseline
+    """
+
+    if device is None or device.is_default:
+        return DAY_ENERGY_BASELINE
+
+    baseline = DEVICE_DAY_ENERGY_BASELINES.get(device.device_id)
+    if baseline is None or baseline.device is not device:
+        baseline = DEVICE_DAY_ENERGY_BASELINES[device.device_id] = DayEnergyBaseline(device)
+    return baseline
+
+
+async def total_energy_today(engine, device: Optional[Device] = None):
+    """
+
+    TOTAL ENERGY CONSUMED TODAY
+    ===============================
+
+    Function that computes the total energy consumed today as the latest energy (from the latest reading cache)
+    minus the cached start of the day energy.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param device: The device, the default device when not given
+
+    :return: The dictionary consisting of total energy consumed today, the date and the id of the latest reading
+    :rtype: dict
+
+    """
+
+    today = plant_today()
+    latest = await latest_reading_cache(device).get(engine)
+    baseline = await day_energy_baseline(device).get(engine, today)
+
+    # Right after midnight the latest reading can still be from the previous day
+    if baseline is None or latest.get("date") is None or str(latest["date"]) != today:
+        total_energy = 0
+    else:
+        total_energy = float(latest["energy"]) - baseline
+
+    return {"total_energy": total_energy, "date": today, "reading_id": latest["reading_id"]}
@@ -1,25 +1,94 @@
 # -*- coding: utf-8 -*-
 """ Module for creating Engine and session maker factory
+
+The reads can be spread over read replicas of the primary database (see ReplicaSet), the history routes get their
+engine from get_read_engine while the routes that need the freshest rows (such as the latest reading) keep using
+the primary (get_engine).
+
 This script requires that the following packages be installed within the Python
 environment you are running this script in.
 
     * logging - to perform logging operations
 
     * sqlalchemy - Package used to connect to a database and do SQL operations using orm_queries
+
+    * aiomysql - Async driver used by the asyncio engine (only when the async engine is enabled)
 """
 # Standard Imports
+import asyncio
+import itertools
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
 
 # External Imports
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, text
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+# User Imports
+from .table_models import ENERGY_LMEASURE_TABLE
 
 LOGGER = logging.getLogger(__name__)
 
 GLOBAL_DATABASE_ENGINE = None
 
+# The pool settings that can be given in the input parameters ("pool"), passed as is to create_engine
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_recycle", "pool_pre_ping", "pool_timeout")
+
+# The query used to check (and warm up) a connection
+PROBE_QUERY = text("SELECT 1")
+
+# The query for the timestamp of the latest reading, compared between the primary and a replica to know how far
+# behind the replica is
+FRESHNESS_QUERY = select(ENERGY_LMEASURE_TABLE.c.timestamp).order_by(ENERGY_LMEASURE_TABLE.c.id.desc()).limit(1)
+
+# How the reads are spread over the healthy replicas
+REPLICA_ROUTINGS = ("round_robin", "least_latency")
+
+
+def _pool_arguments(pool_options: Optional[dict]):
+    """
+    Function that returns the pool settings to be passed to create_engine, from the pool input parameters
+
+    :param pool_options: The pool input parameters (may have other keys such as "warm_up")
+
+    :return: The keyword arguments for create_engine
+    :rtype: dict
+    """
+
+    return {key: value for key, value in (pool_options or {}).items() if key in POOL_OPTIONS}
+
+
+def _connection_string(dialect, driver, user, password, host, database):
+    """
+    Function to build the connection string (url) from given input arguments
+
+    :param dialect: The database dialect being used
+    :type dialect: str
+    :param driver: The driver used to connect to the give database dialect
+    :type driver: str
+    :param user: The user to login into the database
+    :type user: str
+    :param password: The password of the user to login into the database
+    :type password: str
+    :param host: The host ID
+    :type host: str
+    :param database: The database name to connect to
+    :type database: str
+    :return: The connection string for sqlalchemy
+    :rtype: str
+    """
+
+    if not all(map(lambda arg: True if issubclass(type(arg), str) else False, [dialect, driver, user, password,
+                                                                               host, database])):
+        raise AttributeError("Invalid attribute type, should be string")
 
-def create_new_engine(dialect, driver, user, password, host, database):
+    return dialect + "+" + driver + "://" + user + ":" + password + "@" + host + "/" + database + "?charset=utf8mb4"
+
+
+def create_new_engine(dialect, driver, user, password, host, database, pool_options=None):
     """
     Function to Create new engine from given input arguments
     ===================================================================
@@ -36,19 +105,17 @@ def create_new_engine(dialect, driver, user, password, host, database):
     :type host: str
     :param database: The database name to connect to
     :type database: str
+    :param pool_options: The connection pool settings (pool_size, max_overflow, pool_recycle, pool_pre_ping and
+    pool_timeout), the sqlalchemy defaults are used for the settings not given
+    :type pool_options: Optional[dict]
     :return: New engine configured with given parameters
     :rtype: :class:`sqlalchemy.engine.create_engine`
     """
     try:
 
-        if not all(map(lambda arg: True if issubclass(type(arg), str) else False, [dialect, driver, user, password,
-                                                                                   host, database])):
-            raise AttributeError("Invalid attribute type, should be string")
-
-        connection_string = dialect + "+" + driver + "://" + user + ":" + password + "@" + host + "/" + \
-                            database + "?charset=utf8mb4"
+        connection_string = _connection_string(dialect, driver, user, password, host, database)
 
-        engine = create_engine(connection_string, echo=False)
+        engine = create_engine(connection_string, echo=False, **_pool_arguments(pool_options))
         LOGGER.info("Created Engine for {dialect} Connection at : {ip} using "
                     "{driver} to the {database} Database".format(dialect=dialect, ip=host, driver=driver,
                                                                  database=database))
@@ -58,11 +125,463 @@ def create_new_engine(dialect, driver, user, password, host, database):
         raise
 
 
-def initialize_global_engine(engine: Engine):
+def create_new_async_engine(dialect, async_driver, user, password, host, database, pool_options=None):
+    """
+    Function to Create new asyncio engine from given input arguments
+    ===================================================================
+
+    The returned engine talks to the database through an async driver (such as aiomysql), so awaiting a query
+    does not block the event loop the fastapi application is running on.
+
+    :param dialect: The database dialect being used
+    :type dialect: str
+    :param async_driver: The asyncio driver used to connect to the give database dialect (such as aiomysql)
+    :type async_driver: str
+    :param user: The user to login into the database
+    :type user: str
+    :param password: The password of the user to login into the database
+    :type password: str
+    :param host: The host ID
+    :type host: str
+    :param database: The database name to connect to
+    :type database: str
+    :param pool_options: The connection pool settings (same as create_new_engine)
+    :type pool_options: Optional[dict]
+    :return: New async engine configured with given parameters
+    :rtype: :class:`sqlalchemy.ext.asyncio.AsyncEngine`
+    """
+    try:
+
+        connection_string = _connection_string(dialect, async_driver, user, password, host, database)
+
+        engine = create_async_engine(connection_string, echo=False, **_pool_arguments(pool_options))
+        LOGGER.info("Created Async Engine for {dialect} Connection at : {ip} using "
+                    "{driver} to the {database} Database".format(dialect=dialect, ip=host, driver=async_driver,
+                                                                 database=database))
+        return engine
+    except AttributeError as err:
+        LOGGER.error(err)
+        raise
+
+
+def _open_and_probe(engine: Engine):
+    """
+    Function that checks out a connection from the pool of a (sync) engine and runs the probe query on it
+
+    :param engine: The sqlalchemy engine
+
+    :return: The open connection (to be closed by the caller, which returns it to the pool)
+    :rtype: Connection
+    """
+
+    connection = engine.connect()
+    try:
+        connection.execute(PROBE_QUERY)
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+async def _open_and_probe_async(engine: AsyncEngine):
+    """
+    Function that checks out a connection from the pool of an asyncio engine and runs the probe query on it
+
+    :param engine: The sqlalchemy asyncio engine
+
+    :return: The open connection (to be closed by the caller, which returns it to the pool)
+    :rtype: AsyncConnection
+    """
+
+    connection = await engine.connect()
+    try:
+        await connection.execute(PROBE_QUERY)
+    except Exception:
+        await connection.close()
+        raise
+    return connection
+
+
+async def warm_up_pool(engine: Union[Engine, AsyncEngine], connections: Optional[int] = None):
+    """
+
+    WARM UP THE CONNECTION POOL
+    ==============================
+
+    Function that opens the connections of the pool (all at once, so that they are all new connections and not the
+    same one checked out again) and returns them to the pool, so the first requests do not have to wait for the
+    connection (tcp, tls and authentication round trips) to the database. Called at the startup, before the
+    application accepts requests.
+
+    :param engine: The sqlalchemy engine (sync or asyncio)
+    :param connections: The number of connections to open, the pool size when not given
+
+    :return: The number of connections opened
+    :rtype: int
+    """
+
+    pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+    if connections is None:
+        connections = pool.size() if hasattr(pool, "size") else 1
+    if connections < 1:
+        return 0
+
+    start = time.perf_counter()
+    if isinstance(engine, AsyncEngine):
+        opened = await asyncio.gather(*[_open_and_probe_async(engine) for _ in range(connections)],
+                                      return_exceptions=True)
+        for connection in opened:
+            if not isinstance(connection, BaseException):
+                await connection.close()
+    else:
+        def _open_all():
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = [executor.submit(_open_and_probe, engine) for _ in range(connections)]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    results.append(error)
+            for connection in results:
+                if not isinstance(connection, BaseException):
+                    connection.close()
+            return results
+
+        opened = await asyncio.to_thread(_open_all)
+
+    errors = [connection for connection in opened if isinstance(connection, BaseException)]
+    for error in errors:
+        LOGGER.error("Could not open a connection while warming up the pool : {error}".format(error=error))
+
+    LOGGER.info("Warmed up the connection pool with {count} connections in {seconds:.3f} seconds".format(
+        count=len(opened) - len(errors), seconds=time.perf_counter() - start))
+    return len(opened) - len(errors)
+
+
+def pool_statistics(engine: Union[Engine, AsyncEngine]):
+    """
+    Function that returns the state of the connection pool of an engine
+
+    :param engine: The sqlalchemy engine (sync or asyncio)
+
+    :return: The pool class, its size, the connections checked out (in use), idle (checked in) and in overflow
+    (opened beyond the pool size), None for the numbers the pool does not keep
+    :rtype: dict
+    """
+
+    pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+
+    def _count(name):
+        method = getattr(pool, name, None)
+        return method() if callable(method) else None
+
+    return {"pool": type(pool).__name__, "size": _count("size"), "checked_out": _count("checkedout"),
+            "idle": _count("checkedin"), "overflow": _count("overflow"), "status": pool.status()}
+
+
+async def probe_database(engine: Union[Engine, AsyncEngine]):
+    """
+    Function that checks that the database can be reached, by running the probe query on a pooled connection
+
+    :param engine: The sqlalchemy engine (sync or asyncio)
+
+    :return: Whether the probe succeeded, the time it took (milliseconds) and the error when it did not succeed
+    :rtype: dict
+    """
+
+    start = time.perf_counter()
+    try:
+        if isinstance(engine, AsyncEngine):
+            await (await _open_and_probe_async(engine)).close()
+        else:
+            await asyncio.to_thread(lambda: _open_and_probe(engine).close())
+    except Exception as error:
+        LOGGER.error("Database probe failed : {error}".format(error=error))
+        return {"healthy": False, "latency_ms": round((time.perf_counter() - start) * 1000, 3), "error": str(error)}
+
+    return {"healthy": True, "latency_ms": round((time.perf_counter() - start) * 1000, 3), "error": None}
+
+
+async def read_latest_timestamp(engine: Union[Engine, AsyncEngine]):
+    """
+    Function that returns the timestamp of the latest reading of the energy meter table
+
+    :param engine: The sqlalchemy engine (sync or asyncio)
+
+    :return: The timestamp, None when the table is empty
+    :rtype: Optional[datetime]
+    """
+
+    if isinstance(engine, AsyncEngine):
+        async with engine.connect() as connection:
+            return (await connection.execute(FRESHNESS_QUERY)).scalar()
+
+    def _read():
+        with engine.connect() as connection:
+            return connection.execute(FRESHNESS_QUERY).scalar()
+
+    return await asyncio.to_thread(_read)
+
+
+class Replica:
+    """
+    READ REPLICA
+    ===============
+
+    This class holds the engine of a read replica along with what the health probes found out about it, whether it
+    can be reached, its latency and how far behind the primary it is.
+    """
+
+    def __init__(self, name: str, engine: Union[Engine, AsyncEngine]):
+        """
+        :param name: The name of the replica (its host)
+        :param engine: The sqlalchemy engine (sync or asyncio) connected to the replica
+        """
+
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.failures = 0
+        self.latency_ms = None
+        self.lag_seconds = None
+        self.error = None
+
+    def to_dictionary(self):
+        """
+        Function that returns the state of the replica
+
+        :return: The name, health, consecutive failures, latency, lag and last error of the replica
+        :rtype: dict
+        """
+
+        return {"name": self.name, "healthy": self.healthy, "failures": self.failures,
+                "latency_ms": self.latency_ms, "lag_seconds": self.lag_seconds, "error": self.error}
+
+
+class ReplicaSet:
+    """
+    PRIMARY AND READ REPLICAS
+    =============================
+
+    This class routes the reads to the read replicas of the primary database (round robin, or the replica with the
+    least latency), a background task probes every replica and ejects it after "failure_threshold" consecutive
+    failed probes, or while it is more than "max_lag_seconds" behind the primary, until a later probe finds it
+    healthy again. The reads go to the primary when no replica is available.
+    """
+
+    def __init__(self, routing: str = "round_robin", probe_interval: float = 5, failure_threshold: int = 2,
+                 max_lag_seconds: float = 10):
+        """
+        :param routing: How the reads are spread over the replicas, "round_robin" or "least_latency"
+        :param probe_interval: The time (in seconds) between the health probes of the replicas
+        :param failure_threshold: The number of consecutive failed probes after which a replica is ejected
+        :param max_lag_seconds: How far behind the primary (in seconds) a replica can be and still serve reads
+        """
+
+        self.routing = routing
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.max_lag_seconds = max_lag_seconds
+        self.primary: Optional[Union[Engine, AsyncEngine]] = None
+        self.replicas: list[Replica] = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def available(self, max_lag_seconds: Optional[float] = None):
+        """
+        Function that returns the replicas that can serve a read
+
+        :param max_lag_seconds: How far behind the primary (in seconds) a replica can be, the max_lag_seconds of the
+        set when not given
+
+        :return: The healthy replicas that are not lagging behind
+        :rtype: list[Replica]
+        """
+
+        max_lag_seconds = self.max_lag_seconds if max_lag_seconds is None else max_lag_seconds
+        return [replica for replica in self.replicas if replica.healthy and replica.lag_seconds is not None and
+                replica.lag_seconds <= max_lag_seconds]
+
+    def read_engine(self, max_lag_seconds: Optional[float] = None):
+        """
+        Function that returns the engine a read should be run on
+
+        :param max_lag_seconds: How far behind the primary (in seconds) the rows read can be, the max_lag_seconds
+        of the set when not given (0 always reads from the primary)
+
+        :return: The engine of a replica, the primary when no replica is available
+        :rtype: Union[Engine, AsyncEngine]
+        """
+
+        replicas = self.available(max_lag_seconds) if max_lag_seconds != 0 else []
+        if not replicas:
+            return self.primary
+        if self.routing == "least_latency":
+            return min(replicas, key=lambda replica: replica.latency_ms).engine
+        return replicas[next(self._counter) % len(replicas)].engine
+
+    async def _probe(self, replica: Replica, primary_timestamp):
+        """
+        Probe a replica, updating its latency, lag and health
+
+        :param replica: The replica
+        :param primary_timestamp: The timestamp of the latest reading on the primary
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        try:
+            start = time.perf_counter()
+            replica_timestamp = await read_latest_timestamp(replica.engine)
+            latency_ms = (time.perf_counter() - start) * 1000
+        except Exception as error:
+            replica.failures += 1
+            replica.error = str(error)
+            if replica.healthy and replica.failures >= self.failure_threshold:
+                replica.healthy = False
+                LOGGER.error("Ejected the read replica {name} : {error}".format(name=replica.name, error=error))
+            return
+
+        # Smoothing the latency, so a single slow probe does not move all the reads
+        replica.latency_ms = round(latency_ms if replica.latency_ms is None else
+                                   0.7 * replica.latency_ms + 0.3 * latency_ms, 3)
+        if primary_timestamp is None or replica_timestamp is None:
+            replica.lag_seconds = 0 if primary_timestamp is None else float("inf")
+        else:
+            replica.lag_seconds = max((primary_timestamp - replica_timestamp).total_seconds(), 0)
+
+        if not replica.healthy:
+            LOGGER.info("Read replica {name} is healthy again".format(name=replica.name))
+        replica.healthy, replica.failures, replica.error = True, 0, None
+
+    async def probe_all(self):
+        """
+        Probe all the replicas (concurrently)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if not self.replicas:
+            return
+
+        try:
+            primary_timestamp = await read_latest_timestamp(self.primary)
+        except Exception as error:
+            LOGGER.error("Could not read the latest timestamp of the primary : {error}".format(error=error))
+            return
+        await asyncio.gather(*[self._probe(replica, primary_timestamp) for replica in self.replicas])
+
+    async def _probe_forever(self):
+        """
+        Probe the replicas every probe_interval seconds until cancelled
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                LOGGER.error("Failed to probe the read replicas: {error}".format(error=error))
+            await asyncio.sleep(self.probe_interval)
+
+    @property
+    def is_running(self):
+        """
+        Whether the background probe task is running
+
+        :rtype: bool
+        """
+
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Start the background probe task (must be called from a running event loop, such as the startup event)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self.replicas and not self.is_running:
+            self._task = asyncio.get_running_loop().create_task(self._probe_forever())
+            LOGGER.info("Started probing {count} read replicas (every {interval} seconds)".format(
+                count=len(self.replicas), interval=self.probe_interval))
+
+    async def stop(self):
+        """
+        Stop the background probe task
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            LOGGER.info("Stopped probing the read replicas")
+
+    def to_dictionary(self):
+        """
+        Function that returns the state of the replica set
+
+        :return: The routing, the maximum lag and the state of every replica
+        :rtype: dict
+        """
+
+        return {"routing": self.routing, "max_lag_seconds": self.max_lag_seconds,
+                "replicas": [replica.to_dictionary() for replica in self.replicas]}
+
+
+READ_REPLICAS = ReplicaSet()
+
+
+def initialize_read_replicas(primary: Union[Engine, AsyncEngine], replicas: Optional[dict] = None,
+                             routing: str = "round_robin", probe_interval: float = 5, failure_threshold: int = 2,
+                             max_lag_seconds: float = 10):
+    """
+    Function used to initialize the global replica set ( from the main script)
+
+    :param primary: The sqlalchemy engine (sync or asyncio) connected to the primary database
+    :param replicas: The engines connected to the read replicas, by the name of the replica (its host)
+    :param routing: How the reads are spread over the replicas, "round_robin" or "least_latency"
+    :param probe_interval: The time (in seconds) between the health probes of the replicas
+    :param failure_threshold: The number of consecutive failed probes after which a replica is ejected
+    :param max_lag_seconds: How far behind the primary (in seconds) a replica can be and still serve reads
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if routing not in REPLICA_ROUTINGS:
+        raise ValueError("Invalid replica routing {routing}, should be one of {routings}".format(
+            routing=routing, routings=REPLICA_ROUTINGS))
+    if failure_threshold < 1:
+        raise ValueError("The replica failure threshold should be at least 1")
+
+    READ_REPLICAS.primary = primary
+    READ_REPLICAS.replicas = [Replica(name, engine) for name, engine in (replicas or {}).items()]
+    READ_REPLICAS.routing = routing
+    READ_REPLICAS.probe_interval = probe_interval
+    READ_REPLICAS.failure_threshold = failure_threshold
+    READ_REPLICAS.max_lag_seconds = max_lag_seconds
+
+
+def initialize_global_engine(engine: Union[Engine, AsyncEngine]):
     """
     Function used to initialize the global engine variable ( from the main script)
 
-    :param engine: The sqlalchemy engine used to connect to the database
+    :param engine: The sqlalchemy engine (sync or asyncio) used to connect to the database
 
     :return: Nothing
     :rtype: None
@@ -80,11 +599,43 @@ def get_engine():
     This function is used as the generator function that is required (to send the engine) for a parameter(engine)
     inside the read_root api.
 
-    :return: SqlAlchemy Engine
-    :rtype: Engine
+    :return: SqlAlchemy Engine (an AsyncEngine when the async engine is enabled in the input parameters)
+    :rtype: Union[Engine, AsyncEngine]
     """
 
     try:
         yield GLOBAL_DATABASE_ENGINE
     except Exception as error:
         LOGGER.error(error)
+
+
+def primary_engine(engine):
+    """
+    Function that returns the engine of the primary database, for the reads that should not go to a read replica
+    (such as the rollups, which are materialized on the primary and would be read incomplete from a lagging replica)
+
+    :param engine: The engine given to the read (the primary itself when no read replicas are set up)
+
+    :return: SqlAlchemy Engine of the primary database
+    :rtype: Union[Engine, AsyncEngine]
+    """
+
+    return READ_REPLICAS.primary if READ_REPLICAS.primary is not None else engine
+
+
+def get_read_engine():
+    """
+    GET READ ENGINE
+    ==================
+
+    This function is used as the dependency that sends the engine for the read only (history) api routes, a read
+    replica when one is healthy and not lagging behind (see ReplicaSet), the primary otherwise.
+
+    :return: SqlAlchemy Engine (an AsyncEngine when the async engine is enabled in the input parameters)
+    :rtype: Union[Engine, AsyncEngine]
+    """
+
+    try:
+        yield READ_REPLICAS.read_engine() if READ_REPLICAS.primary is not None else GLOBAL_DATABASE_ENGINE
+    except Exception as error:
+        LOGGER.error(error)
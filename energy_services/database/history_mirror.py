@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+HISTORY MIRROR
+======================
+
+Module that keeps a local copy (an embedded sqlite database) of the energy meter table, so that the history queries
+are served from the local disk instead of crossing the network to the (remote) primary database.
+
+A background job copies the rows added to the primary table (after the last copied id) in batches. As the rows are
+copied in the order of their id, the mirror holds every row up to the timestamp of the last copied row, the reads
+for an older range (see history_engine in read_operations) can be served by the mirror, the reads touching newer
+rows (such as today's series and the latest reading) still go to the primary.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * sqlalchemy - Package used to connect to the mirror and copy the rows (sqlite driver of the standard library)
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime
+from typing import Optional
+
+# External Imports
+from sqlalchemy import create_engine, event, insert, select, text
+from sqlalchemy.engine.base import Engine
+
+# User Imports
+from .async_read_operations import read_rows_async
+from .query_statements import statement_for_rows_after_id
+from .table_models import ENERGY_LMEASURE_TABLE, ENERGY_SCHEMA
+
+LOGGER = logging.getLogger(__name__)
+
+# The columns copied to the mirror (all the columns of the energy meter table)
+MIRROR_COLUMNS = tuple(ENERGY_LMEASURE_TABLE.c.keys())
+
+# The indexes of the mirror, for the date wise and the time range queries (the time range index is declared on the
+# energy meter table, it is created here for the mirrors made before it was)
+MIRROR_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_energy_lmeasure_date ON energy_lmeasure (date)",
+    "CREATE INDEX IF NOT EXISTS ix_energy_lmeasure_timestamp_id ON energy_lmeasure (timestamp, id)",
+)
+
+
+def create_mirror_engine(path: str):
+    """
+    Function to create the engine of the mirror database
+
+    The statements of this project are built on the energy meter table of the primary schema, the engine maps that
+    schema to the (only) database of the sqlite file, so the same statements run on the mirror as is.
+
+    :param path: The path of the sqlite file (created if it does not exist)
+
+    :return: The engine of the mirror
+    :rtype: Engine
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    engine = create_engine("sqlite:///" + path, echo=False, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _configure_connection(dbapi_connection, connection_record):
+        # Write ahead logging lets the history queries read while the sync job is writing
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    LOGGER.info("Created Engine for the history mirror at : {path}".format(path=path))
+    return engine.execution_options(schema_translate_map={ENERGY_SCHEMA: None})
+
+
+def create_mirror_table(conn):
+    """
+    Function that creates the energy meter table (and its indexes) in the mirror if it does not exist
+
+    :param conn: The sqlalchemy connection to the mirror
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    ENERGY_LMEASURE_TABLE.create(conn, checkfirst=True)
+    for statement in MIRROR_INDEXES:
+        conn.execute(text(statement))
+
+
+def read_mirror_state(conn):
+    """
+    Function that returns the last row (id and timestamp) copied to the mirror
+
+    :param conn: The sqlalchemy connection to the mirror
+
+    :return: The last copied id (0 if nothing is copied yet) and its timestamp
+    :rtype: tuple[int, Optional[datetime]]
+    """
+
+    state = conn.execute(select(ENERGY_LMEASURE_TABLE.c.id, ENERGY_LMEASURE_TABLE.c.timestamp)
+                         .order_by(ENERGY_LMEASURE_TABLE.c.id.desc()).limit(1)).first()
+    if state is None:
+        return 0, None
+    return state.id, state.timestamp
+
+
+class HistoryMirror:
+    """
+    LOCAL HISTORY MIRROR
+    ========================
+
+    This class runs the background job that copies the new rows of the primary table to the mirror, and knows until
+    which row (and timestamp) the mirror is complete.
+    """
+
+    def __init__(self, interval: float = 30, batch_size: int = 20000):
+        """
+        :param interval: The time (in seconds) to wait once the mirror has caught up with the primary table
+        :param batch_size: The maximum number of rows copied in one batch
+        """
+
+        self.interval = interval
+        self.batch_size = batch_size
+        self.enabled = False
+        self.engine: Optional[Engine] = None
+        self.last_id = None
+        self.last_timestamp = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _prepare(self):
+        """
+        Create the mirror table if required and read the last copied row
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.engine.begin() as conn:
+            create_mirror_table(conn)
+            self.last_id, self.last_timestamp = read_mirror_state(conn)
+
+    def _insert_rows(self, rows: list):
+        """
+        Insert a batch of rows (read from the primary table) into the mirror, in one transaction
+
+        :param rows: The rows, with the values of MIRROR_COLUMNS
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(ENERGY_LMEASURE_TABLE), [dict(zip(MIRROR_COLUMNS, row)) for row in rows])
+
+    async def run_once(self, engine):
+        """
+        Copy batches of rows until the mirror has caught up with the primary table
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the primary database
+
+        :return: The number of rows copied
+        :rtype: int
+        """
+
+        total_rows = 0
+        while True:
+            start_time = time.time()
+            statement = statement_for_rows_after_id(MIRROR_COLUMNS, self.last_id, self.batch_size)
+            rows = await read_rows_async(engine, statement, "mirror_sync")
+            if rows:
+                await asyncio.to_thread(self._insert_rows, rows)
+                self.last_id, self.last_timestamp = rows[-1].id, rows[-1].timestamp
+                total_rows += len(rows)
+                LOGGER.info("Copied {rows} rows to the history mirror up to id {id} in {time} Seconds".format(
+                    rows=len(rows), id=self.last_id, time=round(time.time() - start_time, 4)))
+
+            if len(rows) < self.batch_size:
+                return total_rows
+
+    async def _run_forever(self, engine):
+        """
+        Keep the mirror up to date until cancelled
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the primary database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        await asyncio.to_thread(self._prepare)
+        while True:
+            try:
+                await self.run_once(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                LOGGER.error("Failed to copy the rows to the history mirror: {error}".format(error=error))
+            await asyncio.sleep(self.interval)
+
+    @property
+    def is_running(self):
+        """
+        Whether the background job is running
+
+        :rtype: bool
+        """
+
+        return self._task is not None and not self._task.done()
+
+    def start(self, engine):
+        """
+        Start the background job (must be called from a running event loop, such as the startup event)
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the primary database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self.enabled and not self.is_running:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever(engine))
+            LOGGER.info("Started the history mirror sync (every {interval} seconds)".format(interval=self.interval))
+
+    async def stop(self):
+        """
+        Stop the background job
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            LOGGER.info("Stopped the history mirror sync")
+
+    def covers_until(self, until: datetime):
+        """
+        Whether the mirror holds all the rows older than the given timestamp
+
+        :param until: The timestamp (exclusive)
+
+        :return: True if the mirror can serve the rows older than the timestamp
+        :rtype: bool
+        """
+
+        if not self.enabled or self.engine is None or self.last_timestamp is None:
+            return False
+        return self.last_timestamp >= until
+
+    def covers(self, date_of_rows: str):
+        """
+        Whether the mirror holds all the rows of the given date
+
+        :param date_of_rows: The date (YYYY-MM-DD)
+
+        :return: True if the mirror can serve the rows of the date
+        :rtype: bool
+        """
+
+        if not self.enabled or self.engine is None or self.last_timestamp is None:
+            return False
+        return self.last_timestamp.date() > date.fromisoformat(date_of_rows)
+
+
+HISTORY_MIRROR = HistoryMirror()
+
+
+def initialize_history_mirror(enabled: bool, path: str = "cache/history_mirror.sqlite", interval: float = 30,
+                              batch_size: int = 20000):
+    """
+    Function used to initialize the global history mirror ( from the main script)
+
+    :param enabled: Whether the mirror is maintained (and can serve the history queries)
+    :param path: The path of the sqlite file of the mirror
+    :param interval: The time (in seconds) to wait once the mirror has caught up with the primary table
+    :param batch_size: The maximum number of rows copied in one batch
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if batch_size < 1:
+        raise ValueError("The history mirror batch size should be at least 1")
+
+    HISTORY_MIRROR.enabled = enabled
+    HISTORY_MIRROR.interval = interval
+    HISTORY_MIRROR.batch_size = batch_size
+    if enabled:
+        HISTORY_MIRROR.engine = create_mirror_engine(path)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+LATEST READING CACHE
+======================
+
+Module that keeps the latest row of the energy meter table in memory, so that the clients polling
+"/energy_meter/energy_core/current_update" are served from memory instead of running one query per poll.
+
+A single background task refreshes the reading every "ttl" seconds, so any number of clients cost one query per
+interval. If the background task is not running (or is lagging behind) the reading is refreshed on demand, and
+concurrent callers share that single refresh.
+
+Every device has its own cache (see latest_reading_cache), only the one of the default device is refreshed in the
+background, the others are refreshed on demand.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * asyncio - to run the background refresh task
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import time
+from typing import Optional
+
+# User Imports
+from ..utils import metrics
+from .async_read_operations import read_rows_async
+from .device_registry import Device
+from .query_statements import statement_for_latest_reading
+from .read_operations import row_to_record
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LatestReadingCache:
+    """
+    IN-PROCESS CACHE FOR THE LATEST READING
+    ===========================================
+
+    This class holds the latest reading (as its record, see row_to_record) along with the time at which it was read
+    from the database, every request gets a dictionary of its own built from the record.
+    """
+
+    def __init__(self, ttl_seconds: float = 2.0, device: Optional[Device] = None):
+        """
+        :param ttl_seconds: The time (in seconds) for which a reading read from the database is served
+        :param device: The device whose latest reading is cached, the default device when not given
+        """
+
+        self.ttl_seconds = ttl_seconds
+        self.device = device
+        self.reading = None
+        self.reading_id = None
+        self.refreshed_at = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        # The functions called with the cache whenever a new reading is read (such as the live reading broadcaster)
+        self.listeners = []
+
+    @property
+    def lock(self):
+        """
+        The lock used to make sure only one refresh runs at a time (created lazily, so it is bound to the event loop
+        of the application rather than the one present at import time)
+
+        :rtype: asyncio.Lock
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def age(self):
+        """
+        The time (in seconds) since the cached reading was read from the database, None if never read
+
+        :rtype: Optional[float]
+        """
+
+        if self.refreshed_at is None:
+            return None
+        return time.monotonic() - self.refreshed_at
+
+    async def refresh(self, engine):
+        """
+        Read the latest row from the database and replace the cached reading
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        database_records = await read_rows_async(engine, statement_for_latest_reading(self.device),
+                                                 "latest_reading")
+
+        reading = row_to_record(database_records[-1]) if database_records else None
+        previous_id = self.reading_id
+        self.reading = reading
+        self.reading_id = getattr(reading, "id", None)
+        self.refreshed_at = time.monotonic()
+
+        if self.reading_id is not None and self.reading_id != previous_id:
+            for listener in self.listeners:
+                listener(self)
+
+    async def refresh_if_stale(self, engine):
+        """
+        Refresh the reading if it is older than allowed, so that reading_id (and reading) are current (used to check
+        whether a client already has the latest reading, without building the reading)
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        # While the background task is running it keeps the reading fresh, so we only step in when it is lagging
+        max_age = self.ttl_seconds * 2 if self.is_running else self.ttl_seconds
+
+        hit = True
+        if self.age is None or self.age > max_age:
+            async with self.lock:
+                # Some other request might have refreshed the reading while we were waiting for the lock
+                if self.age is None or self.age > max_age:
+                    await self.refresh(engine)
+                    hit = False
+        metrics.observe_cache("latest_reading", hit)
+
+    async def get(self, engine):
+        """
+        Get the latest reading along with its id and age, refreshing it first if it is older than allowed
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: The latest parameters with "reading_id" and "age_seconds" keys added
+        :rtype: dict
+        """
+
+        await self.refresh_if_stale(engine)
+        return self.to_dictionary()
+
+    def to_dictionary(self):
+        """
+        The cached reading as a dictionary of its own (see get)
+
+        :return: The latest parameters with "reading_id" and "age_seconds" keys added
+        :rtype: dict
+        """
+
+        data = self.reading._asdict() if self.reading is not None else {}
+        data["reading_id"] = self.reading_id
+        data["age_seconds"] = round(self.age, 3)
+        return data
+
+    @property
+    def is_running(self):
+        """
+        Whether the background refresh task is running
+
+        :rtype: bool
+        """
+
+        return self._task is not None and not self._task.done()
+
+    async def _refresh_forever(self, engine):
+        """
+        Refresh the reading every ttl seconds until cancelled
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        while True:
+            try:
+                async with self.lock:
+                    await self.refresh(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                # A failed refresh should not stop the task, the next interval will try again
+                LOGGER.error("Failed to refresh the latest reading: {error}".format(error=error))
+            await asyncio.sleep(self.ttl_seconds)
+
+    def start(self, engine):
+        """
+        Start the background refresh task (must be called from a running event loop, such as the startup event)
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if not self.is_running:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_forever(engine))
+            LOGGER.info("Started the latest reading refresh task (every {ttl} seconds)".format(ttl=self.ttl_seconds))
+
+    async def stop(self):
+        """
+        Stop the background refresh task
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            LOGGER.info("Stopped the latest reading refresh task")
+
+
+LATEST_READING_CACHE = LatestReadingCache()
+
+
+def initialize_latest_reading_cache(ttl_seconds: float):
+    """
+    Function used to initialize the ttl of the global latest reading cache ( from the main script)
+
+    :param ttl_seconds: The time (in seconds) for which a reading read from the database is served
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if ttl_seconds <= 0:
+        raise ValueError("The latest reading ttl should be greater than zero")
+
+    LATEST_READING_CACHE.ttl_seconds = ttl_seconds
+    for cache in DEVICE_LATEST_READING_CACHES.values():
+        cache.ttl_seconds = ttl_seconds
+
+
+# The latest reading caches of the devices other than the default one, by device id
+DEVICE_LATEST_READING_CACHES = {}
+
+
+def latest_reading_cache(device: Optional[Device] = None):
+    """
+    Function that returns the latest reading cache of a device (created on first use)
+
+    :param device: The device, the default device when not given
+
+    :return: The latest reading cache of the device
+    :rtype: LatestReadingCache
+    """
+
+    if device is None or device.is_default:
+        return LATEST_READING_CACHE
+
+    cache = DEVICE_LATEST_READING_CACHES.get(device.device_id)
+    if cache is None or cache.device is not device:
+        cache = DEVICE_LATEST_READING_CACHES[device.device_id] = LatestReadingCache(LATEST_READING_CACHE.ttl_seconds,
+                                                                                   device)
+    return cache
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+PAGINATION
+======================
+
+Module that contains the continuation tokens (cursors) used to page through the rows of a time range.
+
+A cursor holds the (timestamp, id) of the last row of a page, the next page is queried from right after that row
+(see statement_for_range_query), so pulling a long range costs the same for every page and no rows are skipped or
+repeated.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+"""
+
+# Standard Imports
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+
+LOGGER = logging.getLogger(__name__)
+
+
+def encode_cursor(timestamp, row_id: int):
+    """
+    Function that returns the continuation token for the row a page ended at
+
+    :param timestamp: The timestamp of the last row of the page
+    :param row_id: The id of the last row of the page
+
+    :return: The url safe continuation token
+    :rtype: str
+    """
+
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat(sep=" ")
+    payload = json.dumps({"timestamp": str(timestamp), "id": int(row_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Function that returns the (timestamp, id) of the row a page ended at, from its continuation token
+
+    :param cursor: The continuation token sent by the client
+
+    :return: The timestamp and the id of the last row of the previous page
+    :rtype: tuple[datetime, int]
+    """
+
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(payload)
+        return datetime.fromisoformat(position["timestamp"]), int(position["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def range_page_to_dictionary(parameters: list[str], records: list, page_size: int):
+    """
+
+    CONVERT DATABASE RECORDS TO DICTIONARY - TIME RANGE PAGE
+    ============================================================
+
+    This function is used to convert one page of (id, timestamp, parameters...) records to the dictionary (json)
+    sent to the client. This is specifically used for conversion required by
+    "/energy_meter/energy_core/read_parameter_range" api route.
+
+    :param parameters: The parameters that were queried
+    :param records: The results from SqlAlchemy query.
+    :param page_size: The page size the records were queried with
+
+    :return: The dictionary of the columns, the rows ([timestamp, value, ...]) and the cursor for the next page
+    (None when this is the last page)
+    :rtype: dict
+
+    """
+
+    rows = [list(record[1:]) for record in records]
+
+    next_cursor = None
+    if len(records) == page_size:
+        next_cursor = encode_cursor(records[-1][1], records[-1][0])
+
+    return {"columns": ["timestamp", *parameters], "rows": rows, "next_cursor": next_cursor}
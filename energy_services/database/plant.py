@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+PLANT AGGREGATES
+======================
+
+Module that computes the plant level values (of all the devices together), the values of every device are read
+concurrently (see fan_out), so the time taken is that of the slowest device rather than the sum of all of them.
+
+A device that fails (or does not respond within FAN_OUT_TIMEOUT) does not fail the plant value, it is left out and
+reported in the "errors" of the result.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to combine the series of the devices
+"""
+
+# Standard Imports
+import asyncio
+import logging
+from datetime import date as date_type, datetime, timedelta
+
+# External Imports
+import numpy as np
+
+# User Imports
+from .day_series_cache import read_day_series
+from .device_registry import all_devices
+from .downsampling import grid_averages
+from .energy_today import plant_today, total_energy_today
+from .latest_reading_cache import latest_reading_cache
+from .table_models import energy_column
+
+LOGGER = logging.getLogger(__name__)
+
+# The time (in seconds) a device is waited for before it is left out of a plant value
+FAN_OUT_TIMEOUT = 30
+
+# How the series of the devices are combined, "sum" (such as power, energy) or "average" (such as voltage, frequency)
+PLANT_AGGREGATES = ("sum", "average")
+
+
+async def fan_out(function, devices=None):
+    """
+
+    FAN OUT TO THE DEVICES
+    =========================
+
+    Function that runs function(device) for every device concurrently.
+
+    :param function: The coroutine function, called with the device
+    :param devices: The devices, all the registered devices when not given
+
+    :return: The results by device id and the errors (of the devices that failed) by device id
+    :rtype: tuple[dict, dict]
+
+    """
+
+    devices = all_devices() if devices is None else devices
+    results = await asyncio.gather(*[asyncio.wait_for(function(device), FAN_OUT_TIMEOUT) for device in devices],
+                                   return_exceptions=True)
+
+    values, errors = {}, {}
+    for device, result in zip(devices, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[device.device_id] = "No response within {timeout} seconds".format(timeout=FAN_OUT_TIMEOUT)
+        elif isinstance(result, Exception):
+            errors[device.device_id] = str(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            values[device.device_id] = result
+
+    for device_id, error in errors.items():
+        LOGGER.error("Device {device_id} left out of the plant value: {error}".format(device_id=device_id,
+                                                                                       error=error))
+    return values, errors
+
+
+async def plant_current_values(engine):
+    """
+    Function that returns the latest reading of every device, along with the total power and energy of the plant
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+    :return: The total power and energy, the readings and the errors by device id
+    :rtype: dict
+    """
+
+    readings, errors = await fan_out(lambda device: latest_reading_cache(device).get(engine))
+
+    return {"total_power": sum(float(reading.get("power") or 0) for reading in readings.values()),
+            "total_energy": sum(float(reading.get("energy") or 0) for reading in readings.values()),
+            "devices": readings, "errors": errors}
+
+
+async def plant_total_energy_today(engine):
+    """
+    Function that returns the energy consumed today by every device, along with the total of the plant
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+    :return: The total energy, the date, the energy of every device and the errors by device id
+    :rtype: dict
+    """
+
+    totals, errors = await fan_out(lambda device: total_energy_today(engine, device))
+
+    return {"total_energy": sum(total["total_energy"] for total in totals.values()), "date": plant_today(),
+            "devices": {device_id: total["total_energy"] for device_id, total in totals.items()}, "errors": errors}
+
+
+async def plant_parameter_series(engine, parameter: str, date: str, points: int, aggregate: str = "sum"):
+    """
+
+    PLANT SERIES OF A PARAMETER
+    ===============================
+
+    Function that returns the series of a parameter for a date for the plant, the series of every device is averaged
+    over the same "points" buckets of the day and the devices are combined bucket by bucket.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+    :param parameter: The parameter such as energy, power
+    :param date: The date (YYYY-MM-DD)
+    :param points: The number of buckets of the day
+    :param aggregate: How the devices are combined, "sum" or "average"
+
+    :return: The bucket timestamps (epoch milliseconds) and plant values, the values of every device and the errors
+    by device id (the buckets without values are None)
+    :rtype: dict
+
+    """
+
+    if aggregate not in PLANT_AGGREGATES:
+        raise ValueError("Invalid aggregate {aggregate}, should be one of {aggregates}".format(
+            aggregate=aggregate, aggregates=PLANT_AGGREGATES))
+
+    # Checking the parameter once, rather than as an error of every device
+    energy_column(parameter)
+    start_of_day = datetime.combine(date_type.fromisoformat(date), datetime.min.time())
+    start = int(np.datetime64(start_of_day, "ms").astype(np.int64))
+    width = timedelta(days=1) / timedelta(milliseconds=1) / points
+
+    async def device_series(device):
+        source, _ = await read_day_series(engine, parameter, [date], None, device)
+        return grid_averages(source[date]["timestamps"], source[date]["values"], start, width, points)
+
+    series, errors = await fan_out(device_series)
+
+    timestamps = (start + np.arange(points) * width).astype(np.int64)
+    if series:
+        stacked = np.vstack(list(series.values()))
+        # A bucket is missing for the plant only when it is missing for every device
+        counts = np.count_nonzero(~np.isnan(stacked), axis=0)
+        totals = np.nansum(stacked, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(counts > 0, totals if aggregate == "sum" else totals / counts, np.nan)
+    else:
+        values = np.full(points, np.nan)
+
+    def _to_list(column):
+        return [None if np.isnan(value) else value for value in column.tolist()]
+
+    return {"timestamps": timestamps.tolist(), "values": _to_list(values),
+            "devices": {device_id: _to_list(column) for device_id, column in series.items()}, "errors": errors}
@@ -5,27 +5,118 @@ QUERY STATEMENTS
 
 Module for that contains common queries used in this project
 
+The statements are built with sqlalchemy core on the declared energy meter table, the values (dates, ids etc) are
+bound parameters, so the statement of a query is the same on every call and sqlalchemy compiles it only once (the
+compiled form is cached by the engine). The statements for a parameter are also built only once (lru_cache) and only
+the columns of ENERGY_PARAMETER_COLUMNS can be queried.
+
+Every statement is for a device (see device_registry), the default device (the energy meter table) when not given.
+
 This script requires that the following packages be installed within the Python
 environment you are running this script in.
 
     * logging - to perform logging operations
+
+    * sqlalchemy - Package used to build the sql statements
 """
 
 # Standard Imports
 import logging
+from datetime import date as date_type
+from functools import lru_cache
+from typing import Optional
+
+# External Imports
+from sqlalchemy import Integer, and_, bindparam, func, or_, select
+
+# User Imports
+from .device_registry import Device, get_device
+from .sql_functions import epoch_milliseconds, numeric_records
+from .table_models import ENERGY_LMEASURE_TABLE, ordered_parameters
 
 LOGGER = logging.getLogger(__name__)
 
+TABLE = ENERGY_LMEASURE_TABLE
+
 # Some Global variables that we'll be using for storing the sql statements
-LATEST_ALL_PARAMETER_QUERY = "SELECT * FROM u759114105_energy_meter.energy_lmeasure ORDER BY id DESC LIMIT 1"
+LATEST_ALL_PARAMETER_QUERY = select(TABLE).order_by(TABLE.c.id.desc()).limit(1)
+
+# The columns read for the latest reading, the columns of the energy meter table (a device table can have more)
+LATEST_READING_COLUMNS = tuple(TABLE.c.keys())
+
+TOTAL_ENERGY_CONSUMED_TODAY_QUERY = select(
+    select(TABLE.c.energy).order_by(TABLE.c.id.desc()).limit(1).scalar_subquery() -
+    select(TABLE.c.energy).where(TABLE.c.date == func.curdate()).order_by(TABLE.c.id).limit(1).scalar_subquery())
+
+
+def _to_date(date):
+    """
+    Function that converts a date sent by the client (YYYY-MM-DD) to a date object
+
+    :param date: The date
+    :type date: Union[str, date]
+    :return: The date object
+    :rtype: date
+    """
+
+    if isinstance(date, date_type):
+        return date
+    return date_type.fromisoformat(date)
+
+
+@lru_cache(maxsize=None)
+def _latest_reading_query(device: Device):
+    """
+    Function that builds (once for every device) the statement for the latest reading of a device
+
+    :param device: The device
+    :type device: Device
+    :return: The statement
+    :rtype: Select
+    """
+
+    table = device.table
+    return device.filter(select(*[table.c[column] for column in LATEST_READING_COLUMNS])) \
+        .order_by(table.c.id.desc()).limit(1)
+
+
+def statement_for_latest_reading(device: Optional[Device] = None):
+    """
+    Function that returns a sql query statement to return the latest reading (all the columns) of a device
+
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
+    :return: The sql query to get the latest reading
+    :rtype: Select
+    """
+    return _latest_reading_query(device or get_device())
+
 
-TOTAL_ENERGY_CONSUMED_TODAY_QUERY = "SELECT	" \
-                              "(SELECT energy FROM u759114105_energy_meter.energy_lmeasure ORDER BY id DESC LIMIT 1)-" \
-                              "(SELECT energy FROM u759114105_energy_meter.energy_lmeasure WHERE date = curdate()" \
-                              "ORDER BY id LIMIT 1)"
+@lru_cache(maxsize=None)
+def _date_query(device, parameter, limit):
+    """
+    Function that builds (once for every device, parameter and limit) the statement for the values of a parameter on
+    a date
+
+    :param device: The device
+    :type device: Device
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :type parameter: str
+    :param limit: The maximum number of rows returned, None for no limit
+    :type limit: Optional[int]
+    :return: The statement with the date as a bound parameter
+    :rtype: Select
+    """
+
+    table = device.table
+    statement = device.filter(select(table.c.timestamp, device.column(parameter))
+                              .where(table.c.date == bindparam("date")))
+    if limit is not None:
+        statement = statement.limit(int(limit))
+    return statement
 
 
-def statement_for_date_query(parameter, date):
+def statement_for_date_query(parameter, date, limit=100000, device: Optional[Device] = None):
     """
     Function that returns a sql query statement to return values for given parameter and date
 
@@ -33,10 +124,248 @@ def statement_for_date_query(parameter, date):
     :type parameter: str
     :param date: The date for which we need the values
     :type date: str
+    :param limit: The maximum number of rows returned, None for no limit (used when the rows are streamed)
+    :type limit: Optional[int]
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
     :return: The sql query to get the values
-    :rtype: str
+    :rtype: Select
+    """
+    device = device or get_device()
+    statement = _date_query(device, parameter, limit).params(date=_to_date(date))
+    LOGGER.info("Date query for {parameter} on {date} of {device}".format(parameter=parameter, date=date,
+                                                                         device=device.device_id))
+    return statement
+
+
+# The maximum number of rows of the series of a date (a date returning that many rows may have been cut short)
+DATE_SERIES_LIMIT = 100000
+
+
+@lru_cache(maxsize=None)
+def _date_series_query(device, parameter, limit):
+    """
+    Function that builds (once for every device, parameter and limit) the statement for the series of a parameter on
+    a date, with the timestamps as epoch milliseconds
+
+    :param device: The device
+    :type device: Device
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :type parameter: str
+    :param limit: The maximum number of rows returned, None for no limit
+    :type limit: Optional[int]
+    :return: The statement with the date as a bound parameter
+    :rtype: Select
+    """
+
+    table = device.table
+    statement = device.filter(select(epoch_milliseconds(table.c.timestamp).label("timestamp"),
+                                     device.column(parameter)).where(table.c.date == bindparam("date")))
+    if limit is not None:
+        statement = statement.limit(int(limit))
+    return numeric_records(statement)
+
+
+def statement_for_date_series(parameter, date, limit=DATE_SERIES_LIMIT, device: Optional[Device] = None):
+    """
+    Function that returns a sql query statement to return the series (epoch millisecond timestamp and value) of a
+    given parameter on a given date, the rows are loaded into numpy columns (see rows_to_arrays)
+
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :type parameter: str
+    :param date: The date for which we need the values
+    :type date: str
+    :param limit: The maximum number of rows returned, None for no limit
+    :type limit: Optional[int]
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
+    :return: The sql query to get the series
+    :rtype: Select
+    """
+    device = device or get_device()
+    statement = _date_series_query(device, parameter, limit).params(date=_to_date(date))
+    LOGGER.info("Date series query for {parameter} on {date} of {device}".format(parameter=parameter, date=date,
+                                                                                device=device.device_id))
+    return statement
+
+
+# Bounded, as the sets of parameters come from the clients (up to 2 ** 16 of them for every device)
+@lru_cache(maxsize=256)
+def _date_series_batch_query(device, parameters):
+    """
+    Function that builds (once for every device and set of parameters) the statement for the series of several
+    parameters on several dates, with the timestamps and the dates (the date column the rows are selected by) as
+    epoch milliseconds
+
+    :param device: The device
+    :type device: Device
+    :param parameters: The parameters that need to be queried
+    :type parameters: tuple[str]
+    :return: The statement with the dates as an (expanding) bound parameter and the limit as a bound parameter
+    :rtype: Select
+    """
+
+    table = device.table
+    return numeric_records(device.filter(select(epoch_milliseconds(table.c.timestamp).label("timestamp"),
+                                                epoch_milliseconds(table.c.date).label("date"),
+                                                *[device.column(parameter) for parameter in parameters])
+                                         .where(table.c.date.in_(bindparam("dates", expanding=True))))
+                           .limit(bindparam("limit", type_=Integer, literal_execute=True)))
+
+
+def statement_for_date_series_batch(parameters, dates, limit=DATE_SERIES_LIMIT, device: Optional[Device] = None):
+    """
+    Function that returns a sql query statement to return the series (epoch millisecond timestamp, epoch millisecond
+    date and the values of every parameter) of given parameters on given dates, in a single scan of the table
+
+    :param parameters: The parameters (columns) that need to be queried such as energy, power, the columns of the
+    statement are in the order of ordered_parameters (without repeats)
+    :type parameters: list[str]
+    :param dates: The dates for which we need the values
+    :type dates: list[str]
+    :param limit: The maximum number of rows of every date, the statement returns at most this many rows for every
+    date given (a date may still get more, to be cut by the caller)
+    :type limit: int
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
+    :return: The sql query to get the series
+    :rtype: Select
+    """
+    device = device or get_device()
+    statement = _date_series_batch_query(device, ordered_parameters(parameters)) \
+        .params(dates=[_to_date(date) for date in dates], limit=int(limit) * len(dates))
+    LOGGER.info("Date series batch query for {parameters} on {dates} of {device}".format(
+        parameters=parameters, dates=dates, device=device.device_id))
+    return statement
+
+
+@lru_cache(maxsize=None)
+def _start_of_day_energy_query(device: Device):
+    """
+    Function that builds (once for every device) the statement for the first reading of a device on a date
+
+    :param device: The device
+    :type device: Device
+    :return: The statement with the date as a bound parameter
+    :rtype: Select
+    """
+
+    table = device.table
+    return device.filter(select(table.c.id, table.c.energy).where(table.c.date == bindparam("date"))) \
+        .order_by(table.c.id).limit(1)
+
+
+def statement_for_start_of_day_energy(date, device: Optional[Device] = None):
+    """
+    Function that returns a sql query statement to return the first reading (id and energy) of a given date, which is
+    the baseline the energy consumed on that date is measured from
+
+    :param date: The date for which we need the first reading
+    :type date: str
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
+    :return: The sql query to get the first reading
+    :rtype: Select
     """
-    statement = f"SELECT timestamp, {parameter} FROM u759114105_energy_meter.energy_lmeasure WHERE date = '{date}' " \
-                f"LIMIT 100000"
-    LOGGER.info(statement)
+    device = device or get_device()
+    statement = _start_of_day_energy_query(device).params(date=_to_date(date))
+    LOGGER.info("Start of day energy query on {date} of {device}".format(date=date, device=device.device_id))
+    return statement
+
+
+@lru_cache(maxsize=None)
+def _rows_after_id_query(columns):
+    """
+    Function that builds (once for every set of columns) the statement for the rows added after an id
+
+    :param columns: The columns that need to be queried
+    :type columns: tuple[str]
+    :return: The statement with the id and the batch size as bound parameters
+    :rtype: Select
+    """
+
+    return select(*[TABLE.c[column] for column in columns]).where(TABLE.c.id > bindparam("last_id")) \
+        .order_by(TABLE.c.id).limit(bindparam("batch_size"))
+
+
+def statement_for_rows_after_id(columns, last_id, batch_size):
+    """
+    Function that returns a sql query statement to return the given columns of the rows added after a given id, in
+    the order of their id (used by the background jobs that process the table incrementally)
+
+    :param columns: The columns that need to be queried
+    :type columns: Iterable[str]
+    :param last_id: The id of the last row already processed
+    :type last_id: int
+    :param batch_size: The maximum number of rows returned
+    :type batch_size: int
+    :return: The sql query to get the rows
+    :rtype: Select
+    """
+    return _rows_after_id_query(tuple(columns)).params(last_id=int(last_id), batch_size=int(batch_size))
+
+
+# Bounded, as the sets of parameters come from the clients (up to 2 ** 16 of them for every device)
+@lru_cache(maxsize=256)
+def _range_query(device, parameters, first_page):
+    """
+    Function that builds (once for every device and set of parameters) the statement for a page of a time range, the
+    page is a range scan of the (timestamp, id) index of the table (see table_models.TIMESTAMP_INDEX_COLUMNS)
+
+    :param device: The device
+    :type device: Device
+    :param parameters: The parameters that need to be queried
+    :type parameters: tuple[str]
+    :param first_page: Whether the statement is for the first page (without the keyset condition)
+    :type first_page: bool
+    :return: The statement with the range, the keyset and the page size as bound parameters
+    :rtype: Select
+    """
+
+    table = device.table
+    conditions = [table.c.timestamp >= bindparam("start"), table.c.timestamp < bindparam("end")]
+    if not first_page:
+        conditions.append(or_(table.c.timestamp > bindparam("after_timestamp"),
+                              and_(table.c.timestamp == bindparam("after_timestamp"),
+                                   table.c.id > bindparam("after_id"))))
+
+    statement = select(table.c.id, table.c.timestamp, *[device.column(parameter) for parameter in parameters]) \
+        .where(*conditions)
+    return device.filter(statement).order_by(table.c.timestamp, table.c.id).limit(bindparam("page_size"))
+
+
+def statement_for_range_query(parameters, start, end, page_size, after_timestamp=None, after_id=None,
+                              device: Optional[Device] = None):
+    """
+    Function that returns a sql query statement to return one page of the values of given parameters between two
+    timestamps. The pages are ordered by (timestamp, id) and the next page starts after the (timestamp, id) of the
+    last row of the previous page (keyset pagination), so no page has to skip over the rows of the previous pages.
+
+    :param parameters: The parameters (columns) that need to be queried such as energy, power, the columns of the
+    statement are in the order of ordered_parameters (without repeats)
+    :type parameters: list[str]
+    :param start: The start of the range (inclusive)
+    :type start: datetime
+    :param end: The end of the range (exclusive)
+    :type end: datetime
+    :param page_size: The maximum number of rows in the page
+    :type page_size: int
+    :param after_timestamp: The timestamp of the last row of the previous page, None for the first page
+    :type after_timestamp: Optional[datetime]
+    :param after_id: The id of the last row of the previous page, None for the first page
+    :type after_id: Optional[int]
+    :param device: The device, the default device when not given
+    :type device: Optional[Device]
+    :return: The sql query (with bound parameters) to get the page
+    :rtype: Select
+    """
+
+    device = device or get_device()
+    values = {"start": start, "end": end, "page_size": int(page_size)}
+    if after_timestamp is not None:
+        values.update(after_timestamp=after_timestamp, after_id=int(after_id))
+
+    statement = _range_query(device, ordered_parameters(parameters), after_timestamp is None).params(**values)
+    LOGGER.info("Range query for {parameters} from {start} to {end} of {device}".format(
+        parameters=parameters, start=start, end=end, device=device.device_id))
     return statement
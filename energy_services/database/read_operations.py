@@ -14,36 +14,72 @@ This script contains the following function
 
 # Standard Imports
 import logging
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
 
 # External Imports
+import numpy as np
 from sqlalchemy import text
 from sqlalchemy.engine.base import Engine
 
+# User Imports
+from ..utils import metrics
+from ..utils.responses import dumps
+from .downsampling import columns_to_pairs
+from .series_formats import date_wise_parameters_to_columns
+from .sql_functions import NUMERIC_RECORDS
+
 LOGGER = logging.getLogger(__name__)
 
-# The below parameters represent a sample output of the json required for energy request api
-ENERGY_PARAMETERS = {
-    "id": "11438598",
-    "date": "2022-03-03",
-    "timestamp": "2022-03-03 16:35:24",
-    "energy": "2100940",
-    "power": "181.286",
-    "avg_power_factor": "-0.1505",
-    "avg_current": "1.6544",
-    "avg_voltage": "242.575",
-    "power_factor_1": "0.3025",
-    "power_factor_2": "-0.0705",
-    "power_factor_3": "0.0624",
-    "phase_current_Ir": "1.7791",
-    "phase_current_Iy": "1.462",
-    "phase_current_Iz": "1.7223",
-    "phase_voltage_Ir": "241.739",
-    "phase_voltage_Iy": "241",
-    "phase_voltage_Iz": "244.986",
-    "frequency": "50.2218",
-    "Energy_real": "0.100715"
-}
+# When enabled, the statements given to read_rows_multiple are run concurrently each on its own pooled connection,
+# with at most MAX_CONCURRENT_QUERIES of them running at the same time in the whole process (across all the batches
+# and requests, QUERY_SLOTS for the sync engines, async_read_operations.query_semaphore for the asyncio ones)
+PARALLEL_QUERIES = False
+MAX_CONCURRENT_QUERIES = 5
+QUERY_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_QUERIES)
+
+# The number of rows fetched (and sent) at a time when the rows of a query are streamed
+STREAM_BATCH_SIZE = 5000
+
+# Where the history queries are read from, "primary" (the database the engine connects to) or "mirror" (the local
+# history mirror, for the rows it already holds, see history_engine)
+READ_ROUTINGS = ("primary", "mirror")
+READ_ROUTING = "primary"
+HISTORY_MIRROR = None
+
+
+@lru_cache(maxsize=32)
+def reading_record_type(columns: tuple):
+    """
+    Function that returns the record type (a named tuple) for the rows of the given columns, built once per set of
+    columns, so mapping a row is a single tuple construction
+
+    :param columns: The column keys of the result, in order
+
+    :return: The named tuple type with a field per column
+    :rtype: type
+    """
+
+    return namedtuple("Reading", columns, rename=True)
+
+
+def row_to_record(row):
+    """
+    Function that maps a result row to its record (named tuple), by the column keys of the result itself rather than a
+    fixed order, keeping the native values (numbers, dates and timestamps)
+
+    :param row: The row resulted from the SqlAlchemy query
+
+    :return: The record of the row
+    :rtype: tuple
+    """
+
+    return reading_record_type(tuple(row._mapping.keys()))._make(row)
 
 
 def current_parameters_to_dictionary(records: list):
@@ -56,22 +92,20 @@ def current_parameters_to_dictionary(records: list):
     format to be sent to the client. This is specifically used for conversion required by
     "/energy_meter/current_update" api route.
 
+    A new dictionary is built for every call (keyed by the columns of the result, values kept in their native types),
+    so concurrent conversions do not share any state.
+
     :param records: The results from SqlAlchemy query.
 
-    :return: The dictionary of parameters with key and values matching from the latest database read
+    :return: The dictionary of parameters with key and values matching from the latest database read, empty when
+    there are no records
     :rtype: dict
 
     """
 
-    parameters = ENERGY_PARAMETERS
-    for result in records:
-
-        # This for loop will result in modifying the parameters dictionary such that all the
-        # Key values are updated with the recent one from the database
-        for parameter, value in zip(parameters.keys(), result):
-            parameters[parameter] = str(value)
-
-    return parameters
+    if not records:
+        return {}
+    return row_to_record(records[-1])._asdict()
 
 
 def total_energy_to_dictionary(records: list):
@@ -98,7 +132,8 @@ def total_energy_to_dictionary(records: list):
     return parameters
 
 
-def date_wise_parameters_to_dictionary(dates: list[str], records: list):
+def date_wise_parameters_to_dictionary(dates: list[str], records: list, points: Optional[int] = None,
+                                       method: str = "lttb", rollup_dates: Optional[set] = None):
     """
 
     CONVERT DATABASE RECORDS TO DICTIONARY - DATE WISE PARAMETERS
@@ -110,12 +145,19 @@ def date_wise_parameters_to_dictionary(dates: list[str], records: list):
 
     :param dates: The list of dates for which the parameters are required to be read.
     :param records: The results from SqlAlchemy query.
+    :param points: When given, the values of every date are downsampled to these many points (buckets)
+    :param method: The downsampling method ("lttb" or "minmax"), used only when points is given
+    :param rollup_dates: The dates whose records were read from a rollup table (used only when points is given)
 
     :return: The dictionary consisting of total energy consumed today.
     :rtype: dict
 
     """
 
+    if points is not None:
+        series = date_wise_parameters_to_columns(dates, records, points, method, rollup_dates)
+        return {date: columns_to_pairs(columns) for date, columns in series.items()}
+
     parameters_list = []
     for result in records:
         individual_data = []
@@ -127,7 +169,62 @@ def date_wise_parameters_to_dictionary(dates: list[str], records: list):
     return parameters
 
 
-def read_rows(engine: Engine, statement: str):
+def date_wise_batch_to_json_line(date_of_rows: str, rows: list):
+    """
+
+    CONVERT A BATCH OF STREAMED RECORDS TO A JSON LINE
+    ======================================================
+
+    This function is used to convert a batch of (timestamp, value) rows streamed from the database to one line of
+    newline delimited json. This is specifically used by the "/energy_meter/read_parameter_multiple_stream" api route.
+
+    :param date_of_rows: The date to which the rows belong
+    :param rows: A batch of (timestamp, value) rows
+
+    :return: A json line of the format {"date": date, "values": [[timestamp, value], ...]}
+    :rtype: bytes
+
+    """
+
+    line = {"date": date_of_rows, "values": [[row[0], row[1]] for row in rows]}
+    return dumps(line) + b"\n"
+
+
+def executable(statement):
+    """
+    Function that returns an executable for a statement, wrapping a plain sql string in text()
+
+    :param statement: A sql string or an sqlalchemy core statement (such as select)
+
+    :return: The statement that can be executed by a connection
+    :rtype: Executable
+    """
+
+    return text(statement) if isinstance(statement, str) else statement
+
+
+def fetch_records(result):
+    """
+    Function that fetches all the records of a query result, as sqlalchemy rows, or for the statements whose columns
+    are all numbers (see sql_functions.numeric_records) as a two dimensional float64 array (one row per record) built
+    at once from the tuples of the database driver, without a sqlalchemy Row per record
+
+    :param result: The result of the executed statement
+
+    :return: The records
+    :rtype: Union[list, np.ndarray]
+    """
+
+    if not result.context.execution_options.get(NUMERIC_RECORDS, False):
+        return result.all()
+
+    cursor = result.cursor
+    records = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, len(cursor.description))
+    result.close()
+    return records
+
+
+def read_rows(engine: Engine, statement: str, kind: str = "query"):
     """
 
     Read Rows From Database
@@ -136,7 +233,8 @@ def read_rows(engine: Engine, statement: str):
     Function used to Read records from the database based on the query statement passed as argument
 
     :param engine: The Sqlalchemy engine used to connect to the database
-    :param statement: The query statement that is required to be executed
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param kind: The kind of the query (such as date, range), the label its metrics are recorded with
 
     :return: Returns the query result
     :rtype: list
@@ -144,35 +242,199 @@ def read_rows(engine: Engine, statement: str):
     """
 
     # Opening a connection to the database
+    wait_start = time.perf_counter()
     with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
 
         start_time = time.time()
-        query_result = conn.execute(text(statement)).all()
+        query_result = fetch_records(conn.execute(executable(statement)))
         end_time = time.time()
+        metrics.observe_query(kind, end_time - start_time, len(query_result))
         LOGGER.info("Total Time for Reading Data: {time} seconds".format(time=round((end_time - start_time), 4)))
 
     return query_result
 
 
-def read_rows_multiple(engine: Engine, statements: list[str]):
+def initialize_query_concurrency(parallel_queries: bool, max_concurrent_queries: int):
+    """
+    Function used to initialize the global query concurrency variables ( from the main script)
+
+    :param parallel_queries: Whether the statements of read_rows_multiple should be run concurrently
+    :param max_concurrent_queries: The maximum number of statements (connections) running at the same time
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if max_concurrent_queries < 1:
+        raise ValueError("max_concurrent_queries should be at least 1")
+
+    global PARALLEL_QUERIES, MAX_CONCURRENT_QUERIES, QUERY_SLOTS
+    PARALLEL_QUERIES = parallel_queries
+    MAX_CONCURRENT_QUERIES = max_concurrent_queries
+    QUERY_SLOTS = threading.BoundedSemaphore(max_concurrent_queries)
+
+
+def initialize_read_routing(read_routing: str, history_mirror=None):
+    """
+    Function used to initialize the global read routing variables ( from the main script)
+
+    :param read_routing: Where the history queries are read from, "primary" or "mirror"
+    :param history_mirror: The history mirror (see history_mirror.HistoryMirror), required for "mirror"
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if read_routing not in READ_ROUTINGS:
+        raise ValueError("Invalid read routing {routing}, should be one of {routings}".format(
+            routing=read_routing, routings=READ_ROUTINGS))
+
+    global READ_ROUTING, HISTORY_MIRROR
+    READ_ROUTING = read_routing
+    HISTORY_MIRROR = history_mirror
+
+
+def history_engine(engine, until: datetime, device=None):
+    """
+
+    Engine For A History Query
+    ==============================
+
+    Function that returns the engine a query for the rows older than "until" should be run on, the history mirror
+    when the read routing is "mirror" and the mirror already holds all those rows, the given (primary) engine
+    otherwise (so the freshest rows are always read from the primary). The mirror is kept for the default device
+    only.
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) connected to the primary database
+    :param until: The (exclusive) end of the rows required by the query
+    :param device: The device the query is for, the default device when not given
+
+    :return: The engine to run the query on
+    :rtype: Union[Engine, AsyncEngine]
+
+    """
+
+    if device is not None and not device.is_default:
+        return engine
+
+    if READ_ROUTING == "mirror" and HISTORY_MIRROR is not None and HISTORY_MIRROR.covers_until(until):
+        return HISTORY_MIRROR.engine
+    return engine
+
+
+def read_statement(engine: Engine, statement: str, index: int = 0, kind: str = "query"):
+    """
+
+    Read Rows For One Statement On Its Own Connection
+    =====================================================
+
+    Function used by the parallel mode of read_rows_multiple, every call checks out a separate connection from the
+    pool so that the statements can run at the same time, after taking one of the QUERY_SLOTS shared by the whole
+    process.
+
+    :param engine: The Sqlalchemy engine used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param index: The position of the statement in the batch (used for logging)
+    :param kind: The kind of the query, the label its metrics are recorded with
+
+    :return: Returns the query result
+    :rtype: list
+
+    """
+
+    with QUERY_SLOTS:
+        wait_start = time.perf_counter()
+        with engine.connect() as conn:
+            metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+            start_time = time.time()
+            query_result = fetch_records(conn.execute(executable(statement)))
+            end_time = time.time()
+            metrics.observe_query(kind, end_time - start_time, len(query_result))
+            LOGGER.info("Time for Reading Statement {index}: {time} Seconds ({rows} rows)".format(
+                index=index, time=round((end_time - start_time), 4), rows=len(query_result)))
+
+    return query_result
+
+
+def read_rows_multiple(engine: Engine, statements: list[str], kind: str = "query"):
     """
 
     Read Records Multiple Times
     ==============================
 
+    When PARALLEL_QUERIES is enabled the statements are run concurrently (see initialize_query_concurrency), the
+    results are always returned in the same order as the statements.
+
     :param engine: The Sqlalchemy engine used to connect to the database
     :param statements: An array containing the query statements that are required to be executed
+    :param kind: The kind of the queries, the label their metrics are recorded with
 
     :return: Returns the query result
     :rtype: list
 
     """
 
+    if PARALLEL_QUERIES and len(statements) > 1:
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_QUERIES, len(statements))) as executor:
+            # executor.map keeps the order of the statements
+            query_results = list(executor.map(read_statement, [engine] * len(statements), statements,
+                                              range(len(statements)), [kind] * len(statements)))
+        end_time = time.time()
+        LOGGER.info("Total Time for Reading Data ({count} statements in parallel): {time} Seconds".format(
+            count=len(statements), time=round((end_time - start_time), 4)))
+
+        return query_results
+
+    wait_start = time.perf_counter()
     with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
 
         start_time = time.time()
-        query_results = [conn.execute(text(statement)).all() for statement in statements]
+        query_results = []
+        for statement in statements:
+            statement_start = time.perf_counter()
+            query_results.append(fetch_records(conn.execute(executable(statement))))
+            metrics.observe_query(kind, time.perf_counter() - statement_start, len(query_results[-1]))
         end_time = time.time()
         LOGGER.info("Total Time for Reading Data: {time} Seconds".format(time=round((end_time - start_time), 4)))
 
     return query_results
+
+
+def stream_rows(engine: Engine, statement: str, batch_size: int = STREAM_BATCH_SIZE, kind: str = "stream"):
+    """
+
+    Stream Rows From Database
+    ==============================
+
+    Generator used to read records from the database in batches using a server side cursor, so that only one batch
+    of rows is held in memory at a time regardless of how many rows the statement returns.
+
+    :param engine: The Sqlalchemy engine used to connect to the database
+    :param statement: The query statement that is required to be executed (sql string or sqlalchemy core statement)
+    :param batch_size: The number of rows in a batch
+    :param kind: The kind of the query, the label its metrics are recorded with
+
+    :return: Yields batches of rows
+    :rtype: Iterator[list]
+
+    """
+
+    wait_start = time.perf_counter()
+    with engine.connect() as conn:
+        metrics.POOL_WAIT.observe(value=time.perf_counter() - wait_start)
+
+        start_time = time.time()
+        row_count = 0
+        result = conn.execution_options(stream_results=True).execute(executable(statement))
+        for batch in result.partitions(batch_size):
+            row_count += len(batch)
+            yield batch
+        end_time = time.time()
+        metrics.observe_query(kind, end_time - start_time, row_count)
+        LOGGER.info("Total Time for Streaming Data: {time} Seconds ({rows} rows)".format(
+            time=round((end_time - start_time), 4), rows=row_count))
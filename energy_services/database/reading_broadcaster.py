@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+READING BROADCASTER
+======================
+
+Module that pushes the new readings to the clients subscribed to the live readings (over WebSocket or Server-Sent
+Events), instead of the clients polling "/energy_meter/energy_core/current_update".
+
+The new rows are detected once, by the background refresh of the latest reading cache, every new reading is
+serialized once and the same message is queued for all the subscribers. Every subscriber has a queue of a single
+message, a subscriber that has not taken the previous message yet (a slow consumer) has it replaced by the new one,
+so a slow client always gets the latest reading and never holds back the others or the memory.
+
+The readings are pushed for the default device (the one refreshed in the background).
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * asyncio - for the queues of the subscribers
+"""
+
+# Standard Imports
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional
+
+# User Imports
+from ..utils import metrics
+from ..utils.responses import dumps
+from .latest_reading_cache import LATEST_READING_CACHE, LatestReadingCache
+
+LOGGER = logging.getLogger(__name__)
+
+# The transports the live readings are sent over
+LIVE_TRANSPORTS = ("websocket", "sse")
+
+
+class Subscription:
+    """
+    LIVE READING SUBSCRIPTION
+    ============================
+
+    This class holds the queue (of a single message) of a subscriber, used as an async context manager, the
+    subscriber is registered with the broadcaster on entry and removed on exit.
+    """
+
+    def __init__(self, broadcaster: "ReadingBroadcaster", transport: str):
+        """
+        :param broadcaster: The broadcaster the subscription receives the messages of
+        :param transport: The transport of the subscriber (websocket or sse), the label of the subscriber count
+        """
+
+        self.broadcaster = broadcaster
+        self.transport = transport
+        self.queue = asyncio.Queue(maxsize=1)
+
+    def put(self, message: str):
+        """
+        Queue a message, replacing the previous one if the subscriber has not taken it yet
+
+        :param message: The serialized reading
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        replaced = self.queue.full()
+        if replaced:
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        metrics.LIVE_MESSAGES.increment("replaced" if replaced else "queued")
+
+    async def get(self):
+        """
+        Wait for the next message
+
+        :return: The serialized reading
+        :rtype: str
+        """
+
+        return await self.queue.get()
+
+    async def __aenter__(self):
+        self.broadcaster.add(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.broadcaster.remove(self)
+
+
+class ReadingBroadcaster:
+    """
+    LIVE READING BROADCASTER
+    ============================
+
+    This class holds the subscribers of the live readings and fans the message of every new reading out to them.
+    """
+
+    def __init__(self, cache: Optional[LatestReadingCache] = None):
+        """
+        :param cache: The latest reading cache whose new readings are broadcast, the one of the default device when
+        not given
+        """
+
+        self.cache = cache or LATEST_READING_CACHE
+        self.message: Optional[str] = None
+        self._subscriptions = set()
+        self._counts = Counter()
+        self.cache.listeners.append(self.publish_reading)
+
+    @property
+    def subscriber_count(self):
+        """
+        The number of subscribers
+
+        :rtype: int
+        """
+
+        return len(self._subscriptions)
+
+    def subscribe(self, transport: str):
+        """
+        Create a subscription (to be used as an async context manager), which gets the latest message right away
+
+        :param transport: The transport of the subscriber (websocket or sse)
+
+        :return: The subscription
+        :rtype: Subscription
+        """
+
+        if transport not in LIVE_TRANSPORTS:
+            raise ValueError("Invalid transport, should be one of {transports}".format(transports=LIVE_TRANSPORTS))
+        return Subscription(self, transport)
+
+    def add(self, subscription: Subscription):
+        """
+        Register a subscription (see Subscription)
+
+        :param subscription: The subscription
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        self._subscriptions.add(subscription)
+        self._counts[subscription.transport] += 1
+        metrics.LIVE_SUBSCRIBERS.set(subscription.transport, value=self._counts[subscription.transport])
+        if self.message is not None:
+            subscription.put(self.message)
+
+    def remove(self, subscription: Subscription):
+        """
+        Remove a subscription (see Subscription)
+
+        :param subscription: The subscription
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            self._counts[subscription.transport] -= 1
+            metrics.LIVE_SUBSCRIBERS.set(subscription.transport, value=self._counts[subscription.transport])
+
+    def publish(self, message: str):
+        """
+        Queue a message for all the subscribers
+
+        :param message: The serialized reading
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        self.message = message
+        for subscription in self._subscriptions:
+            subscription.put(message)
+
+    def publish_reading(self, cache: LatestReadingCache):
+        """
+        Serialize the new reading of the latest reading cache and queue it for all the subscribers (the listener
+        registered with the cache)
+
+        :param cache: The latest reading cache
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        self.publish(dumps(cache.to_dictionary()).decode())
+
+
+READING_BROADCASTER = ReadingBroadcaster()
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+ROLLUPS
+======================
+
+Module that maintains pre-aggregated (rollup) tables of the energy meter table and picks them for the history
+queries, so that views spanning weeks or months do not scan the raw rows.
+
+Every rollup level (1 minute, 15 minutes, 1 hour and 1 day, see ROLLUP_LEVELS) keeps for every parameter and bucket
+the minimum, maximum, total and count (for the average), and the first and last values (for the last value and the
+energy delta of the bucket). A background job aggregates the rows added after the last processed id into all the
+levels, merging them with the buckets already present (the last bucket is usually only partially filled).
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to aggregate a batch of rows vectorized
+
+    * sqlalchemy - Package used to connect to a database and do SQL operations
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+# External Imports
+import numpy as np
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# User Imports
+from ..utils import metrics
+from .async_read_operations import run_in_transaction_async
+from .query_statements import statement_for_rows_after_id
+from .sql_functions import epoch_milliseconds, numeric_records
+from .table_models import ENERGY_PARAMETER_COLUMNS, ROLLUP_LEVELS, ROLLUP_TABLES, ROLLUP_STATE_TABLE, metadata_obj
+
+LOGGER = logging.getLogger(__name__)
+
+ROLLUP_STATE_NAME = "energy_lmeasure"
+
+# The dialects the rollups can be materialized on (the upsert is written for every one of them)
+ROLLUP_DIALECTS = ("mysql", "sqlite")
+
+
+def check_rollup_dialect(dialect_name: str):
+    """
+    Function that checks that the rollups can be materialized on a database dialect
+
+    :param dialect_name: The name of the dialect (such as mysql)
+
+    :return: Nothing
+    :rtype: None
+
+    :raises ValueError: If the dialect is not one of ROLLUP_DIALECTS
+    """
+
+    if dialect_name not in ROLLUP_DIALECTS:
+        raise ValueError("Rollups are not supported for the {dialect} dialect, should be one of {dialects}".format(
+            dialect=dialect_name, dialects=ROLLUP_DIALECTS))
+
+
+def _nan_to_none(values: list):
+    """
+    Function that replaces the nan (missing values) of a list with None (NULL)
+
+    :param values: The list of floats
+
+    :return: The list with nan replaced by None
+    :rtype: list
+    """
+
+    return [None if value != value else value for value in values]
+
+
+def aggregate_rows(rows: list):
+    """
+
+    AGGREGATE A BATCH OF ROWS
+    ============================
+
+    Function that aggregates a batch of (id, timestamp, parameters...) rows, ordered by id, into the buckets of every
+    rollup level.
+
+    :param rows: The rows resulted from the query
+
+    :return: The dictionary of rollup level to the records (dictionaries) of its buckets
+    :rtype: dict[str, list[dict]]
+
+    """
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    timestamps = np.array([row[1] for row in rows], dtype="datetime64[ms]").astype(np.int64)
+    parameters = np.array([row[2:] for row in rows], dtype=np.float64)
+
+    rollups = {}
+    for level, width in ROLLUP_LEVELS.items():
+        buckets = timestamps // (width * 1000) * (width * 1000)
+
+        # A stable sort keeps the rows of a bucket in the order of their id
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets, sorted_ids = buckets[order], ids[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(sorted_buckets) != 0])
+        ends = np.r_[starts[1:], sorted_buckets.size] - 1
+
+        bucket_starts = sorted_buckets[starts].astype("datetime64[ms]").tolist()
+        first_ids, last_ids = sorted_ids[starts].tolist(), sorted_ids[ends].tolist()
+
+        records = []
+        for index, parameter in enumerate(ENERGY_PARAMETER_COLUMNS):
+            values = parameters[order, index]
+            present = ~np.isnan(values)
+
+            columns = zip(bucket_starts,
+                          _nan_to_none(np.fmin.reduceat(values, starts).tolist()),
+                          _nan_to_none(np.fmax.reduceat(values, starts).tolist()),
+                          np.add.reduceat(np.where(present, values, 0), starts).tolist(),
+                          np.add.reduceat(present, starts).tolist(),
+                          _nan_to_none(values[starts].tolist()), first_ids,
+                          _nan_to_none(values[ends].tolist()), last_ids)
+
+            records.extend({"bucket_start": bucket_start, "parameter": parameter, "minimum": minimum,
+                            "maximum": maximum, "total": total, "count": count, "first_value": first_value,
+                            "first_id": first_id, "last_value": last_value, "last_id": last_id}
+                           for bucket_start, minimum, maximum, total, count, first_value, first_id, last_value, last_id
+                           in columns)
+
+        rollups[level] = records
+
+    return rollups
+
+
+def _upsert_statement(table, dialect_name: str):
+    """
+    Function that returns the insert statement merging the aggregates of a bucket with the ones already present.
+    As the rows are processed in the order of their id, the first value of a bucket is kept and the last value is
+    replaced.
+
+    :param table: The rollup table
+    :param dialect_name: The dialect of the connection (mysql or sqlite)
+
+    :return: The insert (upsert) statement
+    :rtype: Insert
+    """
+
+    if dialect_name == "mysql":
+        statement = mysql_insert(table)
+        new, least, greatest = statement.inserted, func.least, func.greatest
+    elif dialect_name == "sqlite":
+        statement = sqlite_insert(table)
+        new, least, greatest = statement.excluded, func.min, func.max
+    else:
+        check_rollup_dialect(dialect_name)
+
+    # coalesce so that a missing (NULL) value on either side does not wipe out the other
+    values = {
+        "minimum": least(func.coalesce(table.c.minimum, new.minimum), func.coalesce(new.minimum, table.c.minimum)),
+        "maximum": greatest(func.coalesce(table.c.maximum, new.maximum), func.coalesce(new.maximum, table.c.maximum)),
+        "total": table.c.total + new.total,
+        "count": table.c.count + new.count,
+        "last_value": new.last_value,
+        "last_id": new.last_id,
+    }
+
+    if dialect_name == "mysql":
+        return statement.on_duplicate_key_update(**values)
+    return statement.on_conflict_do_update(index_elements=[table.c.bucket_start, table.c.parameter], set_=values)
+
+
+def create_rollup_tables(conn):
+    """
+    Function that creates the rollup and rollup state tables if they do not exist
+
+    :param conn: The sqlalchemy connection
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    metadata_obj.create_all(conn, tables=[*ROLLUP_TABLES.values(), ROLLUP_STATE_TABLE])
+
+
+def read_rollup_state(conn):
+    """
+    Function that returns the last energy meter row (id and timestamp) aggregated into the rollup tables
+
+    :param conn: The sqlalchemy connection
+
+    :return: The last processed id (0 if nothing is processed yet) and its timestamp
+    :rtype: tuple[int, Optional[datetime]]
+    """
+
+    state = conn.execute(select(ROLLUP_STATE_TABLE.c.last_id, ROLLUP_STATE_TABLE.c.last_timestamp)
+                         .where(ROLLUP_STATE_TABLE.c.name == ROLLUP_STATE_NAME)).first()
+    if state is None:
+        return 0, None
+    return state.last_id, state.last_timestamp
+
+
+def materialize_batch(conn, batch_size: int):
+    """
+
+    MATERIALIZE A BATCH OF ROWS
+    ===============================
+
+    Function that aggregates the next batch of rows (after the last processed id) into all the rollup levels and
+    moves the last processed id forward, run inside one transaction so that a batch is never counted twice.
+
+    :param conn: The sqlalchemy connection (inside a transaction)
+    :param batch_size: The maximum number of rows aggregated
+
+    :return: The number of rows aggregated, the last processed id and its timestamp
+    :rtype: tuple[int, int, Optional[datetime]]
+
+    """
+
+    last_id, last_timestamp = read_rollup_state(conn)
+
+    statement = statement_for_rows_after_id(("id", "timestamp") + ENERGY_PARAMETER_COLUMNS, last_id, batch_size)
+    rows = conn.execute(statement).all()
+    if not rows:
+        return 0, last_id, last_timestamp
+
+    for level, records in aggregate_rows(rows).items():
+        conn.execute(_upsert_statement(ROLLUP_TABLES[level], conn.dialect.name), records)
+
+    new_last_id = rows[-1][0]
+    new_last_timestamp = np.array([rows[-1][1]], dtype="datetime64[ms]")[0].item()
+    state = {"last_id": new_last_id, "last_timestamp": new_last_timestamp}
+    if last_id == 0 and last_timestamp is None:
+        conn.execute(insert(ROLLUP_STATE_TABLE).values(name=ROLLUP_STATE_NAME, **state))
+    else:
+        conn.execute(update(ROLLUP_STATE_TABLE).where(ROLLUP_STATE_TABLE.c.name == ROLLUP_STATE_NAME).values(**state))
+
+    return len(rows), new_last_id, new_last_timestamp
+
+
+class RollupMaterializer:
+    """
+    BACKGROUND ROLLUP MATERIALIZER
+    ==================================
+
+    This class runs the background job that keeps the rollup tables up to date, and knows until which row (and
+    timestamp) they are complete.
+    """
+
+    def __init__(self, interval: float = 60, batch_size: int = 20000):
+        """
+        :param interval: The time (in seconds) to wait once the rollups have caught up with the table
+        :param batch_size: The maximum number of rows aggregated in one transaction
+        """
+
+        self.interval = interval
+        self.batch_size = batch_size
+        self.enabled = False
+        self.last_id = None
+        self.last_timestamp = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, engine):
+        """
+        Aggregate batches of rows until the rollups have caught up with the table
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: The number of rows aggregated
+        :rtype: int
+        """
+
+        total_rows = 0
+        while True:
+            start_time = time.time()
+            row_count, self.last_id, self.last_timestamp = await run_in_transaction_async(
+                engine, materialize_batch, self.batch_size)
+            total_rows += row_count
+            metrics.observe_query("rollup_materialize", time.time() - start_time, row_count)
+
+            if row_count:
+                LOGGER.info("Aggregated {rows} rows into the rollups up to id {id} in {time} Seconds".format(
+                    rows=row_count, id=self.last_id, time=round(time.time() - start_time, 4)))
+            if row_count < self.batch_size:
+                return total_rows
+
+    async def _run_forever(self, engine):
+        """
+        Keep the rollups up to date until cancelled
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        tables_created = False
+        while True:
+            try:
+                # Created within the retries, so the job does not end on a database that is not reachable yet
+                if not tables_created:
+                    await run_in_transaction_async(engine, create_rollup_tables)
+                    tables_created = True
+                await self.run_once(engine)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                LOGGER.error("Failed to materialize the rollups: {error}".format(error=error))
+            await asyncio.sleep(self.interval)
+
+    @property
+    def is_running(self):
+        """
+        Whether the background job is running
+
+        :rtype: bool
+        """
+
+        return self._task is not None and not self._task.done()
+
+    def start(self, engine):
+        """
+        Start the background job (must be called from a running event loop, such as the startup event)
+
+        :param engine: The Sqlalchemy engine (sync or asyncio) used to connect to the database
+
+        :return: Nothing
+        :rtype: None
+
+        :raises ValueError: If the rollups are not supported for the dialect of the engine
+        """
+
+        if self.enabled and not self.is_running:
+            check_rollup_dialect(engine.dialect.name)
+            self._task = asyncio.get_running_loop().create_task(self._run_forever(engine))
+            LOGGER.info("Started the rollup materializer (every {interval} seconds)".format(interval=self.interval))
+
+    async def stop(self):
+        """
+        Stop the background job
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            LOGGER.info("Stopped the rollup materializer")
+
+    def covers(self, date_of_rows: str):
+        """
+        Whether the rollups are complete for the given date (all its rows have been aggregated)
+
+        :param date_of_rows: The date (YYYY-MM-DD)
+
+        :return: True if the rollups can be used for the date
+        :rtype: bool
+        """
+
+        if not self.enabled or self.last_timestamp is None:
+            return False
+        return self.last_timestamp.date() > date.fromisoformat(date_of_rows)
+
+
+ROLLUP_MATERIALIZER = RollupMaterializer()
+
+
+def initialize_rollups(enabled: bool, interval: float = 60, batch_size: int = 20000,
+                       dialect_name: Optional[str] = None):
+    """
+    Function used to initialize the global rollup materializer ( from the main script)
+
+    :param enabled: Whether the rollups are maintained (and used by the history queries)
+    :param interval: The time (in seconds) to wait once the rollups have caught up with the table
+    :param batch_size: The maximum number of rows aggregated in one transaction
+    :param dialect_name: The dialect of the database the rollups are materialized on, checked when given
+
+    :return: Nothing
+    :rtype: None
+
+    :raises ValueError: If the rollups are enabled for a dialect they are not supported for
+    """
+
+    if enabled and dialect_name is not None:
+        check_rollup_dialect(dialect_name)
+
+    ROLLUP_MATERIALIZER.enabled = enabled
+    ROLLUP_MATERIALIZER.interval = interval
+    ROLLUP_MATERIALIZER.batch_size = batch_size
+
+
+def rollup_level_for_resolution(resolution: float):
+    """
+    Function that returns the coarsest rollup level whose buckets are not wider than the requested resolution
+
+    :param resolution: The requested resolution (width of a point) in seconds
+
+    :return: The rollup level, None if even the finest level is too coarse
+    :rtype: Optional[str]
+    """
+
+    levels = [level for level, width in ROLLUP_LEVELS.items() if width <= resolution]
+    return levels[-1] if levels else None
+
+
+def statement_for_rollup_query(parameter: str, start_date: str, end_date: str, level: str):
+    """
+    Function that returns a query statement to return the buckets of a rollup level for given parameter and dates
+
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :param start_date: The first date for which we need the buckets
+    :param end_date: The last date (inclusive) for which we need the buckets
+    :param level: The rollup level (such as 1m, 1h)
+
+    :return: The query to get the buckets (bucket_start as epoch milliseconds, minimum, maximum, total, count,
+    first_value, last_value)
+    :rtype: Select
+    """
+
+    table = ROLLUP_TABLES[level]
+    end = date.fromisoformat(end_date) + timedelta(days=1)
+    statement = select(epoch_milliseconds(table.c.bucket_start).label("bucket_start"), table.c.minimum,
+                       table.c.maximum, table.c.total, table.c.count, table.c.first_value, table.c.last_value) \
+        .where(table.c.parameter == parameter,
+               table.c.bucket_start >= date.fromisoformat(start_date),
+               table.c.bucket_start < end) \
+        .order_by(table.c.bucket_start)
+    return numeric_records(statement)
+
+
+def rollup_level_for_date(parameter: str, date_of_rows: str, points: int, device=None):
+    """
+    Function that returns the rollup level for a date wise query downsampled to "points", when a rollup can serve it
+
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :param date_of_rows: The date for which we need the values
+    :param points: The number of points required for the date
+    :param device: The device the query is for, the default device when not given (the rollups are kept for the
+    default device only)
+
+    :return: The rollup level, None if the raw rows have to be queried (rollups disabled or not complete for the
+    date, the requested resolution finer than the finest rollup, or a device other than the default one)
+    :rtype: Optional[str]
+    """
+
+    if device is not None and not device.is_default:
+        return None
+
+    level = rollup_level_for_resolution(ROLLUP_LEVELS["1d"] / points)
+    if level is None or parameter not in ENERGY_PARAMETER_COLUMNS or not ROLLUP_MATERIALIZER.covers(date_of_rows):
+        return None
+    return level
+
+
+def statement_for_rollup_date(parameter: str, date_of_rows: str, points: int):
+    """
+    Function that returns the rollup query statement for a date wise query downsampled to "points", when a rollup
+    can serve it (see rollup_level_for_date)
+
+    :param parameter: The parameter that needs to be queried such as energy, power
+    :param date_of_rows: The date for which we need the values
+    :param points: The number of points required for the date
+
+    :return: The rollup query, None if the raw rows have to be queried (rollups disabled or not complete for the
+    date, or the requested resolution finer than the finest rollup)
+    :rtype: Optional[Select]
+    """
+
+    level = rollup_level_for_date(parameter, date_of_rows, points)
+    if level is None:
+        return None
+    return statement_for_rollup_query(parameter, date_of_rows, date_of_rows, level)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+SERIES FORMATS
+======================
+
+Module that converts date wise parameter series to the wire formats supported by the history api routes
+
+    * pairs - {date: [[timestamp, value], ...]}, the default (see date_wise_parameters_to_dictionary)
+    * columnar - {date: {"timestamps": [epoch ms, ...], "values": [value, ...]}}
+    * binary - the columns of every date packed into little endian buffers (see encode_binary_series)
+
+The binary format is laid out as below (all integers little endian), every series is padded so that its
+timestamps start at an offset that is a multiple of 8, which lets the client wrap the buffers in typed arrays
+(BigInt64Array / Float32Array) without copying or parsing point by point.
+
+    * magic b"ESB1" (4 bytes), number of series (uint32)
+    * for every series
+        * length of the date (uint16), the date (utf-8)
+        * number of points n (uint32), number of value columns k (uint8)
+        * for every value column, length of the name (uint8), the name (utf-8)
+        * zero padding up to a multiple of 8
+        * timestamps, epoch milliseconds (int64 x n)
+        * the k value columns (float32 x n each)
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * numpy - to hold the columns and pack them into buffers
+"""
+
+# Standard Imports
+import logging
+import struct
+from typing import Optional
+
+# External Imports
+import numpy as np
+
+# User Imports
+from .downsampling import downsample_columns, downsample_rollup_columns, rollup_rows_to_columns, rows_to_arrays
+
+LOGGER = logging.getLogger(__name__)
+
+SERIES_FORMATS = ("pairs", "columnar", "binary")
+
+BINARY_SERIES_MEDIA_TYPE = "application/octet-stream"
+BINARY_SERIES_MAGIC = b"ESB1"
+
+
+def date_wise_parameters_to_columns(dates: list[str], records: list, points: Optional[int] = None,
+                                    method: str = "lttb", rollup_dates: Optional[set] = None):
+    """
+
+    CONVERT DATABASE RECORDS TO COLUMNS - DATE WISE PARAMETERS
+    ===============================================================
+
+    This function is used to convert the raw database records of every date to columns (numpy arrays) of epoch
+    millisecond timestamps and values, downsampled when points is given.
+
+    :param dates: The list of dates for which the parameters are required to be read.
+    :param records: The results from SqlAlchemy query.
+    :param points: When given, the values of every date are downsampled to these many points (buckets)
+    :param method: The downsampling method ("lttb" or "minmax"), used only when points is given
+    :param rollup_dates: The dates whose records were read from a rollup table (see statement_for_rollup_date)
+
+    :return: The dictionary of date to its columns
+    :rtype: dict[str, dict[str, np.ndarray]]
+
+    """
+
+    rollup_dates = rollup_dates or set()
+    source = {date: records_to_source_columns(result, date in rollup_dates) for date, result in zip(dates, records)}
+    return source_columns_to_series(source, points, method, rollup_dates)
+
+
+def records_to_source_columns(records: list, rollup: bool = False):
+    """
+    Function that converts the records of one date to columns, before any downsampling (this is the form the day
+    series cache holds)
+
+    :param records: The results from SqlAlchemy query, raw (timestamp, value) rows or rollup rows
+    :param rollup: Whether the records were read from a rollup table
+
+    :return: "timestamps" and "values" columns for raw rows, the rollup columns (see rollup_rows_to_columns) for
+    rollup rows
+    :rtype: dict[str, np.ndarray]
+    """
+
+    if rollup:
+        return rollup_rows_to_columns(records)
+
+    timestamps, values = rows_to_arrays(records)
+    return {"timestamps": timestamps, "values": values}
+
+
+def source_columns_to_series(source: dict, points: Optional[int] = None, method: str = "lttb",
+                             rollup_dates: Optional[set] = None):
+    """
+    Function that downsamples (when points is given) the columns of every date (see records_to_source_columns)
+
+    :param source: The dictionary of date to its columns, before any downsampling
+    :param points: When given, the values of every date are downsampled to these many points (buckets)
+    :param method: The downsampling method ("lttb" or "minmax"), used only when points is given
+    :param rollup_dates: The dates whose columns are rollup columns
+
+    :return: The dictionary of date to its columns
+    :rtype: dict[str, dict[str, np.ndarray]]
+    """
+
+    series = {}
+    for date, columns in source.items():
+        if rollup_dates and date in rollup_dates:
+            series[date] = downsample_rollup_columns(columns, points, method)
+        elif points is None:
+            series[date] = columns
+        else:
+            series[date] = downsample_columns(columns["timestamps"], columns["values"], points, method)
+
+    return series
+
+
+def columns_to_dictionary(series: dict):
+    """
+    Function that converts the columns of every date to lists for the columnar json format
+
+    :param series: The dictionary of date to its columns
+
+    :return: The dictionary of date to its columns as lists
+    :rtype: dict[str, dict[str, list]]
+    """
+
+    return {date: {name: column.tolist() for name, column in columns.items()} for date, columns in series.items()}
+
+
+def rollup_columns(rows: list):
+    """
+    Function that converts rollup rows to the columns sent by the rollup api route ("timestamps", "min", "max",
+    "average", "last" and "delta", the change of the value within the bucket)
+
+    :param rows: The rollup rows resulted from the query (see statement_for_rollup_query)
+
+    :return: The columns of the rollup buckets
+    :rtype: dict[str, np.ndarray]
+    """
+
+    columns = rollup_rows_to_columns(rows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = columns["total"] / columns["count"]
+
+    return {"timestamps": columns["timestamps"], "min": columns["min"], "max": columns["max"], "average": average,
+            "last": columns["last"], "delta": columns["last"] - columns["first"]}
+
+
+def encode_binary_series(series: dict):
+    """
+
+    ENCODE SERIES TO THE BINARY FORMAT
+    =====================================
+
+    Function that packs the columns of every date into the binary format described in the module documentation.
+
+    :param series: The dictionary of date to its columns ("timestamps" followed by the value columns)
+
+    :return: The packed series
+    :rtype: bytes
+
+    """
+
+    buffer = bytearray(BINARY_SERIES_MAGIC)
+    buffer += struct.pack("<I", len(series))
+
+    for date, columns in series.items():
+        timestamps = columns["timestamps"]
+        value_columns = [(name, column) for name, column in columns.items() if name != "timestamps"]
+
+        encoded_date = date.encode("utf-8")
+        buffer += struct.pack("<H", len(encoded_date)) + encoded_date
+        buffer += struct.pack("<IB", timestamps.size, len(value_columns))
+        for name, _ in value_columns:
+            encoded_name = name.encode("utf-8")
+            buffer += struct.pack("<B", len(encoded_name)) + encoded_name
+
+        buffer += bytes(-len(buffer) % 8)
+        buffer += timestamps.astype("<i8").tobytes()
+        for _, column in value_columns:
+            buffer += column.astype("<f4").tobytes()
+
+    return bytes(buffer)
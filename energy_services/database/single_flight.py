@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+SINGLE FLIGHT
+======================
+
+Module that coalesces identical queries running at the same time, when many clients ask for the same rows at the
+same moment (such as the dashboards opened at the start of a shift) the first caller runs the query and the others
+wait for it and share its result, instead of every one of them running the same query.
+
+Two queries are identical when they are run on the same engine with the same statement and the same values of its
+bound parameters (the cache key sqlalchemy computes for its compiled cache, see query_key). Only the queries in
+flight are shared, a query started after the previous identical one finished runs again.
+
+The rows returned to the callers sharing a query are the same list, which the callers must not modify.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * asyncio - to share the query between the waiting callers
+"""
+
+# Standard Imports
+import asyncio
+import logging
+from typing import Optional
+
+# User Imports
+from ..utils import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _hashable(value):
+    """
+    Function that converts the value of a bound parameter to a hashable value (lists, such as the dates of an
+    expanding parameter, to tuples)
+
+    :param value: The value
+
+    :return: The hashable value
+    :rtype: Hashable
+    """
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+def query_key(statement):
+    """
+    Function that returns the key of a statement, identical for the statements running the same sql with the same
+    values
+
+    :param statement: A sql string or an sqlalchemy core statement (such as select)
+
+    :return: The key, None when the statement can not be keyed (it is then never shared)
+    :rtype: Optional[tuple]
+    """
+
+    if isinstance(statement, str):
+        return statement,
+
+    cache_key = statement._generate_cache_key()
+    if cache_key is None:
+        return None
+
+    try:
+        key = (cache_key.key, tuple(_hashable(parameter.effective_value) for parameter in cache_key.bindparams))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class SingleFlight:
+    """
+    SINGLE FLIGHT GROUP
+    ======================
+
+    This class holds the queries in flight by their key, the callers of a key already in flight wait for the running
+    query instead of starting their own.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        :param enabled: Whether the identical queries are shared
+        """
+
+        self.enabled = enabled
+        self._in_flight = {}
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        # Removing the finished call, unless it was already replaced by a newer one
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _retrieve_exception(task: asyncio.Task):
+        # Retrieving the exception so it is not reported as never retrieved when every waiting caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key: Optional[tuple], function, *args):
+        """
+        Run function(*args), or wait for the identical call already in flight and share its result
+
+        :param key: The key of the call, None to always run it
+        :param function: The coroutine function
+        :param args: The arguments of the function
+
+        :return: The result of the function
+        :rtype: Any
+        """
+
+        if not self.enabled or key is None:
+            return await function(*args)
+
+        task = self._in_flight.get(key)
+        metrics.observe_cache("single_flight", task is not None)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(function(*args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            task.add_done_callback(self._retrieve_exception)
+
+        # Shielded, so a caller that is cancelled (such as a client that disconnected) does not cancel the query for
+        # the other callers
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._in_flight)
+
+
+SINGLE_FLIGHT = SingleFlight(enabled=False)
+
+
+def initialize_single_flight(enabled: bool):
+    """
+    Function used to initialize the global single flight group ( from the main script)
+
+    :param enabled: Whether the identical queries in flight are shared
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    SINGLE_FLIGHT.enabled = enabled
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+SQL FUNCTIONS
+======================
+
+Module that contains the sql expressions that are written differently for every database (dialect), compiled with
+the sqlalchemy compiler extension
+
+    * epoch_milliseconds - the (naive) timestamp as epoch milliseconds, so the history queries return integers that
+      are loaded into numpy arrays as they are, instead of datetime objects converted one by one
+    * numeric_records - marks a statement whose columns are all numbers, its records are fetched as a numpy array
+      (see read_operations.fetch_records)
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * sqlalchemy - Package used to build and compile the sql expressions
+"""
+
+# Standard Imports
+import logging
+
+# External Imports
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+LOGGER = logging.getLogger(__name__)
+
+# The execution option of the statements whose records are fetched as a numpy array (see numeric_records)
+NUMERIC_RECORDS = "numeric_records"
+
+
+class epoch_milliseconds(FunctionElement):
+    """
+    EPOCH MILLISECONDS OF A TIMESTAMP
+    =====================================
+
+    Sql expression for the milliseconds from 1970-01-01 00:00:00 to a (naive) timestamp column, the timestamp is
+    taken as it is stored (no timezone conversion), the same as the epoch milliseconds of the naive timestamps in
+    downsampling.rows_to_arrays.
+    """
+
+    type = BigInteger()
+    name = "epoch_milliseconds"
+    inherit_cache = True
+
+
+@compiles(epoch_milliseconds)
+def _epoch_milliseconds_default(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM {timestamp}) * 1000 AS BIGINT)".format(
+        timestamp=compiler.process(element.clauses, **kw))
+
+
+@compiles(epoch_milliseconds, "mysql")
+def _epoch_milliseconds_mysql(element, compiler, **kw):
+    return "TIMESTAMPDIFF(MICROSECOND, '1970-01-01 00:00:00', {timestamp}) DIV 1000".format(
+        timestamp=compiler.process(element.clauses, **kw))
+
+
+@compiles(epoch_milliseconds, "sqlite")
+def _epoch_milliseconds_sqlite(element, compiler, **kw):
+    # The julian day is precise to a few tens of microseconds, rounding gives the exact millisecond
+    return "CAST(ROUND((julianday({timestamp}) - 2440587.5) * 86400000) AS INTEGER)".format(
+        timestamp=compiler.process(element.clauses, **kw))
+
+
+def numeric_records(statement):
+    """
+    Function that marks a statement whose columns are all numbers (such as the epoch milliseconds and the values of
+    the history series), its records are then fetched as a single float64 array straight from the tuples of the
+    database driver, instead of a sqlalchemy Row per record (see read_operations.fetch_records)
+
+    :param statement: The sqlalchemy core statement
+
+    :return: The statement with the NUMERIC_RECORDS execution option
+    :rtype: Executable
+    """
+
+    return statement.execution_options(**{NUMERIC_RECORDS: True})
@@ -11,15 +11,186 @@ environment you are running this script in.
 """
 # Standard Imports
 import logging
+from typing import Optional
 
 # External Imports
-from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy import MetaData, Table, Column, Index, Integer, String, BigInteger, Date, DateTime, Float
 
 
 LOGGER = logging.getLogger(__name__)
 
 metadata_obj = MetaData()
 
+# The numeric parameters (columns) of the energy meter table, apart from id, date and timestamp
+ENERGY_PARAMETER_COLUMNS = ("energy", "power", "avg_power_factor", "avg_current", "avg_voltage", "power_factor_1",
+                            "power_factor_2", "power_factor_3", "phase_current_Ir", "phase_current_Iy",
+                            "phase_current_Iz", "phase_voltage_Ir", "phase_voltage_Iy", "phase_voltage_Iz",
+                            "frequency", "Energy_real")
 
-def reflect_tables(engine):
-    some_table = Table("some_table", metadata_obj, autoload_with=engine)
+# The schema (database) the energy meter table lives in
+ENERGY_SCHEMA = "u759114105_energy_meter"
+
+# The columns of the index the pages of a time range are read along (see query_statements._range_query), ordered
+# by (timestamp, id) so that a page is a range scan of the index rather than a sort of the whole time range
+TIMESTAMP_INDEX_COLUMNS = ("timestamp", "id")
+TIMESTAMP_INDEX_NAME = "ix_energy_lmeasure_timestamp_id"
+
+# The energy meter table the readings are written into
+# A database created before the index has to be migrated once with:
+#   CREATE INDEX ix_energy_lmeasure_timestamp_id ON u759114105_energy_meter.energy_lmeasure (timestamp, id);
+ENERGY_LMEASURE_TABLE = Table("energy_lmeasure", metadata_obj,
+                              Column("id", BigInteger, primary_key=True),
+                              Column("date", Date),
+                              Column("timestamp", DateTime),
+                              *[Column(parameter, Float) for parameter in ENERGY_PARAMETER_COLUMNS],
+                              Index(TIMESTAMP_INDEX_NAME, *TIMESTAMP_INDEX_COLUMNS),
+                              schema=ENERGY_SCHEMA)
+
+
+# The tables of the other energy meters (devices), kept apart from metadata_obj as a device table can have an extra
+# (device) column while having the same name as the energy meter table
+DEVICE_METADATA = MetaData()
+
+
+def energy_table(name, schema=ENERGY_SCHEMA, device_column: Optional[str] = None):
+    """
+    Function that returns a table with the layout of the energy meter table, used for the tables of the devices (see
+    device_registry), the energy meter table itself for its name and schema
+
+    :param name: The name of the table
+    :type name: str
+    :param schema: The schema (database) the table lives in
+    :type schema: Optional[str]
+    :param device_column: The column holding the id of the device, when the table is shared by several devices
+    :type device_column: Optional[str]
+    :return: The table
+    :rtype: Table
+    """
+
+    if name == ENERGY_LMEASURE_TABLE.name and schema == ENERGY_SCHEMA and device_column is None:
+        return ENERGY_LMEASURE_TABLE
+
+    table = DEVICE_METADATA.tables.get(name if schema is None else schema + "." + name)
+    if table is None:
+        extra_columns = [Column(device_column, String(64))] if device_column is not None else []
+        return Table(name, DEVICE_METADATA,
+                     *[Column(column.name, column.type, primary_key=column.primary_key)
+                       for column in ENERGY_LMEASURE_TABLE.columns],
+                     *extra_columns,
+                     Index("ix_{name}_timestamp_id".format(name=name), *TIMESTAMP_INDEX_COLUMNS),
+                     schema=schema)
+
+    if device_column is not None and device_column not in table.c:
+        raise ValueError("The table {table} is already used without the device column {column}".format(
+            table=table.fullname, column=device_column))
+    return table
+
+
+def energy_column(parameter, table=ENERGY_LMEASURE_TABLE):
+    """
+    Function that returns the column of the energy meter table for a parameter, only the numeric parameters
+    (ENERGY_PARAMETER_COLUMNS) are allowed, so the parameters sent by the clients never end up in a statement as is
+
+    :param parameter: The parameter such as energy, power
+    :type parameter: str
+    :param table: The table (with the layout of the energy meter table) the column belongs to
+    :type table: Table
+    :return: The column of the parameter
+    :rtype: Column
+    """
+
+    if parameter not in ENERGY_PARAMETER_COLUMNS:
+        raise ValueError("Invalid parameter {parameter}, should be one of {parameters}".format(
+            parameter=parameter, parameters=", ".join(ENERGY_PARAMETER_COLUMNS)))
+    return table.c[parameter]
+
+
+def ordered_parameters(parameters):
+    """
+    Function that returns the given parameters without repeats and in the order of the columns of the energy meter
+    table, so the statements built for a set of parameters (and cached) are the same whatever the order and the
+    repeats the clients send them in
+
+    :param parameters: The parameters such as energy, power
+    :type parameters: Iterable[str]
+    :return: The parameters in the order of ENERGY_PARAMETER_COLUMNS
+    :rtype: tuple[str]
+    :raises ValueError: If a parameter is not one of ENERGY_PARAMETER_COLUMNS
+    """
+
+    requested = set(parameters)
+    invalid_parameters = requested.difference(ENERGY_PARAMETER_COLUMNS)
+    if invalid_parameters:
+        raise ValueError("Invalid parameters {parameters}, should be one of {columns}".format(
+            parameters=", ".join(sorted(invalid_parameters)), columns=", ".join(ENERGY_PARAMETER_COLUMNS)))
+    return tuple(parameter for parameter in ENERGY_PARAMETER_COLUMNS if parameter in requested)
+
+
+# The rollup levels (name and width of a bucket in seconds) from the finest to the coarsest
+ROLLUP_LEVELS = {"1m": 60, "15m": 900, "1h": 3600, "1d": 86400}
+
+
+def _rollup_table(level):
+    """
+    Function that returns the table holding the aggregates of every parameter for the buckets of a rollup level.
+    The average is kept as total and count, and the first and last values along with their ids, so that the
+    aggregates of a bucket can be merged with the rows arriving later.
+
+    :param level: The rollup level (such as 1m, 1h)
+    :type level: str
+    :return: The rollup table
+    :rtype: Table
+    """
+
+    return Table(f"energy_lmeasure_rollup_{level}", metadata_obj,
+                 Column("bucket_start", DateTime, primary_key=True),
+                 Column("parameter", String(32), primary_key=True),
+                 Column("minimum", Float),
+                 Column("maximum", Float),
+                 Column("total", Float),
+                 Column("count", Integer),
+                 Column("first_value", Float),
+                 Column("first_id", BigInteger),
+                 Column("last_value", Float),
+                 Column("last_id", BigInteger))
+
+
+ROLLUP_TABLES = {level: _rollup_table(level) for level in ROLLUP_LEVELS}
+
+# The last energy meter row (id and timestamp) that has been aggregated into the rollup tables
+ROLLUP_STATE_TABLE = Table("energy_lmeasure_rollup_state", metadata_obj,
+                           Column("name", String(32), primary_key=True),
+                           Column("last_id", BigInteger),
+                           Column("last_timestamp", DateTime))
+
+
+def reflect_tables(connectable):
+    """
+    Function that reflects the energy meter table from the database and checks it against the declared table, so that
+    a missing column (or the missing index of the time range pages) is reported at startup rather than by the first
+    query using it
+
+    :param connectable: The sqlalchemy engine or connection
+    :return: The reflected table
+    :rtype: Table
+    """
+
+    reflected_table = Table(ENERGY_LMEASURE_TABLE.name, MetaData(), schema=ENERGY_SCHEMA, autoload_with=connectable)
+
+    missing_columns = set(ENERGY_LMEASURE_TABLE.c.keys()) - set(reflected_table.c.keys())
+    if missing_columns:
+        LOGGER.error("Columns {columns} are missing from the {table} table".format(
+            columns=sorted(missing_columns), table=reflected_table.fullname))
+    else:
+        LOGGER.info("Reflected the {table} table".format(table=reflected_table.fullname))
+
+    # The columns of the indexes of an attached sqlite schema are not reflected, their names are checked as well
+    if not any(index.name == TIMESTAMP_INDEX_NAME or
+               tuple(column.name for column in index.columns)[:len(TIMESTAMP_INDEX_COLUMNS)] == TIMESTAMP_INDEX_COLUMNS
+               for index in reflected_table.indexes):
+        LOGGER.warning("The {table} table has no index on {columns}, the pages of a time range sort the whole range, "
+                       "create it with: CREATE INDEX {index} ON {table} ({columns})".format(
+                           table=reflected_table.fullname, index=TIMESTAMP_INDEX_NAME,
+                           columns=", ".join(TIMESTAMP_INDEX_COLUMNS)))
+
+    return reflected_table
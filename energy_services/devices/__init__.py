@@ -7,3 +7,4 @@ This is an initialization script for services available in this package
 """
 
 from .simulator import machine_states, generate_current_data
+from .ingestion_server import LinePoint, IngestionServer, parse_line
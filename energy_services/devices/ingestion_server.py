@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+"""
+INGESTION SERVER
+======================
+
+Module for the tcp server receiving the readings of the devices in the InfluxDB line protocol (the format sent by the
+device simulator, and by Telegraf's socket writer), such as
+
+    energy,device=htm_stallion_200 current=3.4512,number=120 1646753400000000000
+
+and storing them in the energy meter tables, without Telegraf in between.
+
+Every device connection is served by the asyncio event loop (so any number of devices can stay connected), the
+stream of every connection is split in lines and every line is parsed as a point. The points are not inserted one by
+one, they are gathered and inserted in bulk (multi-row inserts) per table, whenever flush_size points are pending or
+every flush_interval seconds, whichever comes first.
+
+A point is stored as a row of the table of its device (the "device" tag, looked up in the device registry after the
+device aliases are applied, the default device when the point has no device tag). Its fields are stored in the
+parameter columns of the same name, or of the column given in field_columns (such as current to avg_current), the
+other fields are ignored. The timestamp (in nanoseconds, the time of arrival when not given) is stored as the time in
+the plant timezone, as the rest of the table.
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * asyncio - to serve the device connections
+
+    * sqlalchemy - Package used to insert the rows
+"""
+
+# Standard Imports
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional, Union
+
+# External Imports
+from sqlalchemy import insert
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# User Imports
+from ..database import ENERGY_PARAMETER_COLUMNS, get_device, run_in_transaction_async
+from ..database import energy_today
+from ..utils import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+# A point of the line protocol, the tags and fields as dictionaries and the timestamp in nanoseconds (None if not given)
+LinePoint = namedtuple("LinePoint", ["measurement", "tags", "fields", "timestamp"])
+
+# The longest line accepted (in bytes), a connection sending a longer line is closed
+MAX_LINE_BYTES = 64 * 1024
+
+ESCAPED_CHARACTER = re.compile(r"\\(.)")
+
+BOOLEAN_VALUES = {"t": True, "T": True, "true": True, "True": True, "TRUE": True,
+                  "f": False, "F": False, "false": False, "False": False, "FALSE": False}
+
+
+def _split(text: str, separator: str, quotes: bool = False, limit: Optional[int] = None):
+    """
+    Function that splits a text on the separator, except where the separator is escaped (with a backslash) or, when
+    quotes is True, inside a double quoted string
+
+    :param text: The text
+    :param separator: The separator (a single character)
+    :param quotes: Whether the double quoted strings are kept whole
+    :param limit: The maximum number of splits, no limit when not given
+
+    :return: The parts, still escaped
+    :rtype: list[str]
+    """
+
+    parts, start, index, quoted = [], 0, 0, False
+    while index < len(text):
+        character = text[index]
+        if character == "\\":
+            index += 2
+            continue
+        if quotes and character == '"':
+            quoted = not quoted
+        elif character == separator and not quoted and (limit is None or len(parts) < limit):
+            parts.append(text[start:index])
+            start = index + 1
+        index += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unescape(text: str):
+    """
+    Function that removes the escaping backslashes of a measurement, tag or field key
+
+    :param text: The escaped text
+
+    :return: The text
+    :rtype: str
+    """
+
+    return ESCAPED_CHARACTER.sub(r"\1", text) if "\\" in text else text
+
+
+def _field_value(text: str):
+    """
+    Function that converts the value of a field, a float, an integer (with an i or u suffix), a boolean or a double
+    quoted string
+
+    :param text: The value as sent
+
+    :return: The value
+    :rtype: Union[float, int, bool, str]
+    """
+
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if text in BOOLEAN_VALUES:
+        return BOOLEAN_VALUES[text]
+    if text[-1:] in ("i", "u"):
+        return int(text[:-1])
+    return float(text)
+
+
+def parse_line(line: str):
+    """
+
+    PARSE A LINE OF THE LINE PROTOCOL
+    =====================================
+
+    Function that parses a line of the line protocol, "measurement[,tag=value...] field=value[,field=value...]
+    [timestamp]", with the escaping of the protocol (backslash escaped commas, spaces and equal signs, and double
+    quoted string fields).
+
+    :param line: The line, without the line break
+
+    :return: The point
+    :rtype: LinePoint
+
+    :raises ValueError: If the line is not a valid point
+
+    """
+
+    # Most lines have nothing escaped nor quoted, those are split directly
+    escaped = "\\" in line or '"' in line
+    if escaped:
+        sections = _split(line, " ", limit=1)
+        sections[1:] = _split(sections[1], " ", quotes=True) if len(sections) == 2 else []
+    else:
+        sections = line.split(" ")
+
+    if len(sections) not in (2, 3):
+        raise ValueError("Invalid line, should be 'measurement[,tag=value...] field=value[,...] [timestamp]'")
+
+    if escaped:
+        series, field_set = _split(sections[0], ","), _split(sections[1], ",", quotes=True)
+        pairs = [_split(pair, "=", limit=1) for pair in series[1:]]
+        fields = [_split(pair, "=", quotes=True, limit=1) for pair in field_set]
+    else:
+        series, field_set = sections[0].split(","), sections[1].split(",")
+        pairs = [pair.split("=", 1) for pair in series[1:]]
+        fields = [pair.split("=", 1) for pair in field_set]
+
+    if not series[0]:
+        raise ValueError("Invalid line, the measurement is missing")
+    if any(len(pair) != 2 or not pair[0] or not pair[1] for pair in pairs + fields):
+        raise ValueError("Invalid tag or field, should be key=value")
+
+    timestamp = int(sections[2]) if len(sections) == 3 else None
+    return LinePoint(_unescape(series[0]), {_unescape(key): _unescape(value) for key, value in pairs},
+                     {_unescape(key): _field_value(value) for key, value in fields}, timestamp)
+
+
+def _insert_rows(connection, table, rows: list):
+    """
+    Function that inserts the rows of a table in bulk, as one executemany of the insert statement (which the mysql
+    drivers send as multi-row inserts, as many rows per statement as the packet size allows), so the statement is
+    compiled once rather than for every batch
+
+    :param connection: The connection (inside a transaction)
+    :param table: The table
+    :param rows: The rows, dictionaries having the same keys
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    connection.execute(insert(table), rows)
+
+
+class IngestionServer:
+    """
+    LINE PROTOCOL INGESTION SERVER
+    ==================================
+
+    This class holds the tcp server receiving the points of the devices and the rows pending to be inserted, by table.
+    """
+
+    def __init__(self, engine: Union[Engine, AsyncEngine], host: str = "0.0.0.0", port: int = 8094,
+                 flush_size: int = 1000, flush_interval: float = 1.0, measurement: str = "energy",
+                 device_tag: str = "device", field_columns: Optional[dict] = None,
+                 device_aliases: Optional[dict] = None):
+        """
+        :param engine: The Sqlalchemy engine (sync or asyncio) the rows are inserted with
+        :param host: The address the server listens on
+        :param port: The port the server listens on
+        :param flush_size: The number of pending points at which they are inserted
+        :param flush_interval: The time (in seconds) after which the pending points are inserted, even if fewer than
+        flush_size
+        :param measurement: The measurement of the points stored, the points of the other measurements are ignored
+        :param device_tag: The tag holding the id of the device
+        :param field_columns: The parameter column of the fields not named after their column (field to column)
+        :param device_aliases: The id of the device (in the device registry) of the devices sending another id
+        """
+
+        if flush_size < 1 or flush_interval <= 0:
+            raise ValueError("The ingestion flush_size and flush_interval should be greater than zero")
+
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.measurement = measurement
+        self.device_tag = device_tag
+        self.field_columns = field_columns or {}
+        self.device_aliases = device_aliases or {}
+
+        # The rows pending to be inserted, by table, and the pending rows beyond which the connections stop reading
+        self.pending = {}
+        self.pending_count = 0
+        self.max_pending = flush_size * 10
+        self.connections = 0
+        self._unknown_devices = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flush_needed: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+
+    def point_to_row(self, point: LinePoint):
+        """
+        Function that converts a point to the row of the table of its device
+
+        :param point: The point
+
+        :return: The table and the row, None if the point is not stored (another measurement, an unknown device or no
+        parameter field)
+        :rtype: Optional[tuple]
+
+        :raises ValueError: If a parameter field is not finite (nan or infinity)
+        :raises OverflowError: If the timestamp is out of range
+        :raises OSError: If the timestamp is out of the range of the platform
+        """
+
+        if point.measurement != self.measurement:
+            metrics.INGESTED_POINTS.increment("ignored")
+            return None
+
+        device_id = point.tags.get(self.device_tag)
+        device_id = self.device_aliases.get(device_id, device_id)
+        try:
+            device = get_device(device_id)
+        except KeyError:
+            metrics.INGESTED_POINTS.increment("unknown_device")
+            if device_id not in self._unknown_devices:
+                self._unknown_devices.add(device_id)
+                LOGGER.warning("Ignoring the points of the unknown device {device_id}".format(device_id=device_id))
+            return None
+
+        row = dict.fromkeys(ENERGY_PARAMETER_COLUMNS)
+        stored = False
+        for field, value in point.fields.items():
+            column = self.field_columns.get(field, field)
+            if column in row and isinstance(value, (int, float)) and not isinstance(value, bool):
+                # The database does not store nan and infinity, a single one would fail the insert of the whole batch
+                if not math.isfinite(value):
+                    raise ValueError("Invalid value {value} of the field {field}".format(value=value, field=field))
+                row[column] = float(value)
+                stored = True
+        if not stored:
+            metrics.INGESTED_POINTS.increment("ignored")
+            return None
+
+        timestamp = point.timestamp if point.timestamp is not None else time.time_ns()
+        moment = datetime.fromtimestamp(timestamp / 1e9, energy_today.PLANT_TIMEZONE).replace(tzinfo=None)
+        row["date"] = moment.date()
+        row["timestamp"] = moment
+        if device.device_column is not None:
+            row[device.device_column] = device.device_value
+        return device.table, row
+
+    def add_line(self, line: bytes):
+        """
+        Parse a line received from a device and add its row to the pending rows
+
+        :param line: The line, with or without the line break
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        text = line.decode("utf8", errors="replace").strip()
+        # Skipping the empty lines and the comments
+        if not text or text.startswith("#"):
+            return
+
+        try:
+            table_row = self.point_to_row(parse_line(text))
+        except (ValueError, OverflowError, OSError) as error:
+            metrics.INGESTED_POINTS.increment("invalid")
+            LOGGER.debug("Invalid line {line!r}: {error}".format(line=text, error=error))
+            return
+
+        if table_row is None:
+            return
+
+        table, row = table_row
+        self.pending.setdefault(table, []).append(row)
+        self.pending_count += 1
+        # The events exist once the server is started (the rows are only gathered before that)
+        if self._flush_needed is not None and self.pending_count >= self.flush_size:
+            self._flush_needed.set()
+        if self._space is not None and self.pending_count >= self.max_pending:
+            self._space.clear()
+
+    def _requeue(self, table, rows: list):
+        """
+        Put the rows of a failed insert back in front of the pending rows of their table, unless that would exceed
+        max_pending (then the rows are lost)
+
+        :param table: The table
+        :param rows: The rows
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self.pending_count + len(rows) > self.max_pending:
+            metrics.INGESTED_POINTS.increment("failed", amount=len(rows))
+            return
+        self.pending[table] = rows + self.pending.get(table, [])
+        self.pending_count += len(rows)
+
+    async def flush(self):
+        """
+        Insert all the pending rows, in one transaction (of bulk inserts) per table, so the rows of a table that fails
+        do not hold back the other tables. The rows of a failed insert are kept pending (up to max_pending) to be
+        inserted with the next flush
+
+        :return: The number of rows inserted
+        :rtype: int
+        """
+
+        if not self.pending:
+            return 0
+
+        pending = self.pending
+        self.pending, self.pending_count = {}, 0
+
+        inserted = 0
+        for table, rows in pending.items():
+            start_time = time.perf_counter()
+            try:
+                await run_in_transaction_async(self.engine, _insert_rows, table, rows)
+            except Exception as error:
+                LOGGER.error("Failed to insert {count} points into {table}: {error}".format(
+                    count=len(rows), table=table.fullname, error=error))
+                self._requeue(table, rows)
+                continue
+
+            metrics.INGESTION_FLUSH_DURATION.observe(value=time.perf_counter() - start_time)
+            metrics.INGESTED_POINTS.increment("inserted", amount=len(rows))
+            inserted += len(rows)
+            LOGGER.debug("Inserted {count} points into {table} in {time} Seconds".format(
+                count=len(rows), table=table.fullname, time=round(time.perf_counter() - start_time, 4)))
+
+        if self._space is not None and self.pending_count < self.max_pending:
+            self._space.set()
+        return inserted
+
+    async def _flush_forever(self):
+        """
+        Insert the pending rows every flush_interval seconds, or as soon as flush_size rows are pending, until the
+        server is stopped
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Read the lines of a device connection until it is closed
+
+        :param reader: The stream of the connection
+        :param writer: The writer of the connection (used to close it)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        peer = writer.get_extra_info("peername")
+        self.connections += 1
+        LOGGER.info("Device connected from {peer} ({count} connections)".format(peer=peer, count=self.connections))
+        try:
+            while True:
+                # Not reading any further while the inserts are behind, so the devices slow down instead of the
+                # pending rows growing without bound
+                await self._space.wait()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    LOGGER.warning("Closing the connection from {peer}, line longer than {limit} bytes".format(
+                        peer=peer, limit=MAX_LINE_BYTES))
+                    break
+                if not line:
+                    break
+                self.add_line(line)
+        except ConnectionError as error:
+            LOGGER.info("Connection from {peer} lost: {error}".format(peer=peer, error=error))
+        finally:
+            self.connections -= 1
+            writer.close()
+            LOGGER.info("Device disconnected from {peer}".format(peer=peer))
+
+    @property
+    def is_running(self):
+        """
+        Whether the server is accepting connections
+
+        :rtype: bool
+        """
+
+        return self._server is not None and self._server.is_serving()
+
+    async def start(self):
+        """
+        Start listening for the device connections and the flush task (must be called from a running event loop)
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self.is_running:
+            return
+
+        self._closing = False
+        self._flush_needed = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=MAX_LINE_BYTES)
+        self._task = asyncio.get_running_loop().create_task(self._flush_forever())
+        LOGGER.info("Ingestion server listening on {host}:{port} (flush every {size} points or {interval} "
+                    "seconds)".format(host=self.host, port=self.port, size=self.flush_size,
+                                      interval=self.flush_interval))
+
+    async def stop(self):
+        """
+        Stop accepting connections, stop the flush task and insert the rows still pending
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        # Letting the flush task finish the insert it is running (rather than cancelling it halfway)
+        if self._task is not None:
+            self._closing = True
+            self._flush_needed.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+        LOGGER.info("Stopped the ingestion server")
+
+    async def serve_forever(self):
+        """
+        Start the server and serve the devices until cancelled (such as with Ctrl+C), inserting the pending rows
+        before returning
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
@@ -15,79 +15,148 @@ environment you are running this script in.
 
 # Standard Imports
 import logging
-from typing import Optional
+from datetime import date as date_type, datetime, time, timedelta
+from typing import List, Optional, Union
 
 # External Imports
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 # User Imports
-from .router_dependencies import get_current_active_user
+from .router_dependencies import get_current_active_user, get_requested_device
 import energy_services.database as db
+from energy_services.utils import http_caching
+from energy_services.utils.responses import EnergyJSONResponse
 
 LOGGER = logging.getLogger(__name__)
 
+# The maximum number of dates of a statistics or batch request (a month)
+MAX_REQUEST_DATES = 31
+
 # Depends(get_current_active_user)
 ROUTER = APIRouter(
     prefix="/energy_meter/energy_core",
     tags=["Core Energy Routes"],
     dependencies=[],
+    default_response_class=EnergyJSONResponse,
     responses={404: {"description": "Not found"}},)
 
 
+def _latest_reading_headers(cache: db.LatestReadingCache, *parts):
+    """
+    Function that returns the validator headers of a response built from the latest reading, the entity tag is made
+    of the given parts and the id of the latest reading, and the reading's timestamp is the last modified time
+
+    :param cache: The latest reading cache of the device (already refreshed)
+    :param parts: The other parts of the entity tag (such as the device id)
+
+    :return: The headers
+    :rtype: dict
+    """
+
+    timestamp = getattr(cache.reading, "timestamp", None)
+    last_modified = db.plant_time_to_utc(timestamp) if isinstance(timestamp, datetime) else None
+    return http_caching.validator_headers(http_caching.entity_tag(*parts, cache.reading_id), last_modified)
+
+
+def _closed_days_headers(dates: List[str]):
+    """
+    Function that returns the cache headers of a history response, long lived when all its dates are closed (before
+    today, see http_caching.closed_day_headers)
+
+    :param dates: The dates (YYYY-MM-DD) of the response
+
+    :return: The headers
+    :rtype: dict
+    """
+
+    return http_caching.closed_day_headers() if all(db.is_closed_day(date) for date in dates) else {}
+
+
 @ROUTER.get("/current_update")
-async def read_all_current_values(engine: Engine = Depends(db.get_engine)):
+async def read_all_current_values(request: Request, engine: Union[Engine, AsyncEngine] = Depends(db.get_engine),
+                                  device: db.Device = Depends(get_requested_device)):
     """
 
     GET CURRENT PARAMETERS DATA
     ===============================
 
-    This api is used to query the latest data from the database
+    This api is used to get the latest data, served from the latest reading cache (which is refreshed in the
+    background) instead of querying the database on every request. The reading is always read from the primary
+    database, never from a read replica (which can lag behind).
+
+    The response carries an ETag made of the id of the latest reading, a client sending it back (If-None-Match)
+    gets "304 Not Modified" without a body until a new reading arrives.
 
+    :param request: The request (for its If-None-Match header)
     :param engine: The SqlAlchemy engine used to connect to the database.
+    :param device: The device (energy meter), the default device when not given
 
-    :return: Return the current parameters in json/dictionary format
-    :rtype: dict
+    :return: Return the current parameters in json/dictionary format, along with the "reading_id" and
+    "age_seconds" (time since the reading was read from the database)
+    :rtype: Union[EnergyJSONResponse, Response]
 
     """
-    statement = db.LATEST_ALL_PARAMETER_QUERY
-    database_records = db.read_rows(engine, statement)
-    data = db.current_parameters_to_dictionary(database_records)
-    return data
+    cache = db.latest_reading_cache(device)
+    await cache.refresh_if_stale(engine)
+
+    headers = _latest_reading_headers(cache, device.device_id)
+    if http_caching.etag_matches(request, headers["ETag"]):
+        return http_caching.not_modified(headers)
+    return EnergyJSONResponse(cache.to_dictionary(), headers=headers)
 
 
 @ROUTER.get("/total_energy_today")
-async def read_total_energy(engine: Engine = Depends(db.get_engine)):
+async def read_total_energy(request: Request, engine: Union[Engine, AsyncEngine] = Depends(db.get_engine),
+                            device: db.Device = Depends(get_requested_device)):
     """
 
     GET TOTAL ENERGY FOR TODAY
     ===============================
 
-    This api is used to query the total energy consumed today (from today morning until now)
+    This api is used to get the total energy consumed today (from today morning, in the plant timezone, until now),
+    computed from the cached start of the day energy and the latest reading cache.
+
+    The response carries an ETag made of the date and the id of the latest reading, a client sending it back
+    (If-None-Match) gets "304 Not Modified" without a body until a new reading arrives (or the day changes).
 
+    :param request: The request (for its If-None-Match header)
     :param engine: The SqlAlchemy engine used to connect to the database.
+    :param device: The device (energy meter), the default device when not given
 
-    :return: Return the current parameters in json/dictionary format
-    :rtype: dict
+    :return: Return the total energy along with the date and the id of the latest reading in json/dictionary format
+    :rtype: Union[EnergyJSONResponse, Response]
 
     """
-    statement = db.TOTAL_ENERGY_CONSUMED_TODAY_QUERY
-    database_records = db.read_rows(engine, statement)
-    data = db.total_energy_to_dictionary(database_records)
-    return data
+    cache = db.latest_reading_cache(device)
+    await cache.refresh_if_stale(engine)
+
+    headers = _latest_reading_headers(cache, device.device_id, db.plant_today())
+    if http_caching.etag_matches(request, headers["ETag"]):
+        return http_caching.not_modified(headers)
+
+    data = await db.total_energy_today(engine, device)
+    return EnergyJSONResponse(data, headers=headers)
 
 
 @ROUTER.get("/read_parameter_multiple")
 async def read_parameter_multiple(parameter: str, date_1: str, date_2:  Optional[str] = None,
                                   date_3:  Optional[str] = None, date_4:  Optional[str] = None,
-                                  date_5:  Optional[str] = None, engine: Engine = Depends(db.get_engine)):
+                                  date_5:  Optional[str] = None, points: Optional[int] = Query(None, ge=3),
+                                  method: str = "lttb", format: str = "pairs",
+                                  engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine),
+                                  device: db.Device = Depends(get_requested_device)):
     """
 
     GET PARAMETER VALUES FOR GIVEN DATE
     =======================================
 
     This api is used to query the all the values of a given parameter for a given date(s). Which will be used
-    for displaying a graph to compare the trend for the given 5 days.
+    for displaying a graph to compare the trend for the given 5 days. The series of the dates before today are
+    served from the day series cache once they have been read, and when all the dates are before today the response
+    is sent with long lived cache headers (like every history route, see http_caching.closed_day_headers).
 
     :param date_1: Date 1 for which all parameter values need to be sent
     :param date_2: Date 2 for which all parameter values need to be sent
@@ -95,10 +164,295 @@ async def read_parameter_multiple(parameter: str, date_1: str, date_2:  Optional
     :param date_4: Date 4 for which all parameter values need to be sent
     :param date_5: Date 5 for which all parameter values need to be sent
     :param parameter: The parameter that needs to be read from the database ( such as power, energy etc)
-    :param engine: The SqlAlchemy engine used to connect to the database
+    :param points: When given, the values of every date are downsampled (on the server) to these many points
+    :param method: The downsampling method, "lttb" ([timestamp, value] points keeping the shape of the series) or
+    "minmax" ([timestamp, min, max, average] for equal time buckets)
+    :param format: The format of the response, "pairs" ({date: [[timestamp, value], ...]}), "columnar"
+    ({date: {"timestamps": [epoch ms, ...], "values": [...]}}) or "binary" (see the series_formats module)
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+    :param device: The device (energy meter), the default device when not given
 
-    :return: Return the current parameters in json/dictionary format
-    :rtype: dict
+    :return: Return the current parameters in json/dictionary format (or the packed binary series)
+    :rtype: Union[EnergyJSONResponse, Response]
+
+    """
+
+    if method not in db.DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid method, should be one of {methods}".format(methods=db.DOWNSAMPLING_METHODS))
+
+    if format not in db.SERIES_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid format, should be one of {formats}".format(formats=db.SERIES_FORMATS))
+
+    dates = [date_1, date_2, date_3, date_4, date_5]
+
+    # Filtering out the dates that are not given
+    dates = list(filter(lambda date: date is not None, dates))
+
+    # The dates not cached are queried, from the coarsest rollup that still gives the requested number of points
+    # instead of the raw rows when it is available for the date
+    try:
+        source, rollup_dates = await db.read_day_series(engine, parameter, dates, points, device)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    headers = _closed_days_headers(dates)
+    series = db.source_columns_to_series(source, points, method, rollup_dates)
+    if format == "pairs":
+        data = {date: db.columns_to_pairs(columns) for date, columns in series.items()}
+        return EnergyJSONResponse(data, headers=headers)
+    if format == "columnar":
+        # The numpy columns are serialized as they are
+        return EnergyJSONResponse(series, headers=headers)
+    return Response(content=db.encode_binary_series(series), media_type=db.BINARY_SERIES_MEDIA_TYPE, headers=headers)
+
+
+@ROUTER.get("/read_parameter_batch")
+async def read_parameter_batch(parameters: List[str] = Query(...), dates: List[str] = Query(...),
+                               points: Optional[int] = Query(None, ge=3), method: str = "lttb",
+                               format: str = "pairs",
+                               engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine),
+                               device: db.Device = Depends(get_requested_device)):
+    """
+
+    GET SEVERAL PARAMETER VALUES FOR SEVERAL DATES
+    ==================================================
+
+    This api is used to query the values of several parameters for several dates in one request (such as power,
+    current and voltage overlaid for a few days). The series not cached are read in a single scan of the table for
+    all the parameters and dates, instead of one query per parameter and date.
+
+    :param parameters: The parameters ( such as power, avg_current etc), the query parameter can be repeated
+    :param dates: The dates (YYYY-MM-DD), the query parameter can be repeated
+    :param points: When given, the values of every series are downsampled (on the server) to these many points
+    :param method: The downsampling method, "lttb" or "minmax" (see "/read_parameter_multiple")
+    :param format: The format of the response, "pairs" ({date: {parameter: [[timestamp, value], ...]}}) or
+    "columnar" ({date: {parameter: {"timestamps": [epoch ms, ...], "values": [...]}}})
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+    :param device: The device (energy meter), the default device when not given
+
+    :return: Return the series of every date and parameter in json/dictionary format
+    :rtype: EnergyJSONResponse
+
+    """
+
+    if method not in db.DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid method, should be one of {methods}".format(methods=db.DOWNSAMPLING_METHODS))
+
+    if format not in ("pairs", "columnar"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid format, should be one of ('pairs', 'columnar')")
+
+    if len(dates) > MAX_REQUEST_DATES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="At most {count} dates can be requested".format(count=MAX_REQUEST_DATES))
+
+    try:
+        source = await db.read_day_series_batch(engine, parameters, dates, device)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    headers = _closed_days_headers(dates)
+    series = {date: db.source_columns_to_series(columns, points, method) for date, columns in source.items()}
+    if format == "pairs":
+        data = {date: {parameter: db.columns_to_pairs(columns) for parameter, columns in parameter_series.items()}
+                for date, parameter_series in series.items()}
+        return EnergyJSONResponse(data, headers=headers)
+    return EnergyJSONResponse(series, headers=headers)
+
+
+@ROUTER.get("/read_parameter_statistics")
+async def read_parameter_statistics(parameters: List[str] = Query(...), dates: List[str] = Query(...),
+                                    threshold: Optional[float] = None,
+                                    engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine),
+                                    device: db.Device = Depends(get_requested_device)):
+    """
+
+    GET PARAMETER STATISTICS FOR GIVEN DATES
+    ============================================
+
+    This api is used to get the statistics (count, min, max, mean, std, p50, p95 and p99) of one or more parameters
+    for one or more dates, computed on the server from the series of the dates (served from the day series cache
+    for the dates before today once they have been read).
+
+    :param parameters: The parameters ( such as power, avg_voltage etc), the query parameter can be repeated
+    :param dates: The dates (YYYY-MM-DD), the query parameter can be repeated
+    :param threshold: When given, the time (in seconds) every parameter was above the threshold on every date is
+    also sent (as "seconds_above_threshold")
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+    :param device: The device (energy meter), the default device when not given
+
+    :return: Return the statistics in json/dictionary format ({parameter: {date: {"count": ..., "min": ...}}})
+    :rtype: EnergyJSONResponse
+
+    """
+
+    if len(dates) > MAX_REQUEST_DATES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="At most {count} dates can be requested".format(count=MAX_REQUEST_DATES))
+
+    try:
+        data = await db.read_day_statistics(engine, parameters, dates, threshold, device)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return EnergyJSONResponse(data, headers=_closed_days_headers(dates))
+
+
+@ROUTER.get("/read_parameter_rollup")
+async def read_parameter_rollup(parameter: str, start_date: str, end_date: str, points: int = Query(500, ge=1),
+                                format: str = "columnar",
+                                engine: Union[Engine, AsyncEngine] = Depends(db.get_engine),
+                                device: db.Device = Depends(get_requested_device)):
+    """
+
+    GET AGGREGATED PARAMETER VALUES FOR A DATE RANGE
+    ===================================================
+
+    This api is used to query the values of a given parameter over a range of dates (weeks or months) from the
+    pre-aggregated rollup tables, using the coarsest rollup level that still gives the requested number of points.
+    The rollups are kept for the default device only, and the api responds with 503 while they are disabled or not
+    materialized yet.
+
+    :param parameter: The parameter that needs to be read from the database ( such as power, energy etc)
+    :param start_date: The first date of the range
+    :param end_date: The last date of the range (inclusive)
+    :param points: The (approximate) number of points required for the whole range
+    :param format: The format of the response, "columnar" ({"timestamps": [epoch ms, ...], "min": [...],
+    "max": [...], "average": [...], "last": [...], "delta": [...]}) or "binary" (see the series_formats module)
+    :param engine: The SqlAlchemy engine used to connect to the database (always the primary, where the rollups are
+    materialized)
+    :param device: The device (energy meter), the default device when not given
+
+    :return: Return the rollup buckets in json/dictionary format (or the packed binary series)
+    :rtype: Union[EnergyJSONResponse, Response]
+
+    """
+
+    # The tables exist (and hold the rows up to last_timestamp) once the materializer has run
+    rollups = db.ROLLUP_MATERIALIZER
+    if not rollups.enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Rollups are not enabled")
+    if rollups.last_timestamp is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Rollups are not materialized yet")
+
+    if not device.is_default:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Rollups are kept for the default device only")
+
+    if parameter not in db.ENERGY_PARAMETER_COLUMNS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid parameter")
+
+    if format not in ("columnar", "binary"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid format, should be one of ('columnar', 'binary')")
+
+    try:
+        days = (date_type.fromisoformat(end_date) - date_type.fromisoformat(start_date)).days + 1
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date, should be YYYY-MM-DD")
+    if days < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_date is before start_date")
+
+    # Falling back to the finest level when even that is coarser than the requested resolution
+    level = db.rollup_level_for_resolution(days * db.ROLLUP_LEVELS["1d"] / points) or "1m"
+
+    statement = db.statement_for_rollup_query(parameter, start_date, end_date, level)
+    records = await db.read_rows_async(engine, statement, "rollup")
+
+    # Cached by the clients only when the buckets of the last day are complete
+    headers = _closed_days_headers([end_date]) if rollups.covers(end_date) else {}
+    columns = db.rollup_columns(records)
+    if format == "columnar":
+        data = dict(columns)
+        data["level"] = level
+        return EnergyJSONResponse(data, headers=headers)
+    return Response(content=db.encode_binary_series({f"{start_date}/{end_date}": columns}),
+                    media_type=db.BINARY_SERIES_MEDIA_TYPE, headers=headers)
+
+
+@ROUTER.get("/read_parameter_range")
+async def read_parameter_range(start: datetime, end: datetime, parameters: List[str] = Query(...),
+                               page_size: int = Query(5000, ge=1, le=50000), cursor: Optional[str] = None,
+                               engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine),
+                               device: db.Device = Depends(get_requested_device)):
+    """
+
+    GET PARAMETER VALUES FOR A TIME RANGE
+    =======================================
+
+    This api is used to query the values of one or more parameters between two timestamps, one page at a time.
+    Every page comes with a "next_cursor", which is sent back (with the same start, end and parameters) to get the
+    next page, until "next_cursor" is null. Pages are read with a keyset on (timestamp, id), so every page costs the
+    same however far into the range it is.
+
+    :param start: The start of the range (inclusive)
+    :param end: The end of the range (exclusive)
+    :param parameters: The parameters that need to be read from the database ( such as power, energy etc), the query
+    parameter can be repeated (the columns of the page are in the order of the table)
+    :param page_size: The maximum number of rows in a page
+    :param cursor: The "next_cursor" of the previous page, not given for the first page
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+    :param device: The device (energy meter), the default device when not given
+
+    :return: Return the page in json/dictionary format ({"columns": [...], "rows": [[timestamp, value, ...], ...],
+    "next_cursor": ...})
+    :rtype: EnergyJSONResponse
+
+    """
+
+    # The columns of the page are in the order of the table, without repeats
+    try:
+        parameters = list(db.ordered_parameters(parameters))
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    after_timestamp, after_id = None, None
+    if cursor is not None:
+        try:
+            after_timestamp, after_id = db.decode_cursor(cursor)
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    # The range is read from the history mirror when it already holds all the rows of the range
+    statement = db.statement_for_range_query(parameters, start, end, page_size, after_timestamp, after_id, device)
+    records = await db.read_rows_async(db.history_engine(engine, end, device), statement, "range")
+
+    # A range ending by the start of today only holds the rows of closed days
+    headers = _closed_days_headers([(end - timedelta(microseconds=1)).date().isoformat()])
+    data = db.range_page_to_dictionary(parameters, records, page_size)
+    return EnergyJSONResponse(data, headers=headers)
+
+
+@ROUTER.get("/read_parameter_multiple_stream")
+async def read_parameter_multiple_stream(parameter: str, date_1: str, date_2: Optional[str] = None,
+                                         date_3: Optional[str] = None, date_4: Optional[str] = None,
+                                         date_5: Optional[str] = None,
+                                         engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine),
+                                         device: db.Device = Depends(get_requested_device)):
+    """
+
+    STREAM PARAMETER VALUES FOR GIVEN DATE
+    =======================================
+
+    This api is the streaming version of "/read_parameter_multiple". The rows are read from the database using a
+    server side cursor and sent as newline delimited json as they arrive, one line per batch of rows of the format
+    {"date": date, "values": [[timestamp, value], ...]}, so the memory used by a request does not grow with the
+    number of rows (and the rows are not truncated).
+
+    :param date_1: Date 1 for which all parameter values need to be sent
+    :param date_2: Date 2 for which all parameter values need to be sent
+    :param date_3: Date 3 for which all parameter values need to be sent
+    :param date_4: Date 4 for which all parameter values need to be sent
+    :param date_5: Date 5 for which all parameter values need to be sent
+    :param parameter: The parameter that needs to be read from the database ( such as power, energy etc)
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+    :param device: The device (energy meter), the default device when not given
+
+    :return: Streaming response of newline delimited json
+    :rtype: StreamingResponse
 
     """
 
@@ -107,9 +461,17 @@ async def read_parameter_multiple(parameter: str, date_1: str, date_2:  Optional
     # Filtering out the dates that are not given
     dates = list(filter(lambda date: date is not None, dates))
 
-    # For every date we're creating a new sql query statement
-    statements = [db.statement_for_date_query(parameter, date) for date in dates]
-    records = db.read_rows_multiple(engine, statements)
+    try:
+        statements = [db.statement_for_date_query(parameter, date, limit=None, device=device) for date in dates]
+        # The dates the history mirror already holds are read from the mirror
+        engines = [db.history_engine(engine, datetime.combine(date_type.fromisoformat(date) + timedelta(days=1),
+                                                              time.min), device) for date in dates]
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    async def json_lines():
+        for date, statement, date_engine in zip(dates, statements, engines):
+            async for batch in db.stream_rows_async(date_engine, statement, kind="date_stream"):
+                yield db.date_wise_batch_to_json_line(date, batch)
 
-    data = db.date_wise_parameters_to_dictionary(dates, records)
-    return data
+    return StreamingResponse(json_lines(), media_type="application/x-ndjson", headers=_closed_days_headers(dates))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+DEVICE ROUTES MODULE
+=====================================
+
+This Module consists of api routes for the devices (energy meters) served by this service, the list of the devices
+and a device scoped variant ("/energy_meter/devices/{device_id}/...") of every core energy route
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * fastapi - to define the api routes
+"""
+
+# Standard Imports
+import functools
+import logging
+
+# External Imports
+from fastapi import APIRouter
+
+# User Imports
+from . import core_energy_routes
+import energy_services.database as db
+from energy_services.utils.responses import EnergyJSONResponse
+
+LOGGER = logging.getLogger(__name__)
+
+ROUTER = APIRouter(
+    prefix="/energy_meter/devices",
+    tags=["Device Routes"],
+    dependencies=[],
+    default_response_class=EnergyJSONResponse,
+    responses={404: {"description": "Not found"}},)
+
+
+@ROUTER.get("")
+async def read_devices():
+    """
+
+    GET DEVICES
+    ===============
+
+    This api is used to get the devices (energy meters) served by this service and the table each is stored in.
+
+    :return: Return the devices in json/dictionary format, the default device first
+    :rtype: EnergyJSONResponse
+
+    """
+    return EnergyJSONResponse([device.to_dictionary() for device in db.all_devices()])
+
+
+def _device_endpoint(endpoint):
+    """
+    Function that returns a copy of a core route endpoint for its device scoped route (with the same signature, so
+    the "device_id" parameter becomes the path parameter), the copy keeps the routes apart in the request metrics
+
+    :param endpoint: The endpoint of the core route
+
+    :return: The endpoint of the device scoped route
+    :rtype: Callable
+    """
+
+    @functools.wraps(endpoint)
+    async def device_endpoint(*args, **kwargs):
+        return await endpoint(*args, **kwargs)
+
+    return device_endpoint
+
+
+for core_route in core_energy_routes.ROUTER.routes:
+    ROUTER.add_api_route("/{device_id}" + core_route.path[len(core_energy_routes.ROUTER.prefix):],
+                         _device_endpoint(core_route.endpoint), methods=list(core_route.methods),
+                         name="device_" + core_route.name, tags=["Device Routes"])
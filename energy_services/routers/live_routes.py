@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+LIVE ROUTES MODULE
+=====================================
+
+This Module consists of api routes that push the latest reading to the clients as soon as it is read (over a
+WebSocket or Server-Sent Events), so the dashboards do not need to poll "/energy_meter/energy_core/current_update"
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * fastapi - to define the api routes
+
+    * websockets - the websocket implementation used by uvicorn
+"""
+
+# Standard Imports
+import asyncio
+import logging
+
+# External Imports
+from fastapi import APIRouter, WebSocket
+from fastapi.responses import StreamingResponse
+
+# User Imports
+import energy_services.database as db
+
+LOGGER = logging.getLogger(__name__)
+
+# The time (in seconds) after which a comment is sent to an idle event stream, so the proxies do not close it
+SSE_KEEP_ALIVE_SECONDS = 15
+
+ROUTER = APIRouter(
+    prefix="/energy_meter/live",
+    tags=["Live Routes"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},)
+
+# The websocket routes are declared with their full path, as the prefix of the router is not applied to them
+WEBSOCKET_ROUTER = APIRouter(
+    tags=["Live Routes"],
+    dependencies=[],)
+
+
+@ROUTER.get("/readings")
+async def stream_readings_events():
+    """
+
+    STREAM THE LATEST READINGS (SERVER-SENT EVENTS)
+    ===================================================
+
+    This api is used to receive every new reading (of the default device) as soon as it is read, as a stream of
+    Server-Sent Events (text/event-stream, such as with an EventSource in the browser). The data of every event is
+    the latest reading in the format of "/energy_meter/energy_core/current_update", the first event is the latest
+    reading at the time of subscribing. A client that is slower than the readings only gets the latest one.
+
+    :return: Streaming response of the server sent events
+    :rtype: StreamingResponse
+
+    """
+
+    async def events():
+        async with db.READING_BROADCASTER.subscribe("sse") as subscription:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), SSE_KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "data: {message}\n\n".format(message=message)
+
+    # Asking the reverse proxies not to buffer the stream
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    """
+    Function that waits until the client closes the websocket (the messages sent by the client are ignored)
+
+    :param websocket: The websocket
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@WEBSOCKET_ROUTER.websocket("/energy_meter/live/readings/ws")
+async def stream_readings_websocket(websocket: WebSocket):
+    """
+
+    STREAM THE LATEST READINGS (WEBSOCKET)
+    ==========================================
+
+    This api is used to receive every new reading (of the default device) as soon as it is read, as a text message
+    over a websocket, in the same way as "/energy_meter/live/readings" (see stream_readings_events).
+
+    :param websocket: The websocket
+
+    :return: Nothing
+    :rtype: None
+
+    """
+
+    await websocket.accept()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(websocket))
+    try:
+        async with db.READING_BROADCASTER.subscribe("websocket") as subscription:
+            while True:
+                message = asyncio.ensure_future(subscription.get())
+                await asyncio.wait({message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    message.cancel()
+                    return
+                await websocket.send_text(message.result())
+    finally:
+        disconnected.cancel()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+MONITORING ROUTES MODULE
+=====================================
+
+This Module consists of api routes for monitoring the service itself, such as the state of the database connection
+pool, the health of the database connection and the metrics (in the prometheus text exposition format)
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * fastapi - to define the api routes
+"""
+
+# Standard Imports
+import logging
+from typing import Union
+
+# External Imports
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# User Imports
+import energy_services.database as db
+from energy_services.utils import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+ROUTER = APIRouter(
+    prefix="/energy_meter/monitoring",
+    tags=["Monitoring Routes"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},)
+
+# The metrics are served from the root ("/metrics"), where the prometheus scrapers look for them by default
+METRICS_ROUTER = APIRouter(
+    tags=["Monitoring Routes"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},)
+
+
+@ROUTER.get("/pool_stats")
+async def read_pool_statistics(engine: Union[Engine, AsyncEngine] = Depends(db.get_engine)):
+    """
+
+    GET CONNECTION POOL STATISTICS
+    ===================================
+
+    This api is used to get the state of the database connection pool, the number of connections checked out (in
+    use), idle and in overflow.
+
+    :param engine: The SqlAlchemy engine used to connect to the database.
+
+    :return: Return the pool statistics in json/dictionary format
+    :rtype: dict
+
+    """
+    return db.pool_statistics(engine)
+
+
+@ROUTER.get("/replicas")
+async def read_replica_state():
+    """
+
+    GET READ REPLICA STATE
+    ==========================
+
+    This api is used to get the state of the read replicas, whether each is healthy (or ejected), its latency and
+    how far behind the primary it is.
+
+    :return: Return the routing and the state of every replica in json/dictionary format
+    :rtype: dict
+
+    """
+    return db.READ_REPLICAS.to_dictionary()
+
+
+@ROUTER.get("/health")
+async def read_database_health(engine: Union[Engine, AsyncEngine] = Depends(db.get_engine)):
+    """
+
+    GET DATABASE HEALTH
+    ========================
+
+    This api is used to check that the database can be reached (by running a probe query on a pooled connection),
+    it responds with status 503 when it cannot be reached.
+
+    :param engine: The SqlAlchemy engine used to connect to the database.
+
+    :return: Return whether the database is healthy, the time the probe took and the pool statistics
+    :rtype: dict
+
+    """
+    probe = await db.probe_database(engine)
+    data = {**probe, "pool": db.pool_statistics(engine)}
+    return JSONResponse(data, status_code=200 if probe["healthy"] else 503)
+
+
+@METRICS_ROUTER.get("/metrics")
+async def read_metrics(engine: Union[Engine, AsyncEngine] = Depends(db.get_engine)):
+    """
+
+    GET METRICS
+    ===============
+
+    This api is used to get the metrics of the service (query latency and rows per kind of query, api latency and
+    response bytes per route, connection pool wait and state, cache hits and misses) in the prometheus text
+    exposition format.
+
+    :param engine: The SqlAlchemy engine used to connect to the database.
+
+    :return: Return the metrics as plain text
+    :rtype: Response
+
+    """
+    pool = db.pool_statistics(engine)
+    for state in ("checked_out", "idle", "overflow"):
+        if pool[state] is not None:
+            metrics.POOL_CONNECTIONS.set(state, value=pool[state])
+
+    return Response(content=metrics.render_metrics(), media_type=metrics.METRICS_MEDIA_TYPE)
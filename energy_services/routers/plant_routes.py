@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+PLANT ROUTES MODULE
+=====================================
+
+This Module consists of api routes for the plant level values, combining all the devices (energy meters) served by
+this service, such as the total power and energy consumed today by the plant
+
+This script requires that the following packages be installed within the Python
+environment you are running this script in.
+
+    * logging - to perform logging operations
+
+    * fastapi - to define the api routes
+"""
+
+# Standard Imports
+import logging
+from typing import Union
+
+# External Imports
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# User Imports
+import energy_services.database as db
+from energy_services.utils import http_caching
+from energy_services.utils.responses import EnergyJSONResponse
+
+LOGGER = logging.getLogger(__name__)
+
+ROUTER = APIRouter(
+    prefix="/energy_meter/plant",
+    tags=["Plant Routes"],
+    dependencies=[],
+    default_response_class=EnergyJSONResponse,
+    responses={404: {"description": "Not found"}},)
+
+
+@ROUTER.get("/current_update")
+async def read_plant_current_values(engine: Union[Engine, AsyncEngine] = Depends(db.get_engine)):
+    """
+
+    GET CURRENT PLANT DATA
+    ===========================
+
+    This api is used to get the latest data of every device (read concurrently) along with the total power and
+    energy of the plant.
+
+    :param engine: The SqlAlchemy engine used to connect to the database.
+
+    :return: Return the totals, the latest data of every device and the devices that failed in json/dictionary format
+    :rtype: EnergyJSONResponse
+
+    """
+    data = await db.plant_current_values(engine)
+    return EnergyJSONResponse(data)
+
+
+@ROUTER.get("/total_energy_today")
+async def read_plant_total_energy(engine: Union[Engine, AsyncEngine] = Depends(db.get_engine)):
+    """
+
+    GET TOTAL PLANT ENERGY FOR TODAY
+    ====================================
+
+    This api is used to get the energy consumed today by every device (read concurrently) and by the plant.
+
+    :param engine: The SqlAlchemy engine used to connect to the database.
+
+    :return: Return the total energy, the date, the energy of every device and the devices that failed in
+    json/dictionary format
+    :rtype: EnergyJSONResponse
+
+    """
+    data = await db.plant_total_energy_today(engine)
+    return EnergyJSONResponse(data)
+
+
+@ROUTER.get("/read_parameter")
+async def read_plant_parameter(parameter: str, date: str, points: int = Query(288, ge=1, le=86400),
+                               aggregate: str = "sum",
+                               engine: Union[Engine, AsyncEngine] = Depends(db.get_read_engine)):
+    """
+
+    GET PLANT SERIES OF A PARAMETER
+    ===================================
+
+    This api is used to get the series of a parameter for a date for the plant, the series of every device (read
+    concurrently) is averaged over "points" equal buckets of the day and the devices are summed (such as power,
+    energy) or averaged (such as voltage, frequency) bucket by bucket.
+
+    :param parameter: The parameter such as energy, power
+    :param date: The date (YYYY-MM-DD)
+    :param points: The number of buckets of the day (288 is one every 5 minutes)
+    :param aggregate: How the devices are combined, "sum" or "average"
+    :param engine: The SqlAlchemy engine used to connect to the database (a read replica when available)
+
+    :return: Return the bucket timestamps (epoch milliseconds) with the plant values, the values of every device and
+    the devices that failed in json/dictionary format
+    :rtype: EnergyJSONResponse
+
+    """
+    try:
+        data = await db.plant_parameter_series(engine, parameter, date, points, aggregate)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    # The series of a closed day does not change any more, so it can be cached by the clients
+    headers = http_caching.closed_day_headers() if db.is_closed_day(date) else {}
+    return EnergyJSONResponse(data, headers=headers)
@@ -27,7 +27,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 # User Imports
-from ..database import USER_DB
+from ..database import USER_DB, get_device
 
 LOGGER = logging.getLogger(__name__)
 
@@ -256,3 +256,23 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+def get_requested_device(device_id: Optional[str] = None):
+    """
+    GET REQUESTED DEVICE
+    ========================
+
+    This function is used as the dependency that resolves the device (energy meter) a request is for, from the
+    "device_id" path parameter of the device routes (or query parameter of the core routes).
+
+    :param device_id: The id of the device, the default device when not given
+
+    :return: The device
+    :rtype: Device
+    """
+
+    try:
+        return get_device(device_id)
+    except KeyError as error:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=error.args[0])
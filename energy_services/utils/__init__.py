@@ -8,6 +8,9 @@ This is an initialization module for helper utilities
 # Importing necessary modules and functions to be used by modules using this package
 from energy_services.utils.input_getter import get_input_arguments, get_arguments_from_file
 from energy_services.utils.logger import configure_logging
+from energy_services.utils.metrics import MetricsMiddleware, render_metrics, observe_query, observe_cache
+from energy_services.utils.responses import EnergyJSONResponse, dumps
+from energy_services.utils.http_caching import initialize_http_caching
 
 
 #ARGUMENTS = get_input_arguments()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Http Caching
+==============
+Module for the http caching headers of the api responses.
+
+The polling routes (such as the latest reading) are validated with an entity tag built from the id of the latest
+reading, a client sending back the tag of its last response (If-None-Match) gets an empty "304 Not Modified" as long
+as no new row has arrived, instead of the whole body again. The history of the closed days (the dates before today,
+whose rows do not change any more) is sent with long lived cache headers, so the browsers and a reverse proxy can
+serve the repeated requests themselves.
+
+This script requires the following modules be installed in the python environment
+    * starlette - for the request and response classes
+
+This script contains the following
+    * entity_tag - builds the (weak) entity tag of a response
+    * etag_matches - checks the If-None-Match header of a request against an entity tag
+    * http_date - formats a datetime as an http date (for the Last-Modified header)
+    * validator_headers - the ETag, Last-Modified and Cache-Control headers of a polling response
+    * not_modified - the "304 Not Modified" response
+    * closed_day_headers - the cache headers of a response made only of closed days
+    * initialize_http_caching - sets the max age of the closed day responses (from the main script)
+"""
+
+# Standard Imports
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Optional
+
+# External Imports
+from starlette.requests import Request
+from starlette.responses import Response
+
+# The polling responses can be stored, but are revalidated (with their entity tag) before every use
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# The max age (in seconds) of the responses of the closed days
+CLOSED_DAY_MAX_AGE = 7 * 24 * 3600
+
+
+def initialize_http_caching(closed_day_max_age: int):
+    """
+    Function used to initialize the global max age of the closed day responses ( from the main script)
+
+    :param closed_day_max_age: The time (in seconds) for which the responses of the closed days can be cached, 0 to
+    not cache them
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    if closed_day_max_age < 0:
+        raise ValueError("The closed day max age should not be negative")
+
+    global CLOSED_DAY_MAX_AGE
+    CLOSED_DAY_MAX_AGE = closed_day_max_age
+
+
+def closed_day_headers():
+    """
+    Function that returns the cache headers of the responses made only of closed days
+
+    :return: The headers
+    :rtype: dict
+    """
+
+    if CLOSED_DAY_MAX_AGE <= 0:
+        return {}
+    return {"Cache-Control": "public, max-age={max_age}, immutable".format(max_age=CLOSED_DAY_MAX_AGE)}
+
+
+def entity_tag(*parts):
+    """
+    Function that builds a weak entity tag from its parts (weak, as the bodies of the same tag can differ in the
+    values that do not matter to the clients, such as the age of the reading)
+
+    :param parts: The parts identifying the state sent in the response (such as the device and the reading id)
+
+    :return: The entity tag
+    :rtype: str
+    """
+
+    return 'W/"{tag}"'.format(tag="-".join(str(part) for part in parts))
+
+
+def etag_matches(request: Request, etag: str):
+    """
+    Function that checks whether the If-None-Match header of a request matches an entity tag (using the weak
+    comparison, as required for If-None-Match)
+
+    :param request: The request
+    :param etag: The entity tag of the current response
+
+    :return: True if the client already has the current response
+    :rtype: bool
+    """
+
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque_tag:
+            return True
+    return False
+
+
+def http_date(moment: datetime):
+    """
+    Function that formats a datetime as an http date (such as "Tue, 08 Mar 2022 18:30:00 GMT")
+
+    :param moment: The datetime, aware or naive utc
+
+    :return: The http date
+    :rtype: str
+    """
+
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None):
+    """
+    Function that returns the headers validating a polling response
+
+    :param etag: The entity tag of the response
+    :param last_modified: The time the state sent in the response last changed, if known
+
+    :return: The headers
+    :rtype: dict
+    """
+
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(headers: dict):
+    """
+    Function that returns the "304 Not Modified" response (without a body)
+
+    :param headers: The validator headers of the response (see validator_headers)
+
+    :return: The response
+    :rtype: Response
+    """
+
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics
+==========
+Module for the metrics (counters, gauges and latency histograms) of the service, exposed in the prometheus text
+exposition format on the "/metrics" api route
+
+The metrics are kept in memory of the process (every worker process has its own), recording a value is a dictionary
+lookup and a few additions under a lock, so the metrics can be left on under load.
+
+This script requires the following modules be installed in the python environment
+    * logging - to perform logging operations
+    * threading - to record the metrics from the worker threads (sync engine) safely
+
+This script contains the following
+    * Counter, Gauge, Histogram - the metric types
+    * MetricsRegistry, REGISTRY - the registry of all the metrics, rendered by render_metrics
+    * MetricsMiddleware - asgi middleware recording the latency, status and bytes of every api request
+    * The metrics of the service (QUERY_DURATION, QUERY_ROWS, POOL_WAIT, ...)
+"""
+
+# Standard Imports
+import bisect
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# The content type of the prometheus text exposition format (the response adds the utf-8 charset)
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4"
+
+# Latency buckets (in seconds) from a few milliseconds up to the slowest history queries
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Waiting for a pooled connection should take well under a millisecond unless the pool is exhausted
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _format_labels(names, values, extra=""):
+    """
+    Function that formats the labels of a sample, such as {kind="date",le="0.5"}
+
+    :param names: The label names
+    :param values: The label values (same order as the names)
+    :param extra: An already formatted label appended at the end (the "le" label of histogram buckets)
+
+    :return: The formatted labels, an empty string when there are none
+    :rtype: str
+    """
+
+    labels = ['{name}="{value}"'.format(name=name, value=str(value).replace("\\", "\\\\").replace("\n", "\\n")
+                                        .replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value):
+    """
+    Function that formats a sample value (integers without the decimal point)
+
+    :param value: The value
+
+    :return: The formatted value
+    :rtype: str
+    """
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    BASE CLASS OF THE METRICS
+    =============================
+
+    This class holds the name, help and label names of a metric and its values for every combination of labels.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        """
+        :param name: The name of the metric
+        :param documentation: The help text of the metric
+        :param label_names: The names of the labels of the metric
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """
+        Function that checks the number of label values and returns them as the key of the values
+
+        :param labels: The label values
+
+        :return: The label values as strings
+        :rtype: tuple[str]
+        """
+
+        if len(labels) != len(self.label_names):
+            raise ValueError("{name} expects the labels {labels}".format(name=self.name, labels=self.label_names))
+        return tuple(str(label) for label in labels)
+
+    def samples(self):
+        """
+        Function that returns the lines of the samples of the metric
+
+        :return: The sample lines
+        :rtype: list[str]
+        """
+
+        with self._lock:
+            values = list(self._values.items())
+        return ["{name}{labels} {value}".format(name=self.name, labels=_format_labels(self.label_names, key),
+                                                value=_format_value(value)) for key, value in values]
+
+    def render(self):
+        """
+        Function that returns the metric in the text exposition format
+
+        :return: The help and type lines followed by the samples
+        :rtype: str
+        """
+
+        lines = ["# HELP {name} {help}".format(name=self.name, help=self.documentation),
+                 "# TYPE {name} {type}".format(name=self.name, type=self.metric_type)]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """
+    COUNTER
+    ==========
+
+    A value that only goes up, such as the number of rows read.
+    """
+
+    metric_type = "counter"
+
+    def increment(self, *labels, amount: float = 1):
+        """
+        Function that increments the counter for the given labels
+
+        :param labels: The label values
+        :param amount: The amount to increment by
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    GAUGE
+    ========
+
+    A value that can go up and down, such as the number of connections checked out of the pool.
+    """
+
+    metric_type = "gauge"
+
+    def set(self, *labels, value: float):
+        """
+        Function that sets the gauge for the given labels
+
+        :param labels: The label values
+        :param value: The value
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    HISTOGRAM
+    ============
+
+    The distribution of observed values (such as latencies) over fixed buckets, from which the percentiles are
+    computed when querying the metrics.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        """
+        :param name: The name of the metric
+        :param documentation: The help text of the metric
+        :param label_names: The names of the labels of the metric
+        :param buckets: The upper bounds of the buckets (sorted)
+        """
+
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        """
+        Function that records an observed value for the given labels
+
+        :param labels: The label values
+        :param value: The observed value
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # The counts of every bucket (the last one is +Inf) followed by the sum of the observed values
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        """
+        Function that returns the lines of the (cumulative) buckets, sum and count of the histogram
+
+        :return: The sample lines
+        :rtype: list[str]
+        """
+
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bound = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                lines.append("{name}_bucket{labels} {value}".format(
+                    name=self.name, labels=_format_labels(self.label_names, key, 'le="{bound}"'.format(bound=bound)),
+                    value=cumulative))
+            labels = _format_labels(self.label_names, key)
+            lines.append("{name}_sum{labels} {value}".format(name=self.name, labels=labels,
+                                                             value=_format_value(counts[-1])))
+            lines.append("{name}_count{labels} {value}".format(name=self.name, labels=labels, value=cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    METRICS REGISTRY
+    ===================
+
+    This class holds all the metrics of the service, in the order they were registered.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric):
+        """
+        Function that adds a metric to the registry
+
+        :param metric: The metric
+
+        :return: The same metric
+        :rtype: Metric
+        """
+
+        if metric.name in self.metrics:
+            raise ValueError("Metric {name} is already registered".format(name=metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Function that returns all the metrics in the text exposition format
+
+        :return: The metrics
+        :rtype: str
+        """
+
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+QUERY_DURATION = REGISTRY.register(Histogram(
+    "energy_query_duration_seconds", "Time taken to run a database query (excluding the wait for a connection)",
+    ("kind",)))
+QUERY_ROWS = REGISTRY.register(Counter(
+    "energy_query_rows_total", "Number of rows read from the database", ("kind",)))
+POOL_WAIT = REGISTRY.register(Histogram(
+    "energy_pool_wait_seconds", "Time taken to check out a connection from the pool", (), POOL_WAIT_BUCKETS))
+POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    "energy_pool_connections", "Number of connections of the pool in a state (checked_out, idle or overflow)",
+    ("state",)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "energy_cache_requests_total", "Number of lookups of an in memory cache, by result (hit or miss)",
+    ("cache", "result")))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "energy_http_request_duration_seconds", "Time taken to respond to an api request", ("method", "route", "status")))
+RESPONSE_BYTES = REGISTRY.register(Counter(
+    "energy_http_response_bytes_total", "Number of bytes of the api responses (body)", ("method", "route")))
+INGESTED_POINTS = REGISTRY.register(Counter(
+    "energy_ingested_points_total", "Number of line protocol points received by the ingestion server, by result "
+    "(inserted, invalid, ignored, unknown_device or failed)", ("result",)))
+INGESTION_FLUSH_DURATION = REGISTRY.register(Histogram(
+    "energy_ingestion_flush_seconds", "Time taken to insert a batch of ingested points"))
+LIVE_SUBSCRIBERS = REGISTRY.register(Gauge(
+    "energy_live_subscribers", "Number of clients subscribed to the live readings, by transport (websocket or sse)",
+    ("transport",)))
+LIVE_MESSAGES = REGISTRY.register(Counter(
+    "energy_live_messages_total", "Number of live reading messages queued for the subscribers, by result (queued or "
+    "replaced, when the subscriber had not taken the previous message yet)", ("result",)))
+
+
+def observe_query(kind: str, seconds: float, rows: int):
+    """
+    Function that records the duration and the number of rows of a query
+
+    :param kind: The kind of the query (such as date, range, latest_reading)
+    :param seconds: The time taken by the query
+    :param rows: The number of rows returned
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    QUERY_DURATION.observe(kind, value=seconds)
+    QUERY_ROWS.increment(kind, amount=rows)
+
+
+def observe_cache(cache: str, hit: bool):
+    """
+    Function that records a lookup of an in memory cache
+
+    :param cache: The name of the cache
+    :param hit: Whether the value was served from the cache
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    CACHE_REQUESTS.increment(cache, "hit" if hit else "miss")
+
+
+def render_metrics():
+    """
+    Function that returns all the metrics of the service in the text exposition format
+
+    :return: The metrics
+    :rtype: str
+    """
+
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    METRICS MIDDLEWARE
+    =====================
+
+    Asgi middleware that records the latency, status and response body bytes of every api request, labelled with
+    the path of the route (such as /energy_meter/energy_core/read_parameter_multiple, not the requested url, so the
+    number of label values stays bounded).
+    """
+
+    def __init__(self, app):
+        """
+        :param app: The asgi application wrapped by the middleware
+        """
+
+        self.app = app
+        self._route_paths = {}
+
+    def _route(self, scope):
+        """
+        Function that returns the path of the route that handled the request
+
+        :param scope: The asgi scope of the request (the router adds the endpoint to it)
+
+        :return: The path of the route, "unmatched" when no route handled the request
+        :rtype: str
+        """
+
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._route_paths:
+            for route in getattr(scope.get("app"), "routes", []):
+                self._route_paths[getattr(route, "endpoint", None)] = getattr(route, "path", "unmatched")
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        response = {"status": 500, "bytes": 0}
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            route = self._route(scope)
+            REQUEST_DURATION.observe(scope["method"], route, response["status"],
+                                     value=time.perf_counter() - start_time)
+            RESPONSE_BYTES.increment(scope["method"], route, amount=response["bytes"])
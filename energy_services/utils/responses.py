@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Responses
+============
+Module for the fast json serialization of the api responses, using orjson which serializes the datetimes and the
+numpy arrays (such as the columns of a series) natively, instead of walking every value in python (jsonable_encoder
+followed by json.dumps)
+
+The api routes return an EnergyJSONResponse themselves (rather than a dictionary) so that fastapi does not run the
+content through jsonable_encoder before the response class gets it.
+
+This script requires the following modules be installed in the python environment
+    * orjson - to serialize the responses
+    * numpy - for the numpy values not serialized natively (such as the arrays that are not contiguous)
+
+This script contains the following
+    * dumps - serializes a value to json bytes
+    * EnergyJSONResponse - the json response class of the energy routes
+"""
+
+# Standard Imports
+from decimal import Decimal
+
+# External Imports
+import numpy as np
+import orjson
+from starlette.responses import JSONResponse
+
+# Numpy arrays are serialized natively, and the dictionaries can be keyed by dates and numbers
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    """
+    Function used by orjson to convert the values it does not serialize natively
+
+    :param value: The value that needs to be converted
+
+    :return: Lists for numpy arrays, python numbers for numpy scalars and floats for decimals
+    :rtype: Union[list, int, float]
+    """
+
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("Object of type {type} is not JSON serializable".format(type=type(value).__name__))
+
+
+def dumps(content):
+    """
+    Function that serializes a value to json (nan and infinity are serialized as null)
+
+    :param content: The value
+
+    :return: The json
+    :rtype: bytes
+    """
+
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class EnergyJSONResponse(JSONResponse):
+    """
+    ENERGY JSON RESPONSE
+    =======================
+
+    Json response serialized with orjson (see dumps), accepting datetimes, decimals and numpy arrays in the content.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -22,11 +22,13 @@ import logging
 # External Imports
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 # User Imports
 import energy_services.utils as helper
 import energy_services.database as db
-from energy_services.routers import core_energy_routes, security_routes, user_routes
+from energy_services.routers import core_energy_routes, device_routes, live_routes, monitoring_routes, \
+    plant_routes, security_routes, user_routes
 
 LOGGER = logging.getLogger(__name__)
 
@@ -39,14 +41,79 @@ helper.configure_logging(LOG_CONFIG_FILE)
 
 LOGGER.info("Creating Engine")
 
-# Getting a new engine
-DB_ENGINE = db.create_new_engine(ARGUMENTS["dialect"], ARGUMENTS["driver"],
-                                 ARGUMENTS["user"], ARGUMENTS["password"],
-                                 ARGUMENTS["host"], ARGUMENTS["database"])
+# The connection pool settings (size, overflow, recycle, pre-ping and timeout)
+POOL_ARGUMENTS = ARGUMENTS.get("pool", {})
+
+# Getting a new engine, the async engine (async driver) is used when enabled so that the queries from the
+# async api routes do not block the event loop
+if ARGUMENTS.get("async_engine", False):
+    DB_ENGINE = db.create_new_async_engine(ARGUMENTS["dialect"], ARGUMENTS["async_driver"],
+                                           ARGUMENTS["user"], ARGUMENTS["password"],
+                                           ARGUMENTS["host"], ARGUMENTS["database"], POOL_ARGUMENTS)
+else:
+    DB_ENGINE = db.create_new_engine(ARGUMENTS["dialect"], ARGUMENTS["driver"],
+                                     ARGUMENTS["user"], ARGUMENTS["password"],
+                                     ARGUMENTS["host"], ARGUMENTS["database"], POOL_ARGUMENTS)
 
 # Initializing the global engine variable to the newly created sqlalchemy engine created above
 db.initialize_global_engine(DB_ENGINE)
 
+# The read replicas of the primary (same user, password and database), serving the history queries
+REPLICA_ARGUMENTS = ARGUMENTS.get("read_replicas", {})
+if ARGUMENTS.get("async_engine", False):
+    REPLICA_ENGINES = {host: db.create_new_async_engine(ARGUMENTS["dialect"], ARGUMENTS["async_driver"],
+                                                        ARGUMENTS["user"], ARGUMENTS["password"], host,
+                                                        ARGUMENTS["database"], POOL_ARGUMENTS)
+                       for host in REPLICA_ARGUMENTS.get("hosts", [])}
+else:
+    REPLICA_ENGINES = {host: db.create_new_engine(ARGUMENTS["dialect"], ARGUMENTS["driver"],
+                                                  ARGUMENTS["user"], ARGUMENTS["password"], host,
+                                                  ARGUMENTS["database"], POOL_ARGUMENTS)
+                       for host in REPLICA_ARGUMENTS.get("hosts", [])}
+db.initialize_read_replicas(DB_ENGINE, REPLICA_ENGINES, REPLICA_ARGUMENTS.get("routing", "round_robin"),
+                            REPLICA_ARGUMENTS.get("probe_interval", 5), REPLICA_ARGUMENTS.get("failure_threshold", 2),
+                            REPLICA_ARGUMENTS.get("max_lag_seconds", 10))
+
+# Registering the energy meters (devices) served, the default device is the energy meter table
+db.initialize_devices(ARGUMENTS.get("default_device", "main"), ARGUMENTS.get("devices", {}))
+
+# Running the per date statements of the multiple date queries concurrently (bounded by max_concurrent_queries)
+db.initialize_query_concurrency(ARGUMENTS.get("parallel_queries", False), ARGUMENTS.get("max_concurrent_queries", 5))
+
+# Sharing the result of a query between the callers of the identical query while it is running
+db.initialize_single_flight(ARGUMENTS.get("single_flight", False))
+
+# Setting how long the latest reading is served from memory before it is read again
+db.initialize_latest_reading_cache(ARGUMENTS.get("latest_reading_ttl", 2))
+
+# The day (for the energy consumed today) rolls over at midnight in the plant timezone
+db.initialize_plant_timezone(ARGUMENTS.get("plant_timezone", "Asia/Kolkata"))
+# A date is closed (its series cached for good) only this long after its end, once the late rows are in
+db.initialize_closed_day_grace(ARGUMENTS.get("closed_day_grace_seconds", 3600))
+
+# Maintaining the pre-aggregated rollup tables (used by the history queries) in the background
+ROLLUP_ARGUMENTS = ARGUMENTS.get("rollups", {})
+db.initialize_rollups(ROLLUP_ARGUMENTS.get("enabled", False), ROLLUP_ARGUMENTS.get("interval", 60),
+                      ROLLUP_ARGUMENTS.get("batch_size", 20000), DB_ENGINE.dialect.name)
+
+# Keeping a local copy of the energy meter table and serving the history queries from it (read routing "mirror")
+MIRROR_ARGUMENTS = ARGUMENTS.get("history_mirror", {})
+db.initialize_history_mirror(MIRROR_ARGUMENTS.get("enabled", False),
+                             MIRROR_ARGUMENTS.get("path", "cache/history_mirror.sqlite"),
+                             MIRROR_ARGUMENTS.get("interval", 30), MIRROR_ARGUMENTS.get("batch_size", 20000))
+db.initialize_read_routing(ARGUMENTS.get("read_routing", "primary"), db.HISTORY_MIRROR)
+
+# Caching the series of the past days (which do not change any more) read by the history queries
+DAY_SERIES_CACHE_ARGUMENTS = ARGUMENTS.get("day_series_cache", {})
+db.initialize_day_series_cache(DAY_SERIES_CACHE_ARGUMENTS.get("enabled", False),
+                               DAY_SERIES_CACHE_ARGUMENTS.get("max_bytes", 256 * 1024 * 1024),
+                               DAY_SERIES_CACHE_ARGUMENTS.get("today_ttl", 0),
+                               DAY_SERIES_CACHE_ARGUMENTS.get("directory"),
+                               DAY_SERIES_CACHE_ARGUMENTS.get("disk_max_bytes"))
+
+# The time for which the clients (and a reverse proxy) can cache the history responses of the closed days
+helper.initialize_http_caching(ARGUMENTS.get("http_caching", {}).get("closed_day_max_age", 7 * 24 * 3600))
+
 LOGGER.info("Engine Creation Over")
 
 LOGGER.info("Creating the FastApi application")
@@ -63,6 +130,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Recording the latency, status and response bytes of every request (exposed on "/metrics")
+app.add_middleware(helper.MetricsMiddleware)
+
 app.include_router(core_energy_routes.ROUTER)
+app.include_router(device_routes.ROUTER)
+app.include_router(plant_routes.ROUTER)
+app.include_router(live_routes.ROUTER)
+app.include_router(live_routes.WEBSOCKET_ROUTER)
 app.include_router(security_routes.ROUTER)
 app.include_router(user_routes.ROUTER)
+app.include_router(monitoring_routes.ROUTER)
+app.include_router(monitoring_routes.METRICS_ROUTER)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """
+    Warming up the connection pool, checking the tables and starting the background tasks (such as refreshing the
+    latest reading) once the event loop is running, before the application accepts requests
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    # Opening the connections of the pool, so the first requests do not wait for new connections
+    if POOL_ARGUMENTS.get("warm_up", False):
+        await db.warm_up_pool(DB_ENGINE)
+        for replica_engine in REPLICA_ENGINES.values():
+            await db.warm_up_pool(replica_engine)
+
+    # Checking the declared energy meter table against the one in the database
+    await db.run_in_transaction_async(DB_ENGINE, db.reflect_tables)
+
+    db.LATEST_READING_CACHE.start(DB_ENGINE)
+    db.ROLLUP_MATERIALIZER.start(DB_ENGINE)
+    db.HISTORY_MIRROR.start(DB_ENGINE)
+
+    # Probing the replicas once before serving, so the reads go to the replicas from the first request
+    await db.READ_REPLICAS.probe_all()
+    db.READ_REPLICAS.start()
+
+
+@app.on_event("shutdown")
+async def dispose_engine():
+    """
+    Stopping the background tasks and disposing the engine (closing all the pooled connections) when the
+    application is shutting down
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    await db.LATEST_READING_CACHE.stop()
+    await db.ROLLUP_MATERIALIZER.stop()
+    await db.HISTORY_MIRROR.stop()
+    await db.READ_REPLICAS.stop()
+
+    for engine in [DB_ENGINE, *REPLICA_ENGINES.values()]:
+        if isinstance(engine, AsyncEngine):
+            await engine.dispose()
+        else:
+            engine.dispose()
+    LOGGER.info("Engine disposed")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+
+Main Ingestion Module
+========================
+
+Main Module for receiving the readings of the devices (in the InfluxDB line protocol, such as sent by the device
+simulator) and storing them in the energy meter tables
+
+This script requires the following modules be installed in the python environment
+
+    * logging - to perform logging operations
+
+This script contains the following function
+
+    * main - main function to call appropriate functions
+
+"""
+
+# Standard imports
+import asyncio
+import logging
+
+# External Imports
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# User Imports
+import energy_services.utils as helper
+import energy_services.database as db
+import energy_services.devices as devices
+
+LOGGER = logging.getLogger(__name__)
+
+ARGUMENTS = helper.get_arguments_from_file()
+# Getting the path for logging config using arparse
+LOG_CONFIG_FILE = ARGUMENTS["logfile"]
+# Configuring logging
+helper.configure_logging(LOG_CONFIG_FILE)
+
+
+async def serve(engine):
+    """
+    Serve the device connections until cancelled, then dispose the engine
+
+    :param engine: The Sqlalchemy engine (sync or asyncio) the readings are inserted with
+
+    :return: Nothing
+    :rtype: None
+    """
+
+    ingestion_arguments = ARGUMENTS.get("ingestion", {})
+    server = devices.IngestionServer(engine, ingestion_arguments.get("host", "0.0.0.0"),
+                                     ingestion_arguments.get("port", 8094),
+                                     ingestion_arguments.get("flush_size", 1000),
+                                     ingestion_arguments.get("flush_interval", 1.0),
+                                     ingestion_arguments.get("measurement", "energy"),
+                                     ingestion_arguments.get("device_tag", "device"),
+                                     ingestion_arguments.get("field_columns", {}),
+                                     ingestion_arguments.get("device_aliases", {}))
+    try:
+        await server.serve_forever()
+    finally:
+        if isinstance(engine, AsyncEngine):
+            await engine.dispose()
+        else:
+            engine.dispose()
+
+
+def main():
+
+    # The connection pool settings (size, overflow, recycle, pre-ping and timeout)
+    pool_arguments = ARGUMENTS.get("pool", {})
+
+    if ARGUMENTS.get("async_engine", False):
+        engine = db.create_new_async_engine(ARGUMENTS["dialect"], ARGUMENTS["async_driver"],
+                                            ARGUMENTS["user"], ARGUMENTS["password"],
+                                            ARGUMENTS["host"], ARGUMENTS["database"], pool_arguments)
+    else:
+        engine = db.create_new_engine(ARGUMENTS["dialect"], ARGUMENTS["driver"],
+                                      ARGUMENTS["user"], ARGUMENTS["password"],
+                                      ARGUMENTS["host"], ARGUMENTS["database"], pool_arguments)
+
+    # The devices (and their tables) the readings are stored for, and the timezone the timestamps are stored in
+    db.initialize_devices(ARGUMENTS.get("default_device", "main"), ARGUMENTS.get("devices", {}))
+    db.initialize_plant_timezone(ARGUMENTS.get("plant_timezone", "Asia/Kolkata"))
+
+    try:
+        asyncio.run(serve(engine))
+    except KeyboardInterrupt:
+        LOGGER.info("Ingestion server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+
+Serialization Benchmark
+==========================
+
+Module for comparing the time taken to encode a large "/read_parameter_multiple" response (100000 points over five
+dates) with the default fastapi encoding (jsonable_encoder followed by json.dumps) and with the orjson based
+EnergyJSONResponse, for the "pairs" and the "columnar" response formats
+
+This script requires the following modules be installed in the python environment
+
+    * logging - to perform logging operations
+
+    * numpy - to generate the series
+
+This script contains the following function
+
+    * main - main function to run the benchmark
+
+"""
+
+# Standard imports
+import logging
+import time
+
+# External Imports
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# User Imports
+import energy_services.database as db
+from energy_services.utils.responses import EnergyJSONResponse
+
+LOGGER = logging.getLogger(__name__)
+
+# The size of the benchmarked response
+DATES = ("2022-03-01", "2022-03-02", "2022-03-03", "2022-03-04", "2022-03-05")
+POINTS_PER_DATE = 20000
+REPEATS = 5
+
+
+def generate_series():
+    """
+    Function that generates the columns of every date (a reading every 4.32 seconds) as returned by read_day_series
+
+    :return: The dictionary of date to its "timestamps" (epoch milliseconds) and "values" columns
+    :rtype: dict[str, dict[str, np.ndarray]]
+    """
+
+    generator = np.random.default_rng(0)
+    series = {}
+    for date in DATES:
+        start = np.datetime64(date, "ms").astype(np.int64)
+        series[date] = {"timestamps": start + np.arange(POINTS_PER_DATE, dtype=np.int64) * 4320,
+                        "values": generator.uniform(0, 250, POINTS_PER_DATE)}
+    return series
+
+
+def best_time(function):
+    """
+    Function that runs a function REPEATS times and returns the best time taken along with its result
+
+    :param function: The function to be timed (without arguments)
+
+    :return: The best time in seconds and the result of the function
+    :rtype: tuple[float, object]
+    """
+
+    timings, result = [], None
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+def main():
+    """
+    Main function to run the benchmark and log the time taken by every encoding
+
+    :return: Nothing
+    """
+
+    series = generate_series()
+    pairs = {date: db.columns_to_pairs(columns) for date, columns in series.items()}
+
+    candidates = [
+        ("pairs - jsonable_encoder + json", lambda: JSONResponse(jsonable_encoder(pairs)).body),
+        ("pairs - orjson", lambda: EnergyJSONResponse(pairs).body),
+        ("columnar - jsonable_encoder + json",
+         lambda: JSONResponse(jsonable_encoder(db.columns_to_dictionary(series))).body),
+        ("columnar - orjson (numpy)", lambda: EnergyJSONResponse(series).body),
+    ]
+
+    LOGGER.info("Encoding {points} points over {dates} dates (best of {repeats})".format(
+        points=POINTS_PER_DATE * len(DATES), dates=len(DATES), repeats=REPEATS))
+    baseline = None
+    for name, encode in candidates:
+        seconds, body = best_time(encode)
+        baseline = baseline or seconds
+        LOGGER.info("{name:<40} {milliseconds:>9.2f} ms {size:>10} bytes {speedup:>7.1f}x".format(
+            name=name, milliseconds=seconds * 1000, size=len(body), speedup=baseline / seconds))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
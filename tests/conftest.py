@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests
+
+    * engine - an in-memory sqlite engine holding the energy meter table (in its schema)
+    * replica_engine - another such engine (standing for a read replica)
+"""
+
+# External Imports
+import pytest
+from sqlalchemy import BigInteger, create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+# User Imports
+from energy_services.database.table_models import ENERGY_LMEASURE_TABLE, ENERGY_SCHEMA
+
+
+# sqlite assigns the ids only of the INTEGER primary keys (as the auto increment of the energy meter table on mysql)
+@compiles(BigInteger, "sqlite")
+def _big_integer_sqlite(element, compiler, **kw):
+    return "INTEGER"
+
+
+def _attach_energy_schema(dbapi_connection, connection_record):
+    dbapi_connection.execute("ATTACH DATABASE ':memory:' AS {schema}".format(schema=ENERGY_SCHEMA))
+
+
+def _create_engine():
+    """
+    Create an in-memory sqlite engine (a single connection shared by the threads) with the energy meter table
+    """
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _attach_energy_schema)
+    ENERGY_LMEASURE_TABLE.create(engine)
+    return engine
+
+
+@pytest.fixture
+def engine():
+    engine = _create_engine()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def replica_engine():
+    engine = _create_engine()
+    yield engine
+    engine.dispose()
+
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the day series cache (which series of the closed days are cached for good)
+"""
+
+# Standard Imports
+import asyncio
+from datetime import datetime, timedelta
+
+# External Imports
+import pytest
+from sqlalchemy import insert
+
+# User Imports
+from energy_services.database import day_series_cache, energy_today
+from energy_services.database.day_series_cache import (DAY_SERIES_CACHE, RAW_RESOLUTION, initialize_day_series_cache,
+                                                       read_day_series, read_day_series_batch)
+from energy_services.database.table_models import ENERGY_LMEASURE_TABLE
+
+DATE = "2022-03-06"
+
+
+@pytest.fixture
+def series_engine(engine):
+    with engine.begin() as conn:
+        conn.execute(insert(ENERGY_LMEASURE_TABLE), [
+            {"id": row_id, "date": datetime(2022, 3, 6).date(), "timestamp": datetime(2022, 3, 6, 10, 0, row_id),
+             "power": float(row_id)} for row_id in range(1, 4)])
+    # The series not cached for good are not cached at all
+    initialize_day_series_cache(True, today_ttl=0)
+    yield engine
+    initialize_day_series_cache(False)
+
+
+def _cached_for_good(key: tuple):
+    return asyncio.run(DAY_SERIES_CACHE.get(key, True)) is not None
+
+
+def test_is_closed_day_after_the_grace_period(monkeypatch):
+    today = datetime.now(energy_today.PLANT_TIMEZONE).date()
+    yesterday = (today - timedelta(days=1)).isoformat()
+
+    monkeypatch.setattr(energy_today, "CLOSED_DAY_GRACE_SECONDS", 0)
+    assert energy_today.is_closed_day(yesterday)
+    assert not energy_today.is_closed_day(today.isoformat())
+
+    # A whole day of grace, yesterday is closed only from the end of today
+    monkeypatch.setattr(energy_today, "CLOSED_DAY_GRACE_SECONDS", 24 * 3600)
+    assert not energy_today.is_closed_day(yesterday)
+
+
+def test_closed_day_is_cached(series_engine):
+    source, _ = asyncio.run(read_day_series(series_engine, "power", [DATE]))
+
+    assert source[DATE]["values"].tolist() == [1.0, 2.0, 3.0]
+    assert _cached_for_good(("main", "power", DATE, RAW_RESOLUTION))
+
+
+def test_truncated_closed_day_is_not_cached(series_engine, monkeypatch):
+    monkeypatch.setattr(day_series_cache, "DATE_SERIES_LIMIT", 3)
+
+    asyncio.run(read_day_series(series_engine, "power", [DATE]))
+
+    assert not _cached_for_good(("main", "power", DATE, RAW_RESOLUTION))
+
+
+def test_closed_day_is_read_from_the_primary(series_engine, replica_engine, monkeypatch):
+    monkeypatch.setattr(day_series_cache, "primary_engine", lambda engine: series_engine)
+
+    # The replica has not received the rows yet
+    source, _ = asyncio.run(read_day_series(replica_engine, "power", [DATE]))
+
+    assert source[DATE]["values"].tolist() == [1.0, 2.0, 3.0]
+    assert _cached_for_good(("main", "power", DATE, RAW_RESOLUTION))
+
+
+def test_open_day_read_from_a_replica_is_not_cached(series_engine, replica_engine, monkeypatch):
+    monkeypatch.setattr(day_series_cache, "primary_engine", lambda engine: series_engine)
+    monkeypatch.setattr(day_series_cache, "is_closed_day", lambda date: False)
+
+    source, _ = asyncio.run(read_day_series(replica_engine, "power", [DATE]))
+
+    assert source[DATE]["values"].tolist() == []
+    assert not _cached_for_good(("main", "power", DATE, RAW_RESOLUTION))
+
+
+def test_batch_splits_the_rows_by_their_date(series_engine):
+    # A reading of the 6th stored just after midnight
+    with series_engine.begin() as conn:
+        conn.execute(insert(ENERGY_LMEASURE_TABLE), [{"id": 4, "date": datetime(2022, 3, 6).date(),
+                                                      "timestamp": datetime(2022, 3, 7, 0, 0, 5), "power": 4.0}])
+
+    batch = asyncio.run(read_day_series_batch(series_engine, ["power"], [DATE, "2022-03-07"]))
+    initialize_day_series_cache(True, today_ttl=0)
+    source, _ = asyncio.run(read_day_series(series_engine, "power", [DATE, "2022-03-07"]))
+
+    assert batch[DATE]["power"]["values"].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert batch["2022-03-07"]["power"]["values"].tolist() == []
+    assert source[DATE]["values"].tolist() == batch[DATE]["power"]["values"].tolist()
+
+
+def test_batch_limits_the_rows_of_every_date(series_engine, monkeypatch):
+    monkeypatch.setattr(day_series_cache, "DATE_SERIES_LIMIT", 2)
+
+    batch = asyncio.run(read_day_series_batch(series_engine, ["power"], [DATE]))
+
+    assert batch[DATE]["power"]["values"].size == 2
+    assert not _cached_for_good(("main", "power", DATE, RAW_RESOLUTION))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the ingestion server (the parsing of the line protocol, the conversion of the points to rows and the flush of
+the pending rows)
+"""
+
+# Standard Imports
+import asyncio
+from datetime import datetime
+
+# External Imports
+import pytest
+from sqlalchemy import func, select
+
+# User Imports
+from energy_services.database import ENERGY_LMEASURE_TABLE, get_device, initialize_devices
+from energy_services.devices import IngestionServer, LinePoint, parse_line
+from energy_services.devices import ingestion_server
+
+# 2022-03-06 10:00:00 UTC (15:30:00 in the plant timezone) in nanoseconds
+TIMESTAMP = 1646560800 * 10 ** 9
+
+
+@pytest.fixture
+def devices():
+    initialize_devices("main", {"annex": {"table": "energy_lmeasure_annex"}})
+    yield
+    initialize_devices("main")
+
+
+def test_parse_line():
+    point = parse_line("energy,device=main power=12.5,energy=3 {timestamp}".format(timestamp=TIMESTAMP))
+
+    assert point == LinePoint("energy", {"device": "main"}, {"power": 12.5, "energy": 3.0}, TIMESTAMP)
+
+
+def test_parse_line_escaped_and_quoted():
+    point = parse_line(r'energy\ meter,device=htm\ stallion,site=a\,b\=c power=1.5,note="on, \"ok\" x=1" 10')
+
+    assert point.measurement == "energy meter"
+    assert point.tags == {"device": "htm stallion", "site": "a,b=c"}
+    assert point.fields == {"power": 1.5, "note": 'on, "ok" x=1'}
+    assert point.timestamp == 10
+
+
+def test_parse_line_integer_and_boolean_fields():
+    point = parse_line("energy power=5i,energy=7u,online=t,tripped=FALSE,fault=false")
+
+    assert point.fields == {"power": 5, "energy": 7, "online": True, "tripped": False, "fault": False}
+    assert isinstance(point.fields["power"], int)
+    assert point.timestamp is None
+
+
+@pytest.mark.parametrize("line", ["energy", "energy power=1 2 3", ",device=main power=1", "energy power",
+                                  "energy,device power=1", "energy power=1 soon"])
+def test_parse_line_invalid(line):
+    with pytest.raises(ValueError):
+        parse_line(line)
+
+
+def test_point_to_row(devices):
+    server = IngestionServer(None, field_columns={"current": "avg_current"}, device_aliases={"htm": "annex"})
+
+    table, row = server.point_to_row(parse_line("energy,device=htm power=5i,current=2.5,online=t,unknown=1 {timestamp}"
+                                                .format(timestamp=TIMESTAMP)))
+
+    assert table is get_device("annex").table
+    assert (row["power"], row["avg_current"], row["energy"]) == (5.0, 2.5, None)
+    assert isinstance(row["power"], float)
+    assert row["timestamp"] == datetime(2022, 3, 6, 15, 30)
+    assert row["date"] == datetime(2022, 3, 6).date()
+
+
+def test_point_to_row_ignored_points(devices):
+    server = IngestionServer(None)
+
+    assert server.point_to_row(parse_line("cpu power=1")) is None
+    assert server.point_to_row(parse_line("energy,device=nowhere power=1")) is None
+    # Booleans and strings are not stored in the parameter columns
+    assert server.point_to_row(parse_line('energy power=true,energy="12"')) is None
+
+
+def test_point_to_row_without_timestamp(monkeypatch):
+    server = IngestionServer(None)
+    monkeypatch.setattr(ingestion_server.time, "time_ns", lambda: TIMESTAMP)
+
+    table, row = server.point_to_row(parse_line("energy power=1"))
+
+    assert table is ENERGY_LMEASURE_TABLE
+    assert row["timestamp"] == datetime(2022, 3, 6, 15, 30)
+
+
+@pytest.mark.parametrize("line", ["energy power=1 {timestamp}".format(timestamp=10 ** 30),
+                                  "energy power=1 {timestamp}".format(timestamp=-10 ** 30),
+                                  "energy power=1 soon",
+                                  "energy power=nan", "energy power=inf", "energy power=-Infinity",
+                                  "energy power=1,energy=NaN", "energy power"])
+def test_add_line_skips_invalid_points(line):
+    server = IngestionServer(None)
+
+    server.add_line(line.encode())
+
+    assert server.pending == {}
+    assert server.pending_count == 0
+
+
+def test_add_line(devices):
+    server = IngestionServer(None)
+
+    for line in [b"energy power=1\n", b"# comment\n", b"\n", b"energy,device=annex power=2\n", b"energy power=3"]:
+        server.add_line(line)
+
+    assert server.pending_count == 3
+    assert [row["power"] for row in server.pending[ENERGY_LMEASURE_TABLE]] == [1.0, 3.0]
+    assert [row["power"] for row in server.pending[get_device("annex").table]] == [2.0]
+
+
+def _count_rows(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_flush(engine, devices):
+    server = IngestionServer(engine)
+    for power in range(5):
+        server.add_line("energy power={power} {timestamp}".format(power=power, timestamp=TIMESTAMP).encode())
+
+    assert asyncio.run(server.flush()) == 5
+    assert (server.pending, server.pending_count) == ({}, 0)
+    assert _count_rows(engine, ENERGY_LMEASURE_TABLE) == 5
+    assert asyncio.run(server.flush()) == 0
+
+
+def test_flush_requeues_the_rows_of_a_failed_table(engine, devices):
+    server = IngestionServer(engine)
+    annex_table = get_device("annex").table
+    server.add_line("energy power=1 {timestamp}".format(timestamp=TIMESTAMP).encode())
+    server.add_line("energy,device=annex power=2 {timestamp}".format(timestamp=TIMESTAMP).encode())
+    server.add_line("energy,device=annex power=3 {timestamp}".format(timestamp=TIMESTAMP).encode())
+
+    # The table of the annex does not exist yet, its rows are kept without holding back the other table
+    assert asyncio.run(server.flush()) == 1
+    assert _count_rows(engine, ENERGY_LMEASURE_TABLE) == 1
+    assert list(server.pending) == [annex_table]
+    assert server.pending_count == 2
+
+    # The rows of the failed insert stay in front of the rows received after it
+    server.add_line("energy,device=annex power=4 {timestamp}".format(timestamp=TIMESTAMP).encode())
+    assert [row["power"] for row in server.pending[annex_table]] == [2.0, 3.0, 4.0]
+
+    annex_table.create(engine)
+    assert asyncio.run(server.flush()) == 3
+    assert (server.pending, server.pending_count) == ({}, 0)
+    assert _count_rows(engine, annex_table) == 3
+
+
+def test_flush_drops_the_failed_rows_beyond_max_pending(engine, devices):
+    server = IngestionServer(engine, flush_size=1)
+    for power in range(3):
+        server.add_line("energy,device=annex power={power}".format(power=power).encode())
+    server.max_pending = 2
+
+    assert asyncio.run(server.flush()) == 0
+    assert (server.pending, server.pending_count) == ({}, 0)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the rollups (the aggregation of the rows into the buckets and the background materializer)
+"""
+
+# Standard Imports
+import asyncio
+from datetime import datetime
+
+# External Imports
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+# User Imports
+from energy_services.database.rollups import (ROLLUP_MATERIALIZER, RollupMaterializer, aggregate_rows,
+                                              create_rollup_tables, initialize_rollups)
+from energy_services.database.table_models import (ENERGY_LMEASURE_TABLE, ENERGY_PARAMETER_COLUMNS, ROLLUP_STATE_TABLE,
+                                                   ROLLUP_TABLES)
+from energy_services.routers import core_energy_routes
+
+
+def reading(row_id: int, timestamp: datetime, **values):
+    """
+    Build an energy meter row as returned by the query of the materializer, the parameters not given are missing
+
+    :param row_id: The id of the row
+    :param timestamp: The timestamp of the reading
+    :param values: The values of the parameters
+
+    :return: The (id, timestamp, parameters...) row
+    :rtype: tuple
+    """
+
+    return (row_id, timestamp) + tuple(values.get(parameter) for parameter in ENERGY_PARAMETER_COLUMNS)
+
+
+def bucket(records: list, parameter: str, bucket_start: datetime):
+    """
+    Find the record of a parameter and bucket among the records of a rollup level
+    """
+
+    matches = [record for record in records
+               if record["parameter"] == parameter and record["bucket_start"] == bucket_start]
+    assert len(matches) == 1
+    return matches[0]
+
+
+def test_aggregate_rows_minimum_maximum_average_and_last():
+    rows = [reading(1, datetime(2022, 3, 6, 10, 0, 5), power=3.0),
+            reading(2, datetime(2022, 3, 6, 10, 0, 25), power=1.0),
+            reading(3, datetime(2022, 3, 6, 10, 0, 45), power=2.0)]
+
+    record = bucket(aggregate_rows(rows)["1m"], "power", datetime(2022, 3, 6, 10, 0))
+
+    assert record["minimum"] == 1.0
+    assert record["maximum"] == 3.0
+    assert record["total"] / record["count"] == pytest.approx(2.0)
+    assert (record["first_value"], record["first_id"]) == (3.0, 1)
+    assert (record["last_value"], record["last_id"]) == (2.0, 3)
+
+
+def test_aggregate_rows_energy_delta():
+    rows = [reading(1, datetime(2022, 3, 6, 10, 0), energy=100.0),
+            reading(2, datetime(2022, 3, 6, 10, 30), energy=102.5),
+            reading(3, datetime(2022, 3, 6, 10, 59), energy=105.0),
+            reading(4, datetime(2022, 3, 6, 11, 0), energy=106.0)]
+
+    rollups = aggregate_rows(rows)
+    hour = bucket(rollups["1h"], "energy", datetime(2022, 3, 6, 10))
+    day = bucket(rollups["1d"], "energy", datetime(2022, 3, 6))
+
+    assert hour["last_value"] - hour["first_value"] == pytest.approx(5.0)
+    assert day["last_value"] - day["first_value"] == pytest.approx(6.0)
+
+
+def test_aggregate_rows_bucket_edges():
+    rows = [reading(1, datetime(2022, 3, 6, 10, 14, 59, 999000), power=1.0),
+            reading(2, datetime(2022, 3, 6, 10, 15), power=2.0),
+            reading(3, datetime(2022, 3, 6, 23, 59, 59), power=3.0),
+            reading(4, datetime(2022, 3, 7), power=4.0)]
+
+    rollups = aggregate_rows(rows)
+
+    # The start of a bucket belongs to it, the millisecond before it to the previous one
+    assert bucket(rollups["1m"], "power", datetime(2022, 3, 6, 10, 14))["count"] == 1
+    assert bucket(rollups["1m"], "power", datetime(2022, 3, 6, 10, 15))["count"] == 1
+    assert bucket(rollups["15m"], "power", datetime(2022, 3, 6, 10))["last_id"] == 1
+    assert bucket(rollups["15m"], "power", datetime(2022, 3, 6, 10, 15))["first_id"] == 2
+    assert bucket(rollups["1h"], "power", datetime(2022, 3, 6, 10))["count"] == 2
+    assert bucket(rollups["1d"], "power", datetime(2022, 3, 6))["count"] == 3
+    assert bucket(rollups["1d"], "power", datetime(2022, 3, 7))["count"] == 1
+
+
+def test_aggregate_rows_missing_values():
+    rows = [reading(1, datetime(2022, 3, 6, 10, 0, 5), power=2.0),
+            reading(2, datetime(2022, 3, 6, 10, 0, 25)),
+            reading(3, datetime(2022, 3, 6, 10, 0, 45))]
+
+    records = aggregate_rows(rows)["1m"]
+    record = bucket(records, "power", datetime(2022, 3, 6, 10, 0))
+    missing = bucket(records, "energy", datetime(2022, 3, 6, 10, 0))
+
+    assert (record["total"], record["count"]) == (2.0, 1)
+    assert record["last_value"] is None
+    assert (missing["minimum"], missing["maximum"], missing["count"]) == (None, None, 0)
+
+
+def _insert_readings(engine, readings: list):
+    with engine.begin() as conn:
+        conn.execute(insert(ENERGY_LMEASURE_TABLE), [
+            {"id": row_id, "date": timestamp.date(), "timestamp": timestamp,
+             **dict(zip(ENERGY_PARAMETER_COLUMNS, values))}
+            for row_id, timestamp, *values in readings])
+
+
+def _rollup_row(engine, level: str, parameter: str, bucket_start: datetime):
+    table = ROLLUP_TABLES[level]
+    with engine.connect() as conn:
+        return conn.execute(select(table).where(table.c.parameter == parameter,
+                                                table.c.bucket_start == bucket_start)).one()
+
+
+@pytest.fixture
+def rollup_engine(engine):
+    with engine.begin() as conn:
+        create_rollup_tables(conn)
+    return engine
+
+
+def test_materializer_resumes_from_last_processed_id(rollup_engine):
+    _insert_readings(rollup_engine, [reading(row_id, datetime(2022, 3, 6, 10, 0, row_id), power=float(row_id))
+                                     for row_id in range(1, 6)])
+    materializer = RollupMaterializer(batch_size=2)
+
+    # Batches of 2 rows, until a batch is not full
+    assert asyncio.run(materializer.run_once(rollup_engine)) == 5
+    assert (materializer.last_id, materializer.last_timestamp) == (5, datetime(2022, 3, 6, 10, 0, 5))
+    assert asyncio.run(materializer.run_once(rollup_engine)) == 0
+
+    _insert_readings(rollup_engine, [reading(6, datetime(2022, 3, 6, 10, 0, 6), power=6.0)])
+    assert asyncio.run(materializer.run_once(rollup_engine)) == 1
+
+    with rollup_engine.connect() as conn:
+        state = conn.execute(select(ROLLUP_STATE_TABLE)).one()
+    assert (state.last_id, state.last_timestamp) == (6, datetime(2022, 3, 6, 10, 0, 6))
+
+    # Every row was counted once
+    assert _rollup_row(rollup_engine, "1m", "power", datetime(2022, 3, 6, 10)).count == 6
+
+
+def test_materializer_merges_buckets_with_upsert(rollup_engine):
+    _insert_readings(rollup_engine, [reading(1, datetime(2022, 3, 6, 10, 0, 10), power=5.0, energy=100.0),
+                                     reading(2, datetime(2022, 3, 6, 10, 0, 20), power=2.0, energy=101.0)])
+    materializer = RollupMaterializer()
+    asyncio.run(materializer.run_once(rollup_engine))
+
+    # The later rows land in the bucket already present
+    _insert_readings(rollup_engine, [reading(3, datetime(2022, 3, 6, 10, 0, 30), power=7.0, energy=102.0),
+                                     reading(4, datetime(2022, 3, 6, 10, 0, 40), power=4.0, energy=103.5)])
+    asyncio.run(materializer.run_once(rollup_engine))
+
+    power = _rollup_row(rollup_engine, "1m", "power", datetime(2022, 3, 6, 10))
+    assert (power.minimum, power.maximum, power.total, power.count) == (2.0, 7.0, 18.0, 4)
+    assert (power.first_value, power.first_id, power.last_value, power.last_id) == (5.0, 1, 4.0, 4)
+
+    energy = _rollup_row(rollup_engine, "1d", "energy", datetime(2022, 3, 6))
+    assert energy.last_value - energy.first_value == pytest.approx(3.5)
+
+
+def test_materializer_covers_the_dates_before_the_last_timestamp(rollup_engine):
+    _insert_readings(rollup_engine, [reading(1, datetime(2022, 3, 7, 0, 0, 10), power=1.0)])
+    materializer = RollupMaterializer()
+    materializer.enabled = True
+    asyncio.run(materializer.run_once(rollup_engine))
+
+    assert materializer.covers("2022-03-06")
+    assert not materializer.covers("2022-03-07")
+
+
+def test_initialize_rollups_rejects_unsupported_dialect():
+    with pytest.raises(ValueError):
+        initialize_rollups(True, dialect_name="postgresql")
+    assert not ROLLUP_MATERIALIZER.enabled
+
+
+def test_materializer_retries_the_creation_of_the_tables(engine, monkeypatch):
+    calls = []
+
+    def create_tables(conn):
+        calls.append(conn)
+        if len(calls) == 1:
+            raise RuntimeError("database not reachable")
+        create_rollup_tables(conn)
+
+    monkeypatch.setattr("energy_services.database.rollups.create_rollup_tables", create_tables)
+    materializer = RollupMaterializer(interval=0.01)
+    materializer.enabled = True
+
+    async def run():
+        materializer.start(engine)
+        while materializer.last_id is None:
+            await asyncio.sleep(0.01)
+        await materializer.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(calls) == 2
+
+
+def test_rollup_route_unavailable_when_disabled():
+    app = FastAPI()
+    app.include_router(core_energy_routes.ROUTER)
+    response = TestClient(app).get("/energy_meter/energy_core/read_parameter_rollup",
+                                   params={"parameter": "power", "start_date": "2022-03-06", "end_date": "2022-03-07"})
+
+    assert response.status_code == 503